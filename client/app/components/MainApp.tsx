@@ -19,6 +19,13 @@ interface Message {
   role: "user" | "assistant";
   timestamp: Date;
   sources?: string[];
+  citations?: (Citation | null)[];
+}
+
+interface Citation {
+  file: string | null;
+  page: number | null;
+  section: string | null;
 }
 
 interface UploadedFile {
@@ -33,6 +40,7 @@ export default function MainApp() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputMessage, setInputMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [isStreaming, setIsStreaming] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = () => {
@@ -43,6 +51,18 @@ export default function MainApp() {
     scrollToBottom();
   }, [messages]);
 
+  // /upload queues an ingest job; poll it until the new index is live.
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const response = await fetch(`http://localhost:5000/jobs/${jobId}`);
+      const job = await response.json();
+      if (!response.ok || job.status === "succeeded" || job.status === "failed") {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleFileUpload = async (file: File) => {
     if (file && file.type === "application/pdf") {
       setIsUploading(true);
@@ -56,7 +76,12 @@ export default function MainApp() {
         });
 
         if (response.ok) {
-          const result = await response.json();
+          const { job_id } = await response.json();
+          const result = await waitForJob(job_id);
+          if (result.status !== "succeeded") {
+            alert(`Upload failed: ${result.error ?? "processing did not finish"}`);
+            return;
+          }
           setUploadedFile({
             name: file.name,
             size: (file.size / 1024 / 1024).toFixed(2) + " MB",
@@ -120,8 +145,15 @@ export default function MainApp() {
     setInputMessage("");
     setIsLoading(true);
 
+    const assistantId = (Date.now() + 1).toString();
+    const updateAssistant = (update: (message: Message) => Message) => {
+      setMessages((prev) =>
+        prev.map((message) => (message.id === assistantId ? update(message) : message))
+      );
+    };
+
     try {
-      const response = await fetch("http://localhost:5000/query", {
+      const response = await fetch("http://localhost:5000/query/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -129,20 +161,53 @@ export default function MainApp() {
         body: JSON.stringify({ query: inputMessage }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        const assistantMessage: Message = {
-          id: (Date.now() + 1).toString(),
-          content: data.answer,
-          role: "assistant",
-          timestamp: new Date(),
-          sources: data.sources,
-        };
-        setMessages((prev) => [...prev, assistantMessage]);
+      if (response.ok && response.body) {
+        // Server-Sent Events: "sources" first, then "token"s, then "done" or "error".
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split("\n\n");
+          buffer = events.pop() ?? "";
+          for (const raw of events) {
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? "{}");
+            if (event === "sources") {
+              setIsStreaming(true);
+              setMessages((prev) => [
+                ...prev,
+                {
+                  id: assistantId,
+                  content: "",
+                  role: "assistant",
+                  timestamp: new Date(),
+                  sources: data.sources,
+                  citations: data.citations ?? undefined,
+                },
+              ]);
+            } else if (event === "token") {
+              updateAssistant((message) => ({ ...message, content: message.content + data.token }));
+            } else if (event === "error") {
+              const errorMessage: Message = {
+                id: assistantId,
+                content: `Error: ${data.error}`,
+                role: "assistant",
+                timestamp: new Date(),
+              };
+              setMessages((prev) => [
+                ...prev.filter((message) => message.id !== assistantId),
+                errorMessage,
+              ]);
+            }
+          }
+        }
       } else {
         const error = await response.json();
         const errorMessage: Message = {
-          id: (Date.now() + 1).toString(),
+          id: assistantId,
           content: `Error: ${error.error}`,
           role: "assistant",
           timestamp: new Date(),
@@ -151,7 +216,7 @@ export default function MainApp() {
       }
     } catch (error) {
       const errorMessage: Message = {
-        id: (Date.now() + 1).toString(),
+        id: (Date.now() + 2).toString(),
         content: "Failed to get response. Please try again.",
         role: "assistant",
         timestamp: new Date(),
@@ -159,6 +224,7 @@ export default function MainApp() {
       setMessages((prev) => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setIsStreaming(false);
     }
   };
 
@@ -327,21 +393,31 @@ export default function MainApp() {
                           <div className="space-y-1">
                             {message.sources
                               .slice(0, 2)
-                              .map((source, index) => (
-                                <div
-                                  key={index}
-                                  className="text-xs text-gray-500 bg-gray-800 rounded px-2 py-1"
-                                >
-                                  {source.substring(0, 150)}...
-                                </div>
-                              ))}
+                              .map((source, index) => {
+                                const citation = message.citations?.[index];
+                                return (
+                                  <div
+                                    key={index}
+                                    className="text-xs text-gray-500 bg-gray-800 rounded px-2 py-1"
+                                  >
+                                    {citation?.file && (
+                                      <p className="text-gray-400 mb-1">
+                                        {citation.file}
+                                        {citation.page ? `, p. ${citation.page}` : ""}
+                                        {citation.section ? ` · ${citation.section}` : ""}
+                                      </p>
+                                    )}
+                                    {source.substring(0, 150)}...
+                                  </div>
+                                );
+                              })}
                           </div>
                         </div>
                       )}
                     </div>
                   </div>
                 ))}
-                {isLoading && (
+                {isLoading && !isStreaming && (
                   <div className="flex justify-start">
                     <div className="max-w-[80%] rounded-2xl p-4 bg-gray-900 text-white border border-gray-800">
                       <div className="flex items-center gap-2 mb-2">
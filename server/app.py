@@ -1,109 +1,721 @@
+import json
+import multiprocessing
 import os
-from flask import Flask, request, jsonify
+import re
+import shutil
+import tempfile
+import threading
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
+from werkzeug.utils import secure_filename
 
-from config import UPLOAD_DIR, VECTORSTORE_PATH, CACHE_PATH
-from rag.document_processor import process_and_store_documents
-from rag.chain import initialize_rag_chain, create_rag_pipeline
-from utils.cache import load_cache, save_cache, get_cache_key
+from config import (
+    UPLOAD_DIR, STAGING_DIR, INDEX_DIR, EMBEDDING_MODEL, EMBEDDING, JOBS_DB_PATH, BM25_COMPAT, EXTRACTION,
+    CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, SEMANTIC_CACHE, BATCH_QUERY,
+    RERANK, ANN, METRICS, STARTUP, COLLECTIONS, DEDUP, SHARDING
+)
+# LangChain, FAISS and the embedding model are imported by the functions that
+# need them, so the server binds its port and answers /health straight away
+# while ``load_rag_chain`` brings them up in the background.
+from rag import metrics
+from utils.cache import QueryCache
 from utils.file_utils import clear_upload_directory
+from utils.jobs import JobRunner, JobStore
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"])
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
+CORS(app, origins=CORS_ORIGINS)
 
 
 rag_chain = None
 text_chunks = []
 vectorstore = None
+state_lock = threading.Lock()
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
+query_cache = QueryCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_PATH)
+semantic_cache = None
+jobs = JobStore(JOBS_DB_PATH)
+job_runner = JobRunner(jobs)
+
+# "starting" until load_rag_chain runs, then "loading", "ready" or "failed".
+startup = {"state": "starting", "error": None, "load_seconds": None}
+loaded = threading.Event()
+_load_started = threading.Lock()
+
+def _embeddings():
+    from rag.embeddings import get_embeddings
+    return get_embeddings(EMBEDDING_MODEL, EMBEDDING["batch_size"], EMBEDDING["threads"])
+
+def preload_models():
+    """Import the RAG stack, load the embedding model weights and open the index, without running either.
+
+    Called at import with ``STARTUP["preload_models"]`` so a pre-forking
+    server's workers inherit the weights and the index (see
+    ``rag.chain.preload_index``) instead of each loading its own. No
+    inference runs here: thread pools started before a fork do not survive it.
+    """
+    from rag.chain import preload_index
+    preload_index(_embeddings())
+
+def new_semantic_cache(embeddings):
+    """A ``SemanticCache`` configured from ``SEMANTIC_CACHE``, or ``None`` if it is disabled."""
+    if not SEMANTIC_CACHE["enabled"]:
+        return None
+    from rag.chain import query_embedder_for
+    from rag.semantic_cache import SemanticCache
+    # Shares question vectors with retrieval, so a cache miss costs no second forward pass.
+    return SemanticCache(
+        query_embedder_for(embeddings).embed,
+        threshold=SEMANTIC_CACHE["threshold"],
+        max_entries=SEMANTIC_CACHE["max_entries"]
+    )
+
+def load_rag_chain():
+    """Load the embedding model and the index, warm the model up, then mark the server ready."""
+    global rag_chain, vectorstore, text_chunks, semantic_cache
+    startup["state"] = "loading"
+    start = time.perf_counter()
+    try:
+        from rag.chain import initialize_rag_chain
+
+        embeddings = _embeddings()
+        embeddings.embed_query("warm up")  # first inference allocates buffers and thread pools
+        if RERANK["enabled"]:
+            from rag.reranker import get_reranker
+            get_reranker(RERANK["model"], RERANK["batch_size"], RERANK["cache_size"]).warm_up()
+        semantic_cache = new_semantic_cache(embeddings)
+        chain, store, chunks = initialize_rag_chain()
+        with state_lock:
+            rag_chain, vectorstore, text_chunks = chain, store, chunks
+        startup.update(state="ready", load_seconds=round(time.perf_counter() - start, 3))
+        print(f"Server ready in {startup['load_seconds']}s")
+    except Exception as e:
+        import traceback
+        print(f"Error during startup: {traceback.format_exc()}")
+        startup.update(state="failed", error=str(e))
+    finally:
+        loaded.set()
+
+def start_background_load():
+    """Start ``load_rag_chain`` on a daemon thread; later calls do nothing."""
+    if _load_started.acquire(blocking=False):
+        threading.Thread(target=load_rag_chain, name="rag-load", daemon=True).start()
+
+def use_chain(chain, store=None, chunks=()):
+    """Serve ``chain`` instead of loading one from INDEX_DIR, e.g. one built with a stand-in LLM."""
     global rag_chain, vectorstore, text_chunks
-    
+    _load_started.acquire(blocking=False)
+    with state_lock:
+        rag_chain, vectorstore, text_chunks = chain, store, chunks
+    startup.update(state="ready", load_seconds=0.0)
+    loaded.set()
+
+def chain_unavailable():
+    """The error response for a query that arrives before there is a chain to answer it."""
+    if not loaded.is_set():
+        return jsonify({"error": "Server is still loading. Please retry shortly."}), 503, {"Retry-After": "1"}
+    return jsonify({"error": "RAG chain not initialized. Please upload documents first."}), 400
+
+if STARTUP["preload_models"] and multiprocessing.current_process().name == "MainProcess":  # not in extraction workers
+    preload_models()
+
+_collections = None
+_collections_lock = threading.Lock()
+
+def collection_manager():
+    """The process-wide ``CollectionManager`` over ``COLLECTIONS["dir"]``, created on first use."""
+    global _collections
+    with _collections_lock:
+        if _collections is None:
+            from rag.collection_manager import CollectionManager
+            _collections = CollectionManager(COLLECTIONS["dir"], load_collection,
+                                             int(COLLECTIONS["memory_budget_mb"] * 2**20))
+        return _collections
+
+def load_collection(collection):
+    """Loader for ``CollectionManager``: open the collection's bundle and build a chain over it."""
+    from rag.index_store import load_bundle
+    embeddings = _embeddings()
+    store, chunks, bm25, _ = load_bundle(collection.index_dir, embeddings)
+    return serve_collection(collection, store, chunks, bm25, embeddings)
+
+def serve_collection(collection, store, chunks, bm25, embeddings, report=None):
+    """A ``LoadedCollection`` over an opened index, with the collection's own answer caches.
+
+    After an ingest, ``report`` invalidates the cached answers it made stale
+    before the collection is served again.
+    """
+    from rag.chain import create_rag_pipeline
+    from rag.collection_manager import LoadedCollection
+    from rag.index_store import ChunkMetadata
+
+    chain = create_rag_pipeline(store, chunks, embeddings, os.environ.get("GROQ_API_KEY"), bm25=bm25,
+                                documents=collection.manifest()["documents"],
+                                chunk_metadata=ChunkMetadata.open(collection.index_dir), sharded=False)
+    loaded_collection = LoadedCollection(
+        chain, QueryCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, collection.cache_path), new_semantic_cache(embeddings)
+    )
+    if report is not None:
+        invalidate_cached(report, loaded_collection.caches)
+    return loaded_collection
+
+def _cache_metric(name):
+    """Scrape-time values of one cache statistic, by cache."""
+    def collect():
+        exact = query_cache.stats()
+        values = {("exact",): {"hits": exact["hits"], "misses": exact["misses"], "entries": exact["entries"],
+                               "hit_ratio": exact["hit_ratio"]}[name]}
+        if semantic_cache:
+            semantic = semantic_cache.stats()
+            hits = semantic["exact_hits"] + semantic["semantic_hits"]
+            values[("semantic",)] = {"hits": hits, "misses": semantic["lookups"] - hits,
+                                     "entries": semantic["entries"], "hit_ratio": semantic["hit_rate"]}[name]
+        return values
+    return collect
+
+def _index_metric(name):
+    """Scrape-time value from the current bundle manifest; nothing before startup or the first ingest."""
+    def collect():
+        if not loaded.is_set():
+            return {}
+        from rag.index_store import bundle_exists, read_manifest
+        if not bundle_exists(INDEX_DIR):
+            return {}
+        manifest = read_manifest(INDEX_DIR)
+        return {(): {
+            "chunks": manifest["num_chunks"],
+            "documents": len(manifest["documents"]),
+            "version": manifest["index_version"],
+            "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+        }[name]}
+    return collect
+
+metrics.Counter("rag_cache_hits_total", "Query cache hits.", ("cache",), callback=_cache_metric("hits"))
+metrics.Counter("rag_cache_misses_total", "Query cache misses.", ("cache",), callback=_cache_metric("misses"))
+metrics.Gauge("rag_cache_hit_ratio", "Query cache hits over lookups since startup.", ("cache",),
+              callback=_cache_metric("hit_ratio"))
+metrics.Gauge("rag_cache_entries", "Answers held in each query cache.", ("cache",), callback=_cache_metric("entries"))
+metrics.Gauge("rag_index_chunks", "Chunks in the index bundle.", callback=_index_metric("chunks"))
+metrics.Gauge("rag_index_documents", "Documents in the index bundle.", callback=_index_metric("documents"))
+metrics.Gauge("rag_index_version", "index_version of the index bundle.", callback=_index_metric("version"))
+metrics.Gauge("rag_index_bytes", "On-disk size of the index bundle.", callback=_index_metric("bytes"))
+def _query_embedder_stats():
+    chain = rag_chain
+    embedder = chain.retriever.query_embedder if chain is not None else None
+    return embedder.stats() if embedder is not None else None
+
+def _query_embedder_metric(*fields):
+    """Scrape-time counter from ``QueryEmbedder.stats``; ``fields`` map to the ``result`` label, if any."""
+    def collect():
+        stats = _query_embedder_stats()
+        if stats is None:
+            return {}
+        if len(fields) == 1:
+            return {(): stats[fields[0]]}
+        return {(field,): stats[field] for field in fields}
+    return collect
+
+metrics.Counter("rag_query_embedding_lookups_total", "Question vector lookups, by hits and misses.", ("result",),
+                callback=_query_embedder_metric("hits", "misses"))
+metrics.Counter("rag_query_embedding_passes_total", "Forward passes run for question vectors.",
+                callback=_query_embedder_metric("forward_passes"))
+metrics.Counter("rag_query_embedding_texts_total", "Questions embedded, over all forward passes.",
+                callback=_query_embedder_metric("embedded"))
+def _collection_metric(name):
+    """Scrape-time value from ``CollectionManager.stats``; nothing before the first collection request."""
+    def collect():
+        if _collections is None:
+            return {}
+        stats = _collections.stats()
+        return {(): len(stats["resident"]) if name == "resident" else stats[name]}
+    return collect
+
+metrics.Gauge("rag_collections_resident", "Collections loaded in memory.", callback=_collection_metric("resident"))
+metrics.Gauge("rag_collections_resident_bytes", "Counted footprint of the loaded collections.",
+              callback=_collection_metric("resident_bytes"))
+metrics.Counter("rag_collection_loads_total", "Collections loaded, after an ingest or on a query.",
+                callback=_collection_metric("loads"))
+metrics.Counter("rag_collection_evictions_total", "Collections dropped to stay under the memory budget.",
+                callback=_collection_metric("evictions"))
+metrics.Gauge("rag_initialized", "1 once a RAG chain is loaded.", callback=lambda: {(): int(rag_chain is not None)})
+metrics.Gauge("rag_ready", "1 once startup loading has finished successfully.",
+              callback=lambda: {(): int(startup["state"] == "ready")})
+
+# Routes whose responses may carry a Server-Timing header (see METRICS["timing_header"]).
+TIMED_ROUTES = {"/query", "/query/batch", "/collections/<name>/query"}
+
+@app.before_request
+def start_request_metrics():
+    start_background_load()  # for WSGI servers that import the app without running __main__
+    g.metrics_token = metrics.start_request()
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    seconds = time.perf_counter() - g.request_start
+    timings = metrics.end_request(g.pop("metrics_token"))
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe_request(route, request.method, response.status_code, seconds)
+    if METRICS["timing_header"] and route in TIMED_ROUTES:
+        response.headers["Server-Timing"] = metrics.server_timing(timings, seconds)
+    return response
+
+def ingest_staged(progress, staging_dir, upload_dir, index_dir, incremental, sharded=False):
+    """Move a staged upload into ``upload_dir`` and index it into ``index_dir``.
+
+    Returns ``process_and_store_documents``'s ``(vectorstore, embeddings, chunks, bm25, report)``.
+    """
+    from rag.document_processor import process_and_store_documents
+
+    os.makedirs(upload_dir, exist_ok=True)
+    if not incremental:
+        clear_upload_directory(upload_dir)
+    for file_name in os.listdir(staging_dir):
+        shutil.move(os.path.join(staging_dir, file_name), os.path.join(upload_dir, file_name))
+    shutil.rmtree(staging_dir)
+
+    return process_and_store_documents(
+        upload_dir, index_dir, bm25_compat=BM25_COMPAT, embedding_model=EMBEDDING_MODEL,
+        incremental=incremental, extraction=EXTRACTION, embedding=EMBEDDING, progress=progress, ann=ANN,
+        dedup=DEDUP, sharded=sharded
+    )
+
+def invalidate_cached(report, caches):
+    """Drop the ``(exact, semantic)`` cached answers an ingest's ``report`` made stale.
+
+    Removed chunks stale only the answers that cited them, but new chunks can
+    change the answer to any question (including ones answered "no
+    information"), so an ingest that added or updated documents drops them all.
+    """
+    exact, semantic = caches
+    if report["stale_sources"] is None or report["added"] or report["updated"]:
+        exact.bump_version()
+        if semantic:
+            semantic.clear()
+    else:
+        invalidated = exact.invalidate_sources(report["stale_sources"])
+        if semantic:
+            invalidated += semantic.invalidate_sources(report["stale_sources"])
+        print(f"Invalidated {invalidated} cached responses")
+
+def ingest_result(successful_uploads, chunks, report):
+    return {
+        "message": f"{successful_uploads} files uploaded and processed successfully.",
+        "chunks_created": len(chunks),
+        "documents_added": len(report["added"]),
+        "documents_updated": len(report["updated"]),
+        "documents_removed": len(report["removed"]),
+        "documents_unchanged": len(report["unchanged"]),
+        "embedding": report["embedding"],
+        "dedup": report["dedup"]
+    }
+
+def run_ingest(progress, staging_dir, incremental, successful_uploads):
+    """Background ingest job. Queries keep using the old chain until the swap at the end."""
+    global rag_chain, vectorstore, text_chunks
+    from rag.chain import create_rag_pipeline
+    from rag.index_store import ChunkMetadata, read_manifest
+
+    # The startup load must not swap in the old index after this job's new one.
+    loaded.wait()
+    new_vectorstore, embeddings, new_text_chunks, bm25, report = ingest_staged(
+        progress, staging_dir, UPLOAD_DIR, INDEX_DIR, incremental, sharded=SHARDING["shards"] > 1
+    )
+
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    new_chain = create_rag_pipeline(new_vectorstore, new_text_chunks, embeddings, groq_api_key, bm25=bm25,
+                                    documents=read_manifest(INDEX_DIR)["documents"],
+                                    chunk_metadata=ChunkMetadata.open(INDEX_DIR))
+    with state_lock:
+        rag_chain, vectorstore, text_chunks = new_chain, new_vectorstore, new_text_chunks
+
+    invalidate_cached(report, (query_cache, semantic_cache))
+    return ingest_result(successful_uploads, new_text_chunks, report)
+
+def run_collection_ingest(progress, name, staging_dir, incremental, successful_uploads):
+    """Background ingest job for one collection, which is loaded (and made most recently used) at the end."""
+    collection = collection_manager().collection(name)
+    store, embeddings, chunks, bm25, report = ingest_staged(
+        progress, staging_dir, collection.upload_dir, collection.index_dir, incremental
+    )
+    collection_manager().replace(
+        name, lambda collection: serve_collection(collection, store, chunks, bm25, embeddings, report)
+    )
+    return ingest_result(successful_uploads, chunks, report)
+
+def stage_upload():
+    """Save the request's PDFs to a new staging directory.
+
+    Returns ``(staging_dir, number of files)``, or ``(None, error response)``.
+    Files wait there until their job runs, so a queued upload never touches
+    an upload directory while another ingest is using it.
+    """
     if 'files' not in request.files:
-        return jsonify({"error": "No files part in the request."}), 400
+        return None, (jsonify({"error": "No files part in the request."}), 400)
     
     files = request.files.getlist('files')
     if not files or all(file.filename == '' for file in files):
-        return jsonify({"error": "No files selected for uploading."}), 400
-
-    clear_upload_directory(UPLOAD_DIR)
+        return None, (jsonify({"error": "No files selected for uploading."}), 400)
 
+    staging_dir = tempfile.mkdtemp(dir=STAGING_DIR)
     successful_uploads = 0
     for file in files:
         if file and file.filename.endswith('.pdf'):
-            filename = file.filename
-            file.save(os.path.join(UPLOAD_DIR, filename))
+            filename = secure_filename(file.filename)
+            file.save(os.path.join(staging_dir, filename))
             successful_uploads += 1
     
     if successful_uploads == 0:
-        return jsonify({"error": "No valid PDF files uploaded."}), 400
+        shutil.rmtree(staging_dir)
+        return None, (jsonify({"error": "No valid PDF files uploaded."}), 400)
+    return staging_dir, successful_uploads
+
+def accepted(job_id, successful_uploads):
+    return jsonify({
+        "message": f"{successful_uploads} files accepted for processing.",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
 
+@app.route('/upload', methods=['POST'])
+def upload_files():
+    staging_dir, staged = stage_upload()
+    if staging_dir is None:
+        return staged
+
+    # Incremental uploads add to the existing document set; anything else replaces it.
+    incremental = request.form.get('mode') == 'incremental'
+    return accepted(job_runner.submit(run_ingest, staging_dir, incremental, staged), staged)
+
+@app.route('/collections', methods=['GET'])
+def list_collections():
+    manager = collection_manager()
+    listed = []
+    for name in manager.names():
+        collection = manager.collection(name)
+        manifest = collection.manifest()
+        listed.append({
+            "name": name,
+            "chunks": manifest["num_chunks"],
+            "documents": len(manifest["documents"]),
+            "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+            "resident": manager.is_resident(name)
+        })
+    return jsonify({"collections": listed, **manager.stats()})
+
+@app.route('/collections/<name>/upload', methods=['POST'])
+def upload_collection_files(name):
+    """Like ``/upload``, into the collection ``name``, which is created by its first upload."""
     try:
-        vectorstore, embeddings, text_chunks = process_and_store_documents(UPLOAD_DIR, VECTORSTORE_PATH)
-        
- 
-        groq_api_key = os.environ.get("GROQ_API_KEY")
-        rag_chain = create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key)
-        
-        if os.path.exists(CACHE_PATH):
-            os.remove(CACHE_PATH)
-        
-        return jsonify({
-            "message": f"{successful_uploads} files uploaded and processed successfully.",
-            "chunks_created": len(text_chunks)
-        }), 200
-    except Exception as e:
-        import traceback
-        print(f"Error during upload: {traceback.format_exc()}")
-        return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+        collection_manager().collection(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    staging_dir, staged = stage_upload()
+    if staging_dir is None:
+        return staged
+
+    incremental = request.form.get('mode') == 'incremental'
+    return accepted(job_runner.submit(run_collection_ingest, name, staging_dir, incremental, staged), staged)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
+
+def retrieval_options(data, chain=None):
+    """Per-request retriever overrides from the request body; raises ``ValueError`` if invalid.
+
+    ``chain`` is the one the request will query, the default chain if not given.
+    """
+    options = {}
+    for name in ("k", "candidates"):
+        value = data.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= RERANK["max_candidates"]:
+            raise ValueError(f"{name} must be an integer between 1 and {RERANK['max_candidates']}.")
+        options[name] = value
+    for name in ("nprobe", "ef_search"):
+        value = data.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 4096:
+            raise ValueError(f"{name} must be an integer between 1 and 4096.")
+        options[name] = value
+    if data.get("rerank") is not None:
+        if not isinstance(data["rerank"], bool):
+            raise ValueError("rerank must be true or false.")
+        options["rerank"] = data["rerank"]
+    if data.get("latency_budget_ms") is not None:
+        budget = data["latency_budget_ms"]
+        if isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget < 0:
+            raise ValueError("latency_budget_ms must be a non-negative number.")
+        options["latency_budget"] = budget / 1000
+    if data.get("filter") is not None:
+        chunk_filter = document_filter(data["filter"], chain)
+        if chunk_filter:
+            options["filter"] = chunk_filter
+    return options
+
+def document_filter(value, chain=None):
+    """Validate ``{"documents": [...], "sections": [...]}``; see ``ChunkMetadata.select`` for matching."""
+    if not isinstance(value, dict) or not set(value) <= {"documents", "sections"}:
+        raise ValueError('filter must be an object with "documents" and/or "sections" lists.')
+    chunk_filter = {}
+    for name in ("documents", "sections"):
+        patterns = value.get(name)
+        if patterns is None:
+            continue
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        if not isinstance(patterns, list) or not all(isinstance(p, str) and p for p in patterns):
+            raise ValueError(f"filter.{name} must be a list of non-empty strings.")
+        if patterns:
+            chunk_filter[name] = patterns
+    chain = chain or rag_chain
+    if chunk_filter and chain is not None and chain.retriever.chunk_metadata is None:
+        raise ValueError("This index has no document metadata to filter on. Re-upload the documents.")
+    return chunk_filter
+
+# ``caches`` below is an ``(exact, semantic)`` pair; by default the default index's.
+def lookup_cached(query_text, options=None, caches=None):
+    # Answers retrieved with per-request options are cached under their own
+    # key and never matched semantically.
+    exact, semantic = caches or (query_cache, semantic_cache)
+    with metrics.stage("cache_lookup"):
+        if options:
+            return exact.get(f"{query_text}\0{json.dumps(options, sort_keys=True)}")
+        cached = exact.get(query_text)
+        if cached is None and semantic:
+            cached = semantic.lookup(query_text)
+        return cached
+
+def cache_versions(caches=None):
+    exact, semantic = caches or (query_cache, semantic_cache)
+    return exact.version, semantic.version if semantic else None
+
+def store_cached(query_text, response, versions, options=None, caches=None):
+    exact, semantic = caches or (query_cache, semantic_cache)
+    if options:
+        exact.set(f"{query_text}\0{json.dumps(options, sort_keys=True)}", response, version=versions[0])
+        return
+    exact.set(query_text, response, version=versions[0])
+    if semantic:
+        semantic.add(query_text, response, version=versions[1])
 
 @app.route('/query', methods=['POST'])
 def query_endpoint():
-    if not rag_chain:
-        return jsonify({"error": "RAG chain not initialized. Please upload documents first."}), 400
-        
+    chain = rag_chain
+    if not chain:
+        return chain_unavailable()
+    return answer_request(chain)
+
+@app.route('/collections/<name>/query', methods=['POST'])
+def collection_query_endpoint(name):
+    """Like ``/query``, against the collection ``name``, which is loaded first if it isn't resident."""
+    try:
+        collection = collection_manager().get(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        import traceback
+        print(f"Error loading collection {name}: {traceback.format_exc()}")
+        return jsonify({"error": f"Could not load collection {name}: {str(e)}"}), 500
+    if collection is None:
+        return jsonify({"error": f"Collection {name} has no documents. Upload some first."}), 404
+    return answer_request(collection.chain, collection.caches)
+
+def answer_request(chain, caches=None):
+    """Answer the ``/query`` request body with ``chain``, through ``caches``."""
+    from rag.chain import answer_query, citations, with_retrieval_options
+
     data = request.get_json()
     query_text = data.get('query')
     if not query_text:
         return jsonify({"error": "Query text is required."}), 400
+    try:
+        options = retrieval_options(data, chain)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
   
-    cache = load_cache()
-    cache_key = get_cache_key(query_text)
-    if cache_key in cache:
-        print("Returning cached response")
-        return jsonify(cache[cache_key])
+    cached = lookup_cached(query_text, options, caches)
+    if cached is not None:
+        return jsonify(cached)
         
+    versions = cache_versions(caches)
     try:
-        result = rag_chain({"query": query_text})
+        answer, docs, usage = answer_query(with_retrieval_options(chain, options), query_text)
         response = {
-            "answer": result["result"],
-            "sources": [doc.page_content for doc in result["source_documents"]]
+            "answer": answer,
+            "sources": [doc.page_content for doc in docs],
+            "citations": citations(docs)
         }
         
    
-        cache[cache_key] = response
-        save_cache(cache)
+        store_cached(query_text, response, versions, options, caches)
         
-        return jsonify(response)
+        return jsonify({**response, "usage": usage})
     except Exception as e:
         import traceback
         print(f"Error during query: {traceback.format_exc()}")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+@app.route('/query/batch', methods=['POST'])
+def query_batch_endpoint():
+    """Answer ``{"queries": [...], "fanout": n}`` with one result and timing per query.
+
+    Only the exact-match cache is consulted, so retrieval stays one batch;
+    new answers are written to both caches.
+    """
+    from rag.chain import answer_batch, with_retrieval_options
+    chain = rag_chain
+    if not chain:
+        return chain_unavailable()
+
+    data = request.get_json()
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of question strings."}), 400
+    if len(queries) > BATCH_QUERY["max_queries"]:
+        return jsonify({"error": f"At most {BATCH_QUERY['max_queries']} queries per batch."}), 400
+    try:
+        fanout = int(data.get('fanout', BATCH_QUERY["fanout"]))
+    except (TypeError, ValueError):
+        return jsonify({"error": "fanout must be an integer."}), 400
+    fanout = max(1, min(fanout, BATCH_QUERY["max_fanout"]))
+    try:
+        options = retrieval_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = time.perf_counter()
+    answers = {}
+    for query_text in dict.fromkeys(queries):
+        cached = lookup_cached(query_text, options) if options else query_cache.get(query_text)
+        if cached is not None:
+            answers[query_text] = {**cached, "cached": True}
+
+    pending = [q for q in dict.fromkeys(queries) if q not in answers]
+    versions = cache_versions()
+    timings = {}
+    if pending:
+        try:
+            results, timings = answer_batch(with_retrieval_options(chain, options), pending, fanout)
+        except Exception as e:
+            import traceback
+            print(f"Error during batch query: {traceback.format_exc()}")
+            return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+        for query_text, result in zip(pending, results):
+            if "error" not in result:
+                store_cached(query_text, {key: result[key] for key in ("answer", "sources", "citations")},
+                             versions, options)
+            answers[query_text] = {**result, "cached": False}
+
+    timings.update(total_seconds=round(time.perf_counter() - start, 4), fanout=fanout,
+                   queries=len(queries), cache_hits=sum(answers[q]["cached"] for q in queries))
+    return jsonify({
+        "results": [{"query": query_text, **answers[query_text]} for query_text in queries],
+        "timings": timings
+    })
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Word-sized pieces (with their trailing whitespace) for replaying cached answers.
+REPLAY_PIECES = re.compile(r"\s*\S+\s*")
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream_endpoint():
+    """Server-Sent Events: a ``sources`` event, ``token`` events, then ``done`` (or ``error``)."""
+    from rag.chain import citations, stream_rag_answer, with_retrieval_options
+    chain = rag_chain
+    if not chain:
+        return chain_unavailable()
+
+    data = request.get_json()
+    query_text = data.get('query')
+    if not query_text:
+        return jsonify({"error": "Query text is required."}), 400
+    try:
+        options = retrieval_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    chain = with_retrieval_options(chain, options)
+
+    cached = lookup_cached(query_text, options)
+    versions = cache_versions()
+
+    def generate():
+        if cached is not None:
+            yield sse("sources", {"sources": cached["sources"], "citations": cached.get("citations")})
+            for piece in REPLAY_PIECES.findall(cached["answer"]):
+                yield sse("token", {"token": piece})
+            yield sse("done", {"cached": True})
+            return
+
+        try:
+            docs, tokens, usage = stream_rag_answer(chain, query_text)
+            sources = {"sources": [doc.page_content for doc in docs], "citations": citations(docs)}
+            yield sse("sources", sources)
+            answer = []
+            for token in tokens:
+                answer.append(token)
+                yield sse("token", {"token": token})
+        except Exception as e:
+            import traceback
+            print(f"Error during streamed query: {traceback.format_exc()}")
+            yield sse("error", {"error": f"An error occurred: {str(e)}"})
+            return
+
+        # Only complete answers are cached; a client that disconnects never gets here.
+        store_cached(query_text, {"answer": "".join(answer), **sources}, versions, options)
+        yield sse("done", {"cached": False, "usage": usage})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """200 once the model and index have loaded (with or without documents), else 503."""
+    return jsonify(startup), 200 if startup["state"] == "ready" else 503
+
 @app.route('/health', methods=['GET'])
 def health_check():
+    """Liveness and status; answers while the model and index are still loading."""
+    vectorstore_exists = None
+    if loaded.is_set():
+        from rag.index_store import bundle_exists
+        vectorstore_exists = bundle_exists(INDEX_DIR)
     return jsonify({
         "status": "healthy",
+        "ready": startup["state"] == "ready",
+        "startup": startup,
         "rag_initialized": rag_chain is not None,
-        "vectorstore_exists": os.path.exists(VECTORSTORE_PATH),
-        "chunks_loaded": len(text_chunks)
+        "vectorstore_exists": vectorstore_exists,
+        "chunks_loaded": len(text_chunks),
+        "cache": query_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "reranker": rag_chain.retriever.reranker.stats() if rag_chain and rag_chain.retriever.reranker else None,
+        "query_embedder": _query_embedder_stats(),
+        "collections": _collections.stats() if _collections is not None else None
     })
 
 if __name__ == '__main__':
-    initialize_rag_chain()
+    # The debug reloader re-runs this file in a child process; only that child serves, so only it loads.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_load()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
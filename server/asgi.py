@@ -0,0 +1,301 @@
+"""ASGI serving mode: ``uvicorn asgi:application --port 5000`` from ``server/``.
+
+``POST /query`` and ``POST /query/stream`` are served natively on the event
+loop: retrieval and cache lookups run in a bounded thread pool and the Groq
+call is awaited over a shared connection pool, so a request waiting on the
+LLM holds no thread. Every other route (uploads, jobs, health) is the Flask
+app from ``app.py`` behind ``WsgiToAsgi``, sharing its chain, caches and jobs.
+Startup completes at once; the model and index load in the background (see
+``app.load_rag_chain``) and queries get a 503 until they have.
+
+Admission is limited by ``ASYNC_SERVING``: at most ``max_in_flight`` queries
+run at once, up to ``max_waiting`` more queue for ``max_wait_seconds``, and
+anything beyond that gets a 503 with ``Retry-After``.
+"""
+import asyncio
+import contextvars
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+from config import ASYNC_SERVING, METRICS
+from rag import metrics
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionLimiter:
+    """Async context manager bounding concurrent queries, with a bounded wait queue."""
+
+    def __init__(self, max_in_flight, max_waiting, max_wait_seconds):
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def __aenter__(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded() from None
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected}
+
+
+limiter = AdmissionLimiter(
+    ASYNC_SERVING["max_in_flight"], ASYNC_SERVING["max_waiting"], ASYNC_SERVING["max_wait_seconds"]
+)
+wsgi_app = WsgiToAsgi(flask_app.app)
+
+
+async def run_sync(fn, *args):
+    """Run blocking work (embedding, FAISS, SQLite) on the bounded default executor."""
+    context = contextvars.copy_context()  # keep per-request stage timings
+    return await asyncio.get_running_loop().run_in_executor(None, context.run, fn, *args)
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return None
+
+
+def response_headers(scope, content_type, extra=()):
+    headers = [(b"content-type", content_type.encode())]
+    origin = dict(scope["headers"]).get(b"origin")
+    if origin is not None and origin.decode("latin-1") in flask_app.CORS_ORIGINS:
+        headers += [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+    return headers + list(extra)
+
+
+async def send_json(scope, send, payload, status=200, extra_headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": response_headers(scope, "application/json", extra_headers),
+    })
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+
+async def send_overloaded(scope, send):
+    await send_json(scope, send, {"error": "Server is busy. Please retry shortly."}, status=503,
+                    extra_headers=[(b"retry-after", b"1")])
+
+
+async def read_query(scope, receive, send):
+    """Return ``(chain, query_text, options)``, or ``(None, None, None)`` after sending a 400 or 503."""
+    from rag.chain import with_retrieval_options
+    chain = flask_app.rag_chain
+    data = await read_json(receive)
+    if not chain:
+        if not flask_app.loaded.is_set():
+            await send_json(scope, send, {"error": "Server is still loading. Please retry shortly."}, 503,
+                            extra_headers=[(b"retry-after", b"1")])
+        else:
+            await send_json(scope, send, {"error": "RAG chain not initialized. Please upload documents first."},
+                            400)
+        return None, None, None
+    query_text = data.get("query") if isinstance(data, dict) else None
+    if not query_text:
+        await send_json(scope, send, {"error": "Query text is required."}, 400)
+        return None, None, None
+    try:
+        options = flask_app.retrieval_options(data)
+    except ValueError as e:
+        await send_json(scope, send, {"error": str(e)}, 400)
+        return None, None, None
+    return with_retrieval_options(chain, options), query_text, options
+
+
+async def query(scope, receive, send):
+    from rag.chain import aanswer_query, citations
+    chain, query_text, options = await read_query(scope, receive, send)
+    if chain is None:
+        return
+
+    cached = await run_sync(flask_app.lookup_cached, query_text, options)
+    if cached is not None:
+        await send_json(scope, send, cached)
+        return
+
+    versions = flask_app.cache_versions()
+    try:
+        async with limiter:
+            answer, docs, usage = await aanswer_query(chain, query_text)
+    except Overloaded:
+        await send_overloaded(scope, send)
+        return
+    except Exception as e:
+        import traceback
+        print(f"Error during query: {traceback.format_exc()}")
+        await send_json(scope, send, {"error": f"An error occurred: {str(e)}"}, 500)
+        return
+
+    response = {
+        "answer": answer,
+        "sources": [doc.page_content for doc in docs],
+        "citations": citations(docs)
+    }
+    await run_sync(flask_app.store_cached, query_text, response, versions, options)
+    await send_json(scope, send, {**response, "usage": usage})
+
+
+async def query_stream(scope, receive, send):
+    from rag.chain import astream_rag_answer, citations
+    chain, query_text, options = await read_query(scope, receive, send)
+    if chain is None:
+        return
+
+    cached = await run_sync(flask_app.lookup_cached, query_text, options)
+    versions = flask_app.cache_versions()
+
+    async def start():
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": response_headers(scope, "text/event-stream",
+                                        [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]),
+        })
+
+    async def emit(event, data):
+        await send({"type": "http.response.body", "body": flask_app.sse(event, data).encode(), "more_body": True})
+
+    async def finish():
+        await send({"type": "http.response.body", "body": b""})
+
+    async def produce():
+        if cached is not None:
+            await start()
+            await emit("sources", {"sources": cached["sources"], "citations": cached.get("citations")})
+            for piece in flask_app.REPLAY_PIECES.findall(cached["answer"]):
+                await emit("token", {"token": piece})
+            await emit("done", {"cached": True})
+            await finish()
+            return
+
+        try:
+            async with limiter:
+                await start()
+                try:
+                    docs, tokens, usage = await astream_rag_answer(chain, query_text)
+                    sources = {"sources": [doc.page_content for doc in docs], "citations": citations(docs)}
+                    await emit("sources", sources)
+                    answer = []
+                    async for token in tokens:
+                        answer.append(token)
+                        await emit("token", {"token": token})
+                except Exception as e:
+                    import traceback
+                    print(f"Error during streamed query: {traceback.format_exc()}")
+                    await emit("error", {"error": f"An error occurred: {str(e)}"})
+                    await finish()
+                    return
+        except Overloaded:
+            await send_overloaded(scope, send)
+            return
+
+        await run_sync(flask_app.store_cached, query_text, {"answer": "".join(answer), **sources},
+                       versions, options)
+        await emit("done", {"cached": False, "usage": usage})
+        await finish()
+
+    # Stop generating (and release the slot) as soon as the client goes away.
+    task = asyncio.ensure_future(produce())
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        task.cancel()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await task
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+    finally:
+        watcher.cancel()
+
+
+ASYNC_ROUTES = {
+    "/query": query,
+    "/query/stream": query_stream,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(
+                ThreadPoolExecutor(max_workers=ASYNC_SERVING["cpu_workers"], thread_name_prefix="rag-cpu")
+            )
+            flask_app.start_background_load()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if "rag.chain" in sys.modules:
+                await sys.modules["rag.chain"].close_async_http_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def timed(route, scope, receive, send):
+    """Run a native route, recording its latency and status like ``app.record_request_metrics``."""
+    path = scope["path"]
+    token = metrics.start_request()
+    start = time.perf_counter()
+    status = 500
+
+    async def send_timed(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            if METRICS["timing_header"] and path in flask_app.TIMED_ROUTES:
+                timing = metrics.server_timing(metrics.current_timings(), time.perf_counter() - start)
+                message = {**message, "headers": list(message["headers"]) + [(b"server-timing", timing.encode())]}
+        await send(message)
+
+    try:
+        await route(scope, receive, send_timed)
+    finally:
+        metrics.end_request(token)
+        metrics.observe_request(path, scope["method"], status, time.perf_counter() - start)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ASYNC_ROUTES:
+        await timed(ASYNC_ROUTES[scope["path"]], scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,101 @@
+"""Recall and latency of each ANN index kind against the exact flat index.
+
+Uses the chunk vectors of a real index bundle (``--bundle index``, read from
+its ``vectors.f32``) or a synthetic corpus. Recall@k is the share of the flat
+index's top-k rows each option also returns; latency is per single query.
+Bundle queries are stored chunk vectors with a little noise added, so no
+embedding model is needed.
+
+    python -m benchmarks.bench_ann --chunks 100000
+    python -m benchmarks.bench_ann --bundle index --nprobe 4 16 64 --ef-search 32 128
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.common import HashingEmbeddings, synthetic_chunks, synthetic_queries
+from rag.ann import build_index, search_params
+from rag.index_store import open_vectors
+
+
+def load_corpus(args):
+    if args.bundle:
+        vectors = open_vectors(args.bundle)
+        if vectors is None:
+            raise SystemExit("--bundle has no vectors.f32 to read the exact vectors from; re-upload its documents.")
+        vectors = np.array(vectors)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+        queries = queries + rng.normal(0, 0.02, queries.shape).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        return vectors, queries
+    embeddings = HashingEmbeddings()
+    vectors = np.asarray(embeddings.embed_documents(synthetic_chunks(args.chunks)), dtype=np.float32)
+    queries = np.asarray(embeddings.embed_documents(synthetic_queries(args.queries)), dtype=np.float32)
+    return vectors, queries
+
+
+def index_megabytes(index):
+    with tempfile.NamedTemporaryFile() as f:
+        faiss.write_index(index, f.name)
+        return os.path.getsize(f.name) / 1e6
+
+
+def measure(index, queries, truth, k, params):
+    rows = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rows[i] = found[0]
+    recall = np.mean([len(set(rows[i]) & set(truth[i])) / k for i in range(len(queries))])
+    return recall, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bundle", help="index bundle directory to take chunk vectors from")
+    parser.add_argument("--chunks", type=int, default=50000, help="synthetic corpus size without --bundle")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6, help="rows fetched per query (retriever fetches 2 * k)")
+    parser.add_argument("--kinds", nargs="+", default=["ivf", "hnsw", "ivfpq", "sq"])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--train-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # per-query latency, as in serving
+    vectors, queries = load_corpus(args)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{args.k}\n")
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, args.k)
+    _, p50, p95 = measure(flat, queries, truth, args.k, None)
+    print(f"{'index':<22} {'setting':<14} {'build s':>8} {'MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    print(f"{'Flat':<22} {'exact':<14} {0.0:>8.2f} {index_megabytes(flat):>8.1f} {p50:>8.3f} {p95:>8.3f} {1.0:>7.3f}")
+
+    for kind in args.kinds:
+        start = time.perf_counter()
+        index, info = build_index(vectors, kind, {"train_size": args.train_size})
+        build_seconds = time.perf_counter() - start
+        megabytes = index_megabytes(index)
+        if kind == "hnsw":
+            settings = [(f"efSearch={ef}", search_params(index, ef_search=ef)) for ef in args.ef_search]
+        elif kind == "sq":
+            settings = [("exhaustive", None)]
+        else:
+            settings = [(f"nprobe={n}", search_params(index, nprobe=n)) for n in args.nprobe]
+        for label, params in settings:
+            recall, p50, p95 = measure(index, queries, truth, args.k, params)
+            print(f"{info['description']:<22} {label:<14} {build_seconds:>8.2f} {megabytes:>8.1f} "
+                  f"{p50:>8.3f} {p95:>8.3f} {recall:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Memory each process serving the same index bundle adds, and how much of it is shared.
+
+Builds a bundle of random unit vectors for each index kind, then starts
+``--processes`` fresh interpreters that each ``load_bundle`` it and run
+queries over every row. With all of them still alive, each reports how its
+``/proc/self/smaps_rollup`` grew over its post-import baseline:
+
+- ``RSS MB``: resident pages, counting shared ones in full.
+- ``private MB``: pages only this process maps, i.e. its own copy.
+- ``PSS MB``: resident pages with shared ones split between their users.
+
+Memory-mapped parts of a bundle (a flat index's ``vectors.f32``, IVF
+inverted lists) sit in the page cache once, so their private growth stays
+near zero however many processes serve them; kinds FAISS reads into memory
+(HNSW, SQ) cost every process ``index MB`` of private memory. Linux only.
+
+    python -m benchmarks.bench_bundle_memory --chunks 300000 --kinds flat ivf hnsw sq
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import synthetic_chunks, write_results
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SMAPS_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def memory_mb():
+    """``{"rss", "pss", "private"}`` of this process in MB, from ``smaps_rollup``."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in SMAPS_FIELDS:
+                fields[name] = int(value.split()[0]) / 1024
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "private": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def run_child(bundle_dir, queries):
+    """Child process: load and query the bundle, then report its growth when the parent asks."""
+    import faiss
+    from rag.index_store import load_bundle
+    from rag.ann import search
+
+    faiss.omp_set_num_threads(1)
+    baseline = memory_mb()
+    vectorstore, _, _, manifest = load_bundle(bundle_dir, None)
+    index = vectorstore.index
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(queries):
+        query = rng.normal(size=(1, manifest["dimension"])).astype(np.float32)
+        search(index, query / np.linalg.norm(query), 10, nprobe=index.ntotal, ef_search=64)
+    print("ready", flush=True)
+    sys.stdin.readline()
+    print(json.dumps({name: value - baseline[name] for name, value in memory_mb().items()}), flush=True)
+    sys.stdin.readline()
+
+
+def write_random_bundle(bundle_dir, kind, num_chunks, dim):
+    from rag.ann import build_index
+    from rag.bm25 import SparseBM25
+    from rag.index_store import write_bundle
+
+    vectors = np.random.default_rng(0).normal(size=(num_chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = synthetic_chunks(num_chunks, words_per_chunk=8)
+    index, info = build_index(vectors, kind, {"min_vectors": 0})
+    manifest = write_bundle(bundle_dir, index, texts, SparseBM25(texts), "random", ann=info, vectors=vectors)
+    return sum(entry["bytes"] for name, entry in manifest["files"].items()
+               if name in ("faiss.index", "vectors.f32")) / 1e6
+
+
+def measure(bundle_dir, processes, queries):
+    """Each child's growth, measured while all of them have the bundle loaded."""
+    command = [sys.executable, "-m", "benchmarks.bench_bundle_memory", "--child", bundle_dir,
+               "--queries", str(queries)]
+    children = [subprocess.Popen(command, cwd=SERVER_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                for _ in range(processes)]
+    try:
+        for child in children:
+            if child.stdout.readline().strip() != "ready":
+                raise SystemExit(f"Child exited with code {child.wait()} before loading the bundle.")
+        results = []
+        for child in children:
+            child.stdin.write("measure\n")
+            child.stdin.flush()
+            results.append(json.loads(child.stdout.readline()))
+        return results
+    finally:
+        for child in children:
+            child.stdin.close()
+            child.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=300000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--kinds", nargs="+", default=["flat", "ivf", "hnsw", "sq"])
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=20, help="queries each process runs before measuring")
+    parser.add_argument("--json", help="write machine-readable results here")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child, args.queries)
+        return
+
+    rows = []
+    print(f"{args.chunks} vectors x {args.dim} dims, {args.processes} processes; MB grown per process\n")
+    print(f"{'kind':<6} {'index MB':>9} {'RSS MB':>8} {'private MB':>11} {'PSS MB':>8}")
+    for kind in args.kinds:
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_dir = os.path.join(tmp, "index")
+            index_mb = write_random_bundle(bundle_dir, kind, args.chunks, args.dim)
+            results = measure(bundle_dir, args.processes, args.queries)
+        row = {"kind": kind, "index_mb": round(index_mb, 1),
+               **{name: round(float(np.mean([result[name] for result in results])), 1)
+                  for name in ("rss", "private", "pss")}}
+        rows.append(row)
+        print(f"{kind:<6} {row['index_mb']:>9.1f} {row['rss']:>8.1f} {row['private']:>11.1f} {row['pss']:>8.1f}")
+
+    if args.json:
+        write_results(args.json, "bundle_memory", vars(args), rows)
+
+
+if __name__ == "__main__":
+    main()
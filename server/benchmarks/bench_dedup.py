@@ -0,0 +1,142 @@
+"""Ingest-time deduplication over a corpus of re-issued, boilerplate-heavy HR policies.
+
+Each policy is issued ``--versions`` times, each issue changing ``--edits``
+words per page, and every page carries a running header and a ``Page N of
+M`` footer; every issue ends with the same legal disclaimer page. The corpus
+is ingested with ``config.DEDUP`` off and on (``HashingEmbeddings``, so no
+model weights), reporting chunks stored, the compaction ratio, index size,
+ingest time, retrieval latency and how many of the top ``k`` results are
+distinct passages rather than copies of one (within ``DISTINCT_DISTANCE``
+SimHash bits). ``--max-distance`` above 0 merges near-duplicates as well as
+exact ones.
+
+    python -m benchmarks.bench_dedup --files 20 --versions 3 --max-distance 3 --json dedup.json
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import (VOCAB, HashingEmbeddings, latency_summary, synthetic_pages, synthetic_queries,
+                               write_pdf, write_results)
+from config import DEDUP
+from rag.dedup import DuplicateIndex, fingerprint
+from rag.document_processor import process_and_store_documents
+from rag.index_store import load_bundle, read_manifest
+from rag.retrievers import HybridRetriever
+
+DISCLAIMER = [
+    "This policy does not form part of any contract of employment and may be amended at any time.",
+    "Where local law grants employees greater rights, local law prevails over this policy.",
+    "Questions about this policy should be directed to your HR business partner.",
+] * 8
+DISTINCT_DISTANCE = 3
+
+
+def write_corpus(upload_dir, files, pages, versions, edits):
+    os.makedirs(upload_dir, exist_ok=True)
+    for policy in range(files):
+        base = synthetic_pages(pages, seed=policy)
+        rng = random.Random(policy)
+        for version in range(1, versions + 1):
+            issue = [list(page) for page in base]
+            if version > 1:
+                for lines in issue:
+                    for _ in range(edits):
+                        line = rng.randrange(1, len(lines))
+                        words = lines[line].split()
+                        words[rng.randrange(len(words))] = rng.choice(VOCAB)
+                        lines[line] = " ".join(words)
+            issue.append(list(DISCLAIMER))
+            total = len(issue)
+            write_pdf(os.path.join(upload_dir, f"policy_{policy:03d}_v{version}.pdf"), [
+                [f"ACME Corp Policy {policy} - Issue {version}", "Confidential - internal use only"]
+                + lines[1:] + [f"Page {number} of {total}"]
+                for number, lines in enumerate(issue, start=1)
+            ])
+
+
+def distinct(texts, max_distance):
+    """How many of ``texts`` aren't exact or near copies of an earlier one."""
+    seen = DuplicateIndex(max_distance)
+    count = 0
+    for text in texts:
+        simhash, digest, numbers = fingerprint(text)
+        if seen.find(simhash, digest, numbers) is None:
+            count += 1
+        seen.add(simhash, digest, numbers)
+    return count
+
+
+def query_stats(index_dir, queries, k):
+    embeddings = HashingEmbeddings()
+    vectorstore, chunks, bm25, _ = load_bundle(index_dir, embeddings)
+    retriever = HybridRetriever(vectorstore, chunks, embeddings, bm25=bm25, chunk_ids=np.arange(len(chunks)), k=k)
+    seconds, unique = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.get_relevant_documents(query)
+        seconds.append(time.perf_counter() - start)
+        unique.append(distinct([doc.page_content for doc in docs], DISTINCT_DISTANCE))
+    return latency_summary(seconds), float(np.mean(unique))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20, help="policies")
+    parser.add_argument("--pages", type=int, default=8, help="pages per policy, before the disclaimer")
+    parser.add_argument("--versions", type=int, default=3, help="issues of each policy")
+    parser.add_argument("--edits", type=int, default=1, help="words changed per page in each re-issue")
+    parser.add_argument("--max-distance", type=int, default=DEDUP["max_distance"],
+                        help="SimHash bits near-duplicates may differ in; 0 merges exact copies only")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--json", help="write machine-readable results here")
+    args = parser.parse_args()
+
+    queries = synthetic_queries(args.queries)
+    rows = []
+    print(f"{'dedup':<6} {'seen':>6} {'stored':>7} {'exact':>6} {'near':>5} {'ratio':>6} {'index MB':>9} "
+          f"{'ingest s':>9} {'p50 ms':>7} {'distinct@k':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        upload_dir = os.path.join(tmp, "uploads")
+        write_corpus(upload_dir, args.files, args.pages, args.versions, args.edits)
+        for enabled in (False, True):
+            index_dir = os.path.join(tmp, f"index_{int(enabled)}")
+            start = time.perf_counter()
+            _, _, chunks, _, report = process_and_store_documents(
+                upload_dir, index_dir, embedding_model="hashing", extraction={"workers": args.workers},
+                embeddings=HashingEmbeddings(), dedup={**DEDUP, "enabled": True, "max_distance": args.max_distance} if enabled else None
+            )
+            seconds = time.perf_counter() - start
+            index_bytes = sum(entry["bytes"] for entry in read_manifest(index_dir)["files"].values())
+            latency, unique = query_stats(index_dir, queries, args.k)
+            dedup = report["dedup"] or {"chunks_seen": len(chunks), "chunks_stored": len(chunks),
+                                        "exact_duplicates": 0, "near_duplicates": 0, "compaction_ratio": 1.0}
+            row = {
+                "dedup": enabled,
+                "chunks_seen": dedup["chunks_seen"],
+                "chunks_stored": dedup["chunks_stored"],
+                "exact_duplicates": dedup["exact_duplicates"],
+                "near_duplicates": dedup["near_duplicates"],
+                "compaction_ratio": dedup["compaction_ratio"],
+                "index_mb": round(index_bytes / 1e6, 2),
+                "ingest_seconds": round(seconds, 3),
+                **latency,
+                "distinct_at_k": round(unique, 2),
+            }
+            rows.append(row)
+            print(f"{'on' if enabled else 'off':<6} {row['chunks_seen']:>6} {row['chunks_stored']:>7} "
+                  f"{row['exact_duplicates']:>6} {row['near_duplicates']:>5} {row['compaction_ratio']:>6.2f} "
+                  f"{row['index_mb']:>9.2f} {seconds:>9.2f} {row['p50_ms']:>7.2f} {unique:>11.2f}")
+
+    if args.json:
+        write_results(args.json, "dedup", vars(args), rows)
+
+
+if __name__ == "__main__":
+    main()
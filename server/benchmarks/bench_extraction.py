@@ -0,0 +1,57 @@
+"""PDF extraction throughput against worker count, over a synthetic corpus.
+
+Runs ingest's extraction and splitting (``iter_document_chunks``) without
+embedding, so the numbers are those of the production path.
+
+    python -m benchmarks.bench_extraction --files 32 --pages 40 --workers 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import write_synthetic_corpus
+from rag.document_processor import iter_document_chunks
+from rag.extraction import ExtractionError
+
+
+def extract(corpus, file_names, workers, pages_per_task):
+    """Chunks split from ``file_names``, as ingest extracts them."""
+    chunks = 0
+    extraction = {"workers": workers, "pages_per_task": pages_per_task}
+    for file_name, document in iter_document_chunks(corpus, file_names, extraction):
+        try:
+            chunks += sum(1 for _ in document)
+        except ExtractionError as e:
+            print(f"Error processing {file_name}: {str(e)}")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus:
+        write_synthetic_corpus(corpus, args.files, args.pages)
+        file_names = sorted(os.listdir(corpus))
+        total_pages = args.files * args.pages
+
+        print(f"{args.files} files x {args.pages} pages")
+        print(f"{'workers':>8} {'seconds':>8} {'pages/s':>9} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            chunks = extract(corpus, file_names, workers, args.pages_per_task)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {total_pages / elapsed:>9.0f} {baseline / elapsed:>7.1f}x"
+                  f"  ({chunks} chunks)")
+
+
+if __name__ == "__main__":
+    main()
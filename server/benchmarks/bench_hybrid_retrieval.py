@@ -0,0 +1,82 @@
+"""Per-query latency of HybridRetriever against chunk count.
+
+Compares the original ranking loop (one BM25 pass and one list.index scan per
+candidate) with the precomputed-score path, for both fusion modes.
+
+    python -m benchmarks.bench_hybrid_retrieval --sizes 1000 10000 50000
+"""
+import argparse
+import time
+
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores.faiss import FAISS
+
+from benchmarks.common import HashingEmbeddings, synthetic_chunks, synthetic_queries
+from rag.retrievers import HybridRetriever
+
+
+def legacy_rank(retriever, query, k=3):
+    """The pre-optimisation ranking loop, kept verbatim for comparison."""
+    vector_docs = retriever.vectorstore.similarity_search(query, k=k*2)
+    bm25_scores = retriever.bm25.get_scores(query.split())
+    bm25_indices = np.argsort(bm25_scores)[::-1][:k*2]
+
+    all_docs = []
+    doc_set = set()
+    for doc in vector_docs:
+        if doc.page_content not in doc_set:
+            all_docs.append((doc, 'vector'))
+            doc_set.add(doc.page_content)
+    for idx in bm25_indices:
+        if idx < len(retriever.texts) and retriever.texts[idx] not in doc_set:
+            all_docs.append((Document(page_content=retriever.texts[idx]), 'bm25'))
+            doc_set.add(retriever.texts[idx])
+
+    scored_docs = []
+    for doc, source in all_docs:
+        vector_score = 1.0 if source == 'vector' else 0.5
+        bm25_score = 0.5
+        if doc.page_content in retriever.texts:
+            text_idx = retriever.texts.index(doc.page_content)
+            raw = retriever.bm25.get_scores(query.split())
+            lo, hi = np.min(raw), np.max(raw)
+            if hi - lo > 1e-8:
+                bm25_score = (raw[text_idx] - lo) / (hi - lo)
+        scored_docs.append((doc, 0.7 * vector_score + 0.3 * bm25_score))
+    scored_docs.sort(key=lambda x: x[1], reverse=True)
+    return [doc for doc, _ in scored_docs[:k]]
+
+
+def time_per_query(fn, queries):
+    fn(queries[0])
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    embeddings = HashingEmbeddings()
+    queries = synthetic_queries(args.queries)
+
+    print(f"{'chunks':>8} {'legacy ms':>10} {'weighted ms':>12} {'rrf ms':>8} {'speedup':>8}")
+    for size in args.sizes:
+        texts = synthetic_chunks(size)
+        vectorstore = FAISS.from_texts(texts, embedding=embeddings)
+        weighted = HybridRetriever(vectorstore, texts, embeddings)
+        rrf = HybridRetriever(vectorstore, texts, embeddings, fusion="rrf")
+
+        legacy_ms = time_per_query(lambda q: legacy_rank(weighted, q), queries)
+        weighted_ms = time_per_query(weighted.get_relevant_documents, queries)
+        rrf_ms = time_per_query(rrf.get_relevant_documents, queries)
+        print(f"{size:>8} {legacy_ms:>10.2f} {weighted_ms:>12.2f} {rrf_ms:>8.2f} {legacy_ms / weighted_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Ingest throughput and per-stage time over synthetic HR-policy PDF corpora.
+
+Runs the full ``process_and_store_documents`` pipeline (extraction pool,
+splitting, embedding, FAISS and BM25 build, bundle write) on each corpus in
+``benchmarks.common.CORPORA``. Embedding uses ``HashingEmbeddings``, so the
+embed stage measures the pipeline around the model, not MiniLM itself.
+
+    python -m benchmarks.bench_ingest --corpora small medium large --json ingest.json
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import CORPORA, HashingEmbeddings, write_results, write_synthetic_corpus
+from rag.document_processor import process_and_store_documents
+from rag.index_store import read_manifest
+from rag.metrics import INGEST_STAGE_SECONDS
+
+STAGES = ("extract", "split", "embed", "index", "bm25", "persist")
+
+
+def stage_seconds(before, after):
+    return {f"{stage}_seconds": round(after.get((stage,), (0, 0.0))[1] - before.get((stage,), (0, 0.0))[1], 4)
+            for stage in STAGES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpora", nargs="+", default=["small", "medium"], choices=sorted(CORPORA))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--ann", default="flat", help="index kind, see rag.ann")
+    parser.add_argument("--json", help="write machine-readable results here")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'corpus':<8} {'files':>6} {'pages':>6} {'chunks':>7} {'total s':>8} {'pages/s':>8} {'chunks/s':>9} "
+          + " ".join(f"{stage + ' s':>9}" for stage in STAGES))
+    for name in args.corpora:
+        files, pages = CORPORA[name]
+        with tempfile.TemporaryDirectory() as tmp:
+            upload_dir = os.path.join(tmp, "uploads")
+            index_dir = os.path.join(tmp, "index")
+            write_synthetic_corpus(upload_dir, files, pages)
+            before = INGEST_STAGE_SECONDS.totals()
+            start = time.perf_counter()
+            _, _, chunks, _, _ = process_and_store_documents(
+                upload_dir, index_dir, embedding_model="hashing", extraction={"workers": args.workers},
+                ann={"kind": args.ann}, embeddings=HashingEmbeddings()
+            )
+            seconds = time.perf_counter() - start
+            index_bytes = sum(entry["bytes"] for entry in read_manifest(index_dir)["files"].values())
+        row = {
+            "case": name,
+            "files": files,
+            "pages": files * pages,
+            "chunks": len(chunks),
+            "seconds": round(seconds, 3),
+            "pages_per_sec": round(files * pages / seconds, 1),
+            "chunks_per_sec": round(len(chunks) / seconds, 1),
+            "index_mb": round(index_bytes / 1e6, 2),
+            **stage_seconds(before, INGEST_STAGE_SECONDS.totals()),
+        }
+        rows.append(row)
+        print(f"{name:<8} {files:>6} {row['pages']:>6} {row['chunks']:>7} {seconds:>8.2f} {row['pages_per_sec']:>8.1f} "
+              f"{row['chunks_per_sec']:>9.1f} " + " ".join(f"{row[stage + '_seconds']:>9.3f}" for stage in STAGES))
+
+    if args.json:
+        write_results(args.json, "ingest", vars(args), rows)
+
+
+if __name__ == "__main__":
+    main()
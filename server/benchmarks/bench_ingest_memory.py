@@ -0,0 +1,132 @@
+"""Peak memory of ingest against corpus size, over synthetic HR-policy PDFs.
+
+Each case is ingested twice, each time in a fresh child interpreter with
+``HashingEmbeddings`` (no model weights), and the child reports how far its
+resident set grew over the post-import baseline:
+
+- ``stream MB``: extracting, splitting and embedding every chunk into a
+  ``BundleWriter`` (``stream_documents``), without building the indexes.
+  This is the pipeline's working set and should stay flat as the corpus grows.
+- ``ingest MB``: the whole ``process_and_store_documents``, which also builds
+  the ANN index (if any) and BM25 in memory, one after the other, before
+  writing each out. It grows with ``index MB``, the size of those two on
+  disk, not with the text. A flat index is the ``vectors.f32`` the stream
+  phase already wrote, so it adds nothing.
+
+Cases are ``benchmarks.common.CORPORA`` names or ``FILESxPAGES``, e.g.
+``1x2000`` for one very long PDF. Extraction workers are separate processes
+and aren't counted.
+
+    python -m benchmarks.bench_ingest_memory --cases small medium large 1x2000 --json ingest_memory.json
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import CORPORA, write_results, write_synthetic_corpus
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ("stream", "ingest")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_phase(workdir, phase, workers):
+    """Child process: run one phase over ``workdir/uploads`` and print the measurements as JSON."""
+    from benchmarks.common import HashingEmbeddings
+    from rag.document_processor import hash_file, process_and_store_documents, stream_documents
+    from rag.index_store import BundleWriter, read_manifest
+
+    upload_dir = os.path.join(workdir, "uploads")
+    index_dir = os.path.join(workdir, "index")
+    embeddings = HashingEmbeddings()
+    baseline = peak_rss_mb()
+    measured = {}
+    if phase == "stream":
+        file_names = sorted(os.listdir(upload_dir))
+        hashes = {name: hash_file(os.path.join(upload_dir, name)) for name in file_names}
+        writer = BundleWriter(index_dir)
+        try:
+            stream_documents(writer, upload_dir, file_names, hashes, embeddings, "hashing", {"workers": workers})
+            measured["chunks"] = len(writer)
+        finally:
+            writer.abort()
+    else:
+        _, _, chunks, _, _ = process_and_store_documents(
+            upload_dir, index_dir, embedding_model="hashing", extraction={"workers": workers}, embeddings=embeddings
+        )
+        files = read_manifest(index_dir)["files"]
+        measured.update(
+            chunks=len(chunks),
+            text_mb=files["chunks.bin"]["bytes"] / 1e6,
+            index_mb=sum(entry["bytes"] for name, entry in files.items()
+                         if name == "faiss.index" or name.startswith("bm25")) / 1e6,
+        )
+    measured["growth_mb"] = peak_rss_mb() - baseline
+    print(json.dumps(measured))
+
+
+def parse_case(case):
+    if case in CORPORA:
+        return CORPORA[case]
+    match = re.fullmatch(r"(\d+)x(\d+)", case)
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected one of {', '.join(sorted(CORPORA))} or FILESxPAGES, got {case!r}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def measure(workdir, phase, workers):
+    command = [sys.executable, "-m", "benchmarks.bench_ingest_memory", "--child", workdir, "--phase", phase,
+               "--workers", str(workers)]
+    output = subprocess.run(command, cwd=SERVER_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", default=["small", "medium", "large"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--json", help="write machine-readable results here")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--phase", choices=PHASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_phase(args.child, args.phase, args.workers)
+        return
+
+    shapes = {case: parse_case(case) for case in args.cases}
+    rows = []
+    print(f"{'case':<10} {'pages':>6} {'chunks':>7} {'text MB':>8} {'index MB':>9} {'stream MB':>10} {'ingest MB':>10}")
+    for case, (files, pages) in shapes.items():
+        with tempfile.TemporaryDirectory() as workdir:
+            write_synthetic_corpus(os.path.join(workdir, "uploads"), files, pages)
+            stream = measure(workdir, "stream", args.workers)
+            ingest = measure(workdir, "ingest", args.workers)
+        row = {
+            "case": case,
+            "files": files,
+            "pages": files * pages,
+            "chunks": ingest["chunks"],
+            "text_mb": round(ingest["text_mb"], 2),
+            "index_mb": round(ingest["index_mb"], 2),
+            "stream_mb": round(stream["growth_mb"], 1),
+            "ingest_mb": round(ingest["growth_mb"], 1),
+        }
+        rows.append(row)
+        print(f"{case:<10} {row['pages']:>6} {row['chunks']:>7} {row['text_mb']:>8.2f} {row['index_mb']:>9.2f} "
+              f"{row['stream_mb']:>10.1f} {row['ingest_mb']:>10.1f}")
+
+    if args.json:
+        write_results(args.json, "ingest_memory", vars(args), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Concurrent /query load against the ASGI server, with a local stand-in for Groq.
+
+Ingests a synthetic PDF corpus (``benchmarks.common.CORPORA``) with
+``HashingEmbeddings`` into a scratch directory and starts ``uvicorn`` in a
+child process serving it through ``create_rag_pipeline(..., llm=FakeChatModel)``,
+so no Groq key or model download is needed. For each ``--concurrency``
+level, that many closed-loop clients send distinct questions to ``/query``
+for ``--duration`` seconds; p50/p95/p99 latency, QPS and non-200 responses
+are reported. Client and server share this machine's cores; use ``--url``
+to drive a server started elsewhere instead.
+
+    python -m benchmarks.bench_load --corpus medium --concurrency 1 8 32 --llm-latency 0.5 --json load.json
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import (
+    CORPORA, FakeChatModel, HashingEmbeddings, latency_summary, synthetic_queries, write_results,
+    write_synthetic_corpus
+)
+
+
+def serve(args):
+    """Child process: serve the index in ``args.serve`` with ``FakeChatModel`` on ``args.port``."""
+    os.chdir(args.serve)  # the config's index, cache and job paths are relative to the working directory
+    import uvicorn
+
+    import app as flask_app
+    import asgi
+    from config import INDEX_DIR
+    from rag.chain import create_rag_pipeline
+    from rag.index_store import ChunkMetadata, load_bundle
+
+    embeddings = HashingEmbeddings()
+    vectorstore, chunks, bm25, manifest = load_bundle(INDEX_DIR, embeddings)
+    llm = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second)
+    chain = create_rag_pipeline(vectorstore, chunks, embeddings, None, bm25=bm25, documents=manifest["documents"],
+                                chunk_metadata=ChunkMetadata.open(INDEX_DIR), llm=llm)
+    flask_app.use_chain(chain, vectorstore, chunks)
+    uvicorn.run(asgi.application, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_server(args, workdir):
+    from rag.document_processor import process_and_store_documents
+
+    files, pages = CORPORA[args.corpus]
+    write_synthetic_corpus(os.path.join(workdir, "uploaded_files"), files, pages)
+    _, _, chunks, _, _ = process_and_store_documents(
+        os.path.join(workdir, "uploaded_files"), os.path.join(workdir, "index"), embedding_model="hashing",
+        embeddings=HashingEmbeddings()
+    )
+    print(f"Serving {args.corpus}: {files} files, {files * pages} pages, {len(chunks)} chunks")
+    command = [sys.executable, "-m", "benchmarks.bench_load", "--serve", workdir, "--port", str(args.port),
+               "--llm-latency", str(args.llm_latency), "--tokens-per-second", str(args.tokens_per_second)]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wait_ready(url, server, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server is not None and server.poll() is not None:
+            raise SystemExit(f"Server exited with code {server.returncode}.")
+        try:
+            if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit(f"{url} was not ready after {timeout}s.")
+
+
+async def run_level(url, concurrency, duration, questions):
+    """Closed loop: each client sends its next question as soon as the last is answered."""
+    latencies = []
+    statuses = {}
+    numbers = itertools.count()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                i = next(numbers)
+                # A request number keeps every question distinct, so the answer cache never hits.
+                question = f"{questions[i % len(questions)]} q{i}"
+                start = time.perf_counter()
+                try:
+                    status = (await client.post("/query", json={"query": question})).status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default="medium", choices=sorted(CORPORA))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="0 returns the whole answer at once")
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--url", help="drive this already-running server instead of starting one")
+    parser.add_argument("--json", help="write machine-readable results here")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    questions = synthetic_queries(1000, seed=7)
+    with tempfile.TemporaryDirectory() as workdir:
+        server = None
+        url = args.url
+        if url is None:
+            server = start_server(args, workdir)
+            url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_ready(url, server)
+            rows = []
+            print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'qps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            for concurrency in args.concurrency:
+                latencies, statuses, elapsed = asyncio.run(run_level(url, concurrency, args.duration, questions))
+                errors = sum(count for status, count in statuses.items() if status != 200)
+                row = {"case": f"clients={concurrency}", "concurrency": concurrency,
+                       "requests": sum(statuses.values()), "errors": errors,
+                       "statuses": {str(status): count for status, count in statuses.items()},
+                       "qps": round(len(latencies) / elapsed, 2), **latency_summary(latencies)}
+                rows.append(row)
+                print(f"{concurrency:>8} {row['requests']:>9} {errors:>7} {row['qps']:>8.2f} "
+                      f"{row['p50_ms'] or 0:>9.1f} {row['p95_ms'] or 0:>9.1f} {row['p99_ms'] or 0:>9.1f}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    if args.json:
+        params = {name: value for name, value in vars(args).items() if name != "serve"}
+        write_results(args.json, "load", params, rows)
+
+
+if __name__ == "__main__":
+    main()
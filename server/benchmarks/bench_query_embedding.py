@@ -0,0 +1,87 @@
+"""Question-embedding throughput with ``--clients`` concurrent callers: one forward
+pass per call against the shared, micro-batching ``QueryEmbedder``.
+
+Uses the real model with ``--model`` (e.g. sentence-transformers/all-MiniLM-L6-v2).
+Otherwise a stand-in charges a fixed cost per forward pass plus a smaller cost
+per text, one pass at a time as when a pass keeps every core busy; that is
+the shape that makes batching pay off on CPU. Questions
+are distinct, so the LRU never hits; ``--repeat`` re-asks a fraction of them.
+
+    python -m benchmarks.bench_query_embedding --clients 1 8 32
+    python -m benchmarks.bench_query_embedding --model sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import HashingEmbeddings, latency_summary, synthetic_queries
+from rag.embeddings import QueryEmbedder
+
+
+class ForwardPassCost(HashingEmbeddings):
+    """``HashingEmbeddings`` that takes as long as a model: ``pass_ms`` per call plus ``text_ms`` per text."""
+
+    def __init__(self, pass_ms, text_ms):
+        super().__init__()
+        self.pass_ms = pass_ms
+        self.text_ms = text_ms
+        self.busy = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.busy:
+            time.sleep((self.pass_ms + self.text_ms * len(texts)) / 1000)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def measure(embed, questions, clients):
+    def call(question):
+        start = time.perf_counter()
+        embed(question)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        seconds = list(pool.map(call, questions))
+    return len(questions) / (time.perf_counter() - start), latency_summary(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="embedding model to load instead of the stand-in")
+    parser.add_argument("--pass-ms", type=float, default=8.0)
+    parser.add_argument("--text-ms", type=float, default=1.0)
+    parser.add_argument("--questions", type=int, default=400)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=float, default=0.0, help="fraction of questions asked before")
+    parser.add_argument("--batch-window-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.model:
+        from rag.embeddings import get_embeddings
+        embeddings = get_embeddings(args.model)
+        embeddings.embed_query("warm up")
+    else:
+        embeddings = ForwardPassCost(args.pass_ms, args.text_ms)
+    rng = random.Random(0)
+    base = synthetic_queries(args.questions, seed=3)
+    print(f"{'clients':>8} {'mode':<14} {'qps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'batch':>6}")
+    for clients in args.clients:
+        questions = [q if rng.random() >= args.repeat or not i else base[rng.randrange(i)]
+                     for i, q in enumerate(base)]
+        qps, summary = measure(embeddings.embed_query, questions, clients)
+        print(f"{clients:>8} {'per call':<14} {qps:>8.1f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+              f"{summary['p99_ms']:>8.2f} {1.0:>6.1f}")
+        embedder = QueryEmbedder(embeddings, batch_window=args.batch_window_ms / 1000)
+        qps, summary = measure(embedder.embed, questions, clients)
+        stats = embedder.stats()
+        print(f"{clients:>8} {'QueryEmbedder':<14} {qps:>8.1f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+              f"{summary['p99_ms']:>8.2f} {stats['mean_batch'] or 0:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
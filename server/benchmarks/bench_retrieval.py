@@ -0,0 +1,95 @@
+"""Retrieval-only latency of the served pipeline, without the LLM.
+
+Builds a bundle over synthetic chunks, opens it with ``load_bundle`` and
+``create_rag_pipeline`` (with ``FakeChatModel``, so no Groq key is needed),
+then times the chain's retriever for single queries in each fusion mode,
+batch throughput, and the whole of ``answer_query`` with a zero-latency LLM
+(retrieval plus prompt packing). The query embedding cache is cleared before
+each case; ``retrieve_repeat`` runs the same questions again with it warm.
+
+    python -m benchmarks.bench_retrieval --sizes 10000 100000 --json retrieval.json
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.common import (
+    FakeChatModel, HashingEmbeddings, latency_summary, synthetic_chunks, synthetic_queries, write_results
+)
+from rag.ann import build_index
+from rag.bm25 import SparseBM25
+from rag.chain import answer_query, create_rag_pipeline, with_retrieval_options
+from rag.index_store import load_bundle, write_bundle
+
+
+def timed(fn, queries):
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="chunks")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--ann", default="flat", help="index kind, see rag.ann")
+    parser.add_argument("--json", help="write machine-readable results here")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # per-query latency, as in serving
+    embeddings = HashingEmbeddings()
+    queries = synthetic_queries(args.queries)
+    rows = []
+    print(f"{'chunks':>8} {'case':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'qps':>8}")
+    for size in args.sizes:
+        texts = synthetic_chunks(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_dir = os.path.join(tmp, "index")
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+            index, info = build_index(vectors, args.ann, {"min_vectors": 0})
+            write_bundle(bundle_dir, index, texts, SparseBM25(texts), "hashing", ann=info, vectors=vectors)
+            vectorstore, chunks, bm25, manifest = load_bundle(bundle_dir, embeddings)
+            chain = create_rag_pipeline(vectorstore, chunks, embeddings, None, bm25=bm25,
+                                        documents=manifest["documents"], llm=FakeChatModel())
+
+            embedder = chain.retriever.query_embedder
+            cases = []
+            for fusion in ("weighted", "rrf"):
+                retriever = with_retrieval_options(chain, {"fusion": fusion}).retriever
+                retriever.get_relevant_documents(queries[0])  # warm up
+                embedder.clear()
+                cases.append((f"retrieve_{fusion}", timed(retriever.get_relevant_documents, queries)))
+            cases.append(("retrieve_repeat", timed(retriever.get_relevant_documents, queries)))
+            embedder.clear()
+            cases.append(("answer_query", timed(lambda query: answer_query(chain, query), queries)))
+
+            embedder.clear()
+            batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+            batch_seconds = timed(chain.retriever.get_relevant_documents_batch, batches)
+
+        for name, seconds in cases:
+            row = {"case": f"{name}@{size}", "chunks": size, **latency_summary(seconds),
+                   "qps": round(len(seconds) / sum(seconds), 1)}
+            rows.append(row)
+            print(f"{size:>8} {name:<16} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                  f"{row['qps']:>8.1f}")
+        row = {"case": f"retrieve_batch@{size}", "chunks": size, "batch_size": args.batch_size,
+               **latency_summary(batch_seconds), "qps": round(len(queries) / sum(batch_seconds), 1)}
+        rows.append(row)
+        print(f"{size:>8} {'retrieve_batch':<16} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+              f"{row['qps']:>8.1f}")
+
+    if args.json:
+        write_results(args.json, "retrieval", vars(args), rows)
+
+
+if __name__ == "__main__":
+    main()
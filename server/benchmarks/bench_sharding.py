@@ -0,0 +1,86 @@
+"""Retrieval latency and throughput with the index split across 1..N shard workers.
+
+Builds a synthetic flat bundle, then for each shard count measures
+single-query p50/p95 latency, batch throughput with ``--concurrency``
+concurrent callers, and agreement of the top-k with the in-process
+``HybridRetriever``. Speed-ups need at least as many free cores as shards.
+
+    python -m benchmarks.bench_sharding --chunks 200000 --shards 1 2 4
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from benchmarks.common import HashingEmbeddings, synthetic_chunks, synthetic_queries
+from rag.ann import build_index
+from rag.bm25 import SparseBM25
+from rag.index_store import load_bundle, write_bundle
+from rag.retrievers import HybridRetriever
+from rag.sharding import ShardPool, ShardedRetriever, split_bundle
+
+
+def measure(retriever, queries, concurrency):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([doc.metadata["chunk_id"] for doc in retriever.get_relevant_documents(query)])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(retriever.get_relevant_documents, queries))
+    qps = len(queries) / (time.perf_counter() - start)
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 95), qps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # per-query latency, as in serving
+    embeddings = HashingEmbeddings()
+    texts = synthetic_chunks(args.chunks)
+    queries = synthetic_queries(args.queries)
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle_dir = os.path.join(tmp, "index")
+        index, info = build_index(np.asarray(embeddings.embed_documents(texts), dtype=np.float32), "flat")
+        write_bundle(bundle_dir, index, texts, SparseBM25(texts), "hashing", ann=info)
+        vectorstore, chunks, bm25, _ = load_bundle(bundle_dir, embeddings)
+        print(f"{len(chunks)} chunks, {len(queries)} queries, k={args.k}, {os.cpu_count()} cpus\n")
+
+        local = HybridRetriever(vectorstore, chunks, embeddings, bm25=bm25,
+                                chunk_ids=np.arange(len(chunks), dtype=np.int64), k=args.k)
+        truth, p50, p95, qps = measure(local, queries, args.concurrency)
+        print(f"{'shards':<10} {'split s':>8} {'start s':>8} {'p50 ms':>8} {'p95 ms':>8} {'qps':>8} {'same top-k':>10}")
+        print(f"{'in-proc':<10} {0.0:>8.2f} {0.0:>8.2f} {p50:>8.2f} {p95:>8.2f} {qps:>8.1f} {1.0:>10.3f}")
+
+        for num_shards in args.shards:
+            start = time.perf_counter()
+            shard_dirs, offsets = split_bundle(bundle_dir, num_shards)
+            split_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            pool = ShardPool(shard_dirs, offsets)
+            start_seconds = time.perf_counter() - start
+            try:
+                results, p50, p95, qps = measure(ShardedRetriever(pool, embeddings, k=args.k), queries,
+                                                 args.concurrency)
+            finally:
+                pool.close()
+            same = np.mean([a == b for a, b in zip(results, truth)])
+            print(f"{num_shards:<10} {split_seconds:>8.2f} {start_seconds:>8.2f} {p50:>8.2f} {p95:>8.2f} "
+                  f"{qps:>8.1f} {same:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
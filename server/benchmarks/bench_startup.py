@@ -0,0 +1,166 @@
+"""Cold start: import time of the app and time for a fresh server to answer /health and /ready.
+
+Each run starts a new interpreter, so nothing is warm except the OS page
+cache. ``import app`` only pulls in Flask and the config; the "eager" row
+also imports the RAG stack, which is what the server used to do before
+binding its port. Server runs start ``uvicorn asgi:application`` from
+``server/`` with the current environment (model, index and cache paths)
+and poll until the model and index have loaded. No LLM call is made, so a
+placeholder GROQ_API_KEY is used if none is set.
+
+Then, as a pre-forking server (gunicorn --preload) would, a fresh process
+imports the app and forks ``--workers`` workers that each load the chain
+and run ``--queries`` retrievals. With all of them alive, each reports its
+``smaps_rollup`` (see ``benchmarks.bench_bundle_memory``): ``private MB``
+is what the worker holds alone. With ``PRELOAD_MODELS=1`` the model and the
+index are loaded before the fork, so it should stay small; without it every
+worker loads its own model and whatever part of the index isn't mapped.
+
+    python -m benchmarks.bench_startup --runs 5 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from benchmarks.common import synthetic_queries
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); {imports}; print(time.perf_counter() - start)"
+
+
+def import_seconds(imports, env):
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(imports=imports)], cwd=SERVER_DIR, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def get(url):
+    """``(status, json body)``, or ``None`` while nothing is listening."""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+    except OSError:
+        return None
+
+
+def server_start(port, env, timeout):
+    """Seconds until /health answers and until /ready reports a final state, and that state."""
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port)],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        health = None
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise SystemExit(f"Server exited with code {server.returncode} before answering /health.")
+            if health is None and get(f"{base}/health") is not None:
+                health = time.perf_counter() - start
+            if health is not None:
+                status, body = get(f"{base}/ready")
+                if body["state"] in ("ready", "failed"):
+                    return health, time.perf_counter() - start, body["state"]
+            time.sleep(0.01)
+        raise SystemExit(f"Server was not ready after {timeout}s.")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_workers(workers, queries):
+    """Child process: import the app, fork ``workers`` workers and print each one's memory as JSON lines."""
+    from benchmarks.bench_bundle_memory import memory_mb
+    import app
+
+    parent = memory_mb()
+    go_read, go_write = os.pipe()
+    replies = []
+    for _ in range(workers):
+        reply_read, reply_write = os.pipe()
+        if os.fork() == 0:
+            os.close(go_write)
+            os.close(reply_read)
+            app.load_rag_chain()
+            if app.rag_chain is not None:
+                for query in synthetic_queries(queries):
+                    app.rag_chain.retriever.get_relevant_documents(query)
+            os.write(reply_write, b"ready\n")
+            os.read(go_read, 1)  # returns once the parent closes go_write: every worker has loaded
+            reply = {"state": app.startup["state"], "parent_rss": parent["rss"], **memory_mb()}
+            os.write(reply_write, (json.dumps(reply) + "\n").encode())
+            os._exit(0)
+        os.close(reply_write)
+        replies.append(os.fdopen(reply_read))
+    os.close(go_read)
+    for reply in replies:
+        reply.readline()
+    os.close(go_write)
+    for reply in replies:
+        print(reply.readline().strip())
+        os.wait()
+
+
+def worker_memory(workers, queries, env):
+    """Each forked worker's ``smaps_rollup`` summary, with ``PRELOAD_MODELS`` as in ``env``."""
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child-workers", str(workers),
+               "--queries", str(queries)]
+    result = subprocess.run(command, cwd=SERVER_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Forked-worker check failed:\n{result.stderr.strip().splitlines()[-1]}")
+    return [json.loads(line) for line in result.stdout.strip().splitlines()[-workers:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=2, help="forked workers in the memory check; 0 skips it")
+    parser.add_argument("--queries", type=int, default=20, help="retrievals each forked worker runs")
+    parser.add_argument("--child-workers", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child_workers:
+        run_workers(args.child_workers, args.queries)
+        return
+
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "placeholder")
+    print(f"{args.runs} runs each, median seconds\n")
+    print(f"{'measure':<28} {'seconds':>8}")
+    for label, imports in [("import app", "import app"),
+                           ("import app + RAG stack", "import app, rag.chain, rag.document_processor")]:
+        seconds = np.median([import_seconds(imports, env) for _ in range(args.runs)])
+        print(f"{label:<28} {seconds:>8.3f}")
+
+    runs = [server_start(args.port, env, args.timeout) for _ in range(args.runs)]
+    print(f"{'server: /health answers':<28} {np.median([run[0] for run in runs]):>8.3f}")
+    print(f"{'server: /ready final':<28} {np.median([run[1] for run in runs]):>8.3f}")
+    states = sorted({run[2] for run in runs})
+    if states != ["ready"]:
+        print(f"\nStartup ended as {', '.join(states)}; see GET /ready for the error.")
+
+    if args.workers:
+        print(f"\n{args.workers} forked workers, mean MB per worker\n")
+        print(f"{'mode':<12} {'parent RSS':>11} {'RSS':>8} {'private':>8} {'PSS':>8}")
+        for label, preload in [("preload", "1"), ("no preload", "0")]:
+            results = worker_memory(args.workers, args.queries, {**env, "PRELOAD_MODELS": preload})
+            mean = {name: np.mean([result[name] for result in results])
+                    for name in ("parent_rss", "rss", "private", "pss")}
+            print(f"{label:<12} {mean['parent_rss']:>11.1f} {mean['rss']:>8.1f} {mean['private']:>8.1f} "
+                  f"{mean['pss']:>8.1f}")
+            states = sorted({result["state"] for result in results})
+            if states != ["ready"]:
+                print(f"  workers ended as {', '.join(states)}; the figures don't include a loaded chain.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Shared fixtures for the benchmark scripts: synthetic HR text and PDFs, a cheap
+embedder, a local stand-in for the Groq chat model and machine-readable results."""
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+VOCAB = (
+    "leave vacation sick parental policy employee manager approval salary payroll "
+    "bonus benefits insurance health dental vision retirement pension holiday "
+    "overtime remote office travel expense reimbursement training probation notice "
+    "termination resignation grievance harassment conduct ethics security laptop "
+    "onboarding review performance promotion appraisal compensation days weeks year"
+).split()
+
+
+def synthetic_chunks(n, words_per_chunk=160, seed=0):
+    rng = random.Random(seed)
+    return [
+        f"Section {i}. " + " ".join(rng.choice(VOCAB) for _ in range(words_per_chunk))
+        for i in range(n)
+    ]
+
+
+def synthetic_queries(n, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCAB) for _ in range(rng.randint(3, 8))) for _ in range(n)]
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pages(pages, lines_per_page=40, words_per_line=12, seed=0):
+    """Page texts for ``write_pdf``: a ``Policy page N.`` line, then random HR vocabulary."""
+    rng = random.Random(seed)
+    return [[f"Policy page {page + 1}."] + [
+        " ".join(rng.choice(VOCAB) for _ in range(words_per_line)) for _ in range(lines_per_page)
+    ] for page in range(pages)]
+
+
+def write_synthetic_pdf(path, pages, lines_per_page=40, words_per_line=12, seed=0):
+    """Write a text-only PDF that PyPDF2 can extract, without any PDF library."""
+    write_pdf(path, synthetic_pages(pages, lines_per_page, words_per_line, seed))
+
+
+def write_pdf(path, pages):
+    """Write ``pages``, each a list of lines, as a text-only PDF."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(pages))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_synthetic_corpus(directory, files, pages_per_file, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(files):
+        write_synthetic_pdf(os.path.join(directory, f"policy_{i:04d}.pdf"), pages_per_file, seed=seed + i)
+
+
+# Named synthetic PDF corpora: (files, pages per file). About 5 chunks per page.
+CORPORA = {
+    "small": (10, 10),
+    "medium": (50, 20),
+    "large": (200, 25),
+    "xlarge": (1000, 25),
+}
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic unit-length embeddings so benchmarks don't need the MiniLM weights."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            digest = hashlib.md5(token.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic local stand-in for ChatGroq; pass it as ``create_rag_pipeline(..., llm=)``.
+
+    The answer is ``answer_tokens`` words picked by a hash of the prompt, so
+    the same question over the same context always gets the same answer.
+    ``latency`` seconds pass before the first token, then tokens arrive at
+    ``tokens_per_second`` (all at once when 0), in both blocking and
+    streaming calls. Token usage is reported the way Groq reports it.
+    """
+
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        return prompt, [rng.choice(VOCAB) + " " for _ in range(self.answer_tokens)]
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _result(self, prompt, tokens):
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(tokens)}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))],
+                          llm_output={"token_usage": usage})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        prompt, tokens = self._tokens(messages)
+        time.sleep(self.latency + self._token_delay() * len(tokens))
+        return self._result(prompt, tokens)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        prompt, tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + self._token_delay() * len(tokens))
+        return self._result(prompt, tokens)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any):
+        _, tokens = self._tokens(messages)
+        time.sleep(self.latency)
+        for token in tokens:
+            time.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any):
+        _, tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            await asyncio.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean in milliseconds of a list of latencies in seconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if not len(ms):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "mean_ms": round(float(ms.mean()), 3)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, params, rows):
+    """Write one benchmark's results as JSON for ``benchmarks.compare``.
+
+    Each row is a flat dict with a ``case`` name that identifies it across runs.
+    """
+    results = {
+        "benchmark": benchmark,
+        "created_at": time.time(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "rows": rows,
+    }
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {path}")
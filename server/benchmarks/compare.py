@@ -0,0 +1,78 @@
+"""Compare two benchmark result files (``--json`` output) and flag regressions.
+
+Rows are matched by ``case``. Latency fields (``*_ms``, ``*_seconds``,
+``seconds``) regress when they grow, and throughput fields (``qps``,
+``*_per_sec``) when they shrink, by more than ``--tolerance`` (a fraction)
+and by more than ``--min-ms`` milliseconds for times. Exits with status 1 if
+anything regressed, so a CI job can fail on it.
+
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.15
+"""
+import argparse
+import json
+import sys
+
+
+def direction(field):
+    """+1 if larger is worse, -1 if smaller is worse, 0 if the field is not compared."""
+    if field.endswith("_ms") or field.endswith("_seconds") or field == "seconds":
+        return 1
+    if field == "qps" or field.endswith("_per_sec"):
+        return -1
+    return 0
+
+
+def milliseconds(field, value):
+    return value if field.endswith("_ms") else value * 1000
+
+
+def compare(baseline, current, tolerance, min_ms):
+    """``[(case, field, old, new, change)]`` for every compared field, and whether each regressed."""
+    old_rows = {row["case"]: row for row in baseline["rows"]}
+    changes = []
+    for row in current["rows"]:
+        old = old_rows.get(row["case"])
+        if old is None:
+            continue
+        for field, value in row.items():
+            sign = direction(field)
+            previous = old.get(field)
+            if not sign or not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) \
+                    or not previous:
+                continue
+            change = (value - previous) / previous
+            regressed = sign * change > tolerance
+            if regressed and sign > 0 and milliseconds(field, value - previous) < min_ms:
+                regressed = False
+            changes.append((row["case"], field, previous, value, change, regressed))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--min-ms", type=float, default=0.5, help="ignore slow-downs smaller than this")
+    parser.add_argument("--all", action="store_true", help="list every compared field, not only regressions")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline["benchmark"] != current["benchmark"]:
+        raise SystemExit(f"Cannot compare {baseline['benchmark']} results with {current['benchmark']} results.")
+
+    changes = compare(baseline, current, args.tolerance, args.min_ms)
+    regressions = [change for change in changes if change[5]]
+    print(f"{current['benchmark']}: {baseline.get('git_commit')} -> {current.get('git_commit')}, "
+          f"{len(changes)} fields compared, {len(regressions)} regressed beyond {args.tolerance:.0%}\n")
+    for case, field, old, new, change, regressed in (changes if args.all else regressions):
+        print(f"{'REGRESSED' if regressed else 'ok':<10} {case:<28} {field:<18} {old:>12.3f} -> {new:>12.3f} "
+              f"({change:+.1%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
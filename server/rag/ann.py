@@ -0,0 +1,192 @@
+"""FAISS index construction: exact flat search or an approximate index for large corpora.
+
+Every kind keeps vectors in insertion order with sequential ids, so chunk
+``i`` stays FAISS row ``i``. All use L2 distance on the unit-length MiniLM
+vectors, which the retriever maps to cosine similarity.
+
+The flat kind is a ``FlatVectorIndex`` over the bundle's raw vector file
+rather than a FAISS index: ``faiss.read_index`` can only memory-map the
+inverted lists of IVF indexes, and reads every other kind into private
+memory.
+"""
+import numpy as np
+import faiss
+
+INDEX_KINDS = ("flat", "ivf", "hnsw", "ivfpq", "sq")
+ADD_BATCH = 4096
+SEARCH_BLOCK = 65536
+
+
+class FlatVectorIndex:
+    """Exact L2 search straight over an ``(n, dim)`` float32 array.
+
+    ``rag.index_store.load_bundle`` passes a read-only ``np.memmap`` of the
+    bundle's vectors, so every process serving the bundle searches the same
+    page-cache copy. ``vectors`` may also be an array or anything that slices
+    like one (``rag.index_store.VectorFile``). Rows are scanned
+    ``SEARCH_BLOCK`` at a time. Offers the parts of the FAISS index interface
+    the retriever and bundle code use.
+    """
+
+    is_trained = True
+    metric_type = faiss.METRIC_L2
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, queries, k, rows=None):
+        """``(distances, rows)`` of the ``k`` nearest rows, padded with ``-1``; ``rows`` (sorted) restricts it."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        heap = faiss.ResultHeap(len(queries), k)
+        for start in range(0, self.ntotal, SEARCH_BLOCK):
+            end = min(start + SEARCH_BLOCK, self.ntotal)
+            block = self.vectors[start:end]
+            ids = None
+            if rows is not None:
+                first, last = np.searchsorted(rows, [start, end])
+                if first == last:
+                    continue
+                ids = rows[first:last]
+                block = block[ids - start]
+            distances, found = faiss.knn(queries, np.ascontiguousarray(block, dtype=np.float32), min(k, len(block)))
+            heap.add_result(distances, found + start if ids is None else ids[found])
+        heap.finalize()
+        return heap.D, heap.I
+
+    def reconstruct(self, row):
+        return np.array(self.vectors[row:row + 1][0], dtype=np.float32)
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count], dtype=np.float32)
+
+
+def default_nlist(num_vectors):
+    # ~4*sqrt(N) lists, keeping the 39 training points per centroid k-means wants.
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def factory_string(kind, dim, num_vectors, options):
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{options.get('hnsw_m', 32)}"
+    if kind == "sq":
+        return "SQ8"
+    nlist = options.get("nlist") or default_nlist(num_vectors)
+    if kind == "ivf":
+        return f"IVF{nlist},Flat"
+    if kind == "ivfpq":
+        pq_m = options.get("pq_m", 48)
+        while dim % pq_m:
+            pq_m -= 1
+        return f"IVF{nlist},PQ{pq_m}x8"
+    raise ValueError(f"Unknown index kind {kind!r}; expected one of {', '.join(INDEX_KINDS)}.")
+
+
+def build_index(vectors, kind="flat", options=None, seed=0):
+    """Build an index over ``vectors``; returns ``(index, info)``.
+
+    Trained kinds (IVF, PQ, SQ) are trained on a random sample of at most
+    ``options["train_size"]`` vectors. Corpora smaller than
+    ``options["min_vectors"]`` get a flat index whatever ``kind`` says, since
+    exact search is already fast there. ``info`` is what the bundle manifest
+    records about the index. A flat index is a ``FlatVectorIndex`` over
+    ``vectors`` itself, with nothing built.
+
+    ``vectors`` may be anything with a ``shape`` that returns rows as arrays
+    when sliced, like ``rag.index_store.VectorFile``; it is read
+    ``ADD_BATCH`` rows at a time, plus the training sample.
+    """
+    options = options or {}
+    if not hasattr(vectors, "shape"):
+        vectors = np.asarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    requested = kind
+    if kind != "flat" and num_vectors < options.get("min_vectors", 0):
+        print(f"Warning: {num_vectors} chunks is below ANN min_vectors; building a flat index instead of {kind}.")
+        kind = "flat"
+
+    description = factory_string(kind, dim, num_vectors, options)
+    if kind == "flat":
+        return FlatVectorIndex(vectors), {"kind": kind, "requested": requested, "description": description,
+                                          "trained_on": 0}
+    index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = options.get("ef_construction", 80)
+        index.hnsw.efSearch = options.get("ef_search", 64)
+
+    trained_on = 0
+    if not index.is_trained:
+        trained_on = min(num_vectors, options.get("train_size", 100000))
+        if trained_on < num_vectors:
+            sample = _take(vectors, np.random.default_rng(seed).choice(num_vectors, trained_on, replace=False))
+        else:
+            sample = vectors[:num_vectors]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        del sample
+    if isinstance(index, faiss.IndexFlatCodes):
+        # Reserve the codes up front (a vector keeps its capacity when shrunk)
+        # so adding in batches doesn't reallocate and copy the growing array.
+        index.codes.resize(num_vectors * index.code_size)
+        index.codes.resize(0)
+    for start in range(0, num_vectors, ADD_BATCH):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH], dtype=np.float32))
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = options.get("nprobe", 16)
+        ivf.make_direct_map()  # reconstruct(row) for candidates only BM25 found
+
+    return index, {"kind": kind, "requested": requested, "description": description, "trained_on": trained_on}
+
+
+def _take(vectors, rows):
+    """``vectors[rows]``, reading ``vectors`` a block at a time in order."""
+    taken = np.empty((len(rows), vectors.shape[1]), dtype=np.float32)
+    order = np.argsort(rows)
+    sorted_rows = rows[order]
+    for start in range(0, vectors.shape[0], ADD_BATCH):
+        first, last = np.searchsorted(sorted_rows, [start, start + ADD_BATCH])
+        if first < last:
+            taken[order[first:last]] = vectors[start:start + ADD_BATCH][sorted_rows[first:last] - start]
+    return taken
+
+
+def search_params(index, nprobe=None, ef_search=None, selector=None):
+    """Per-query FAISS search parameters, or ``None`` to use the index defaults.
+
+    Passed to ``index.search(..., params=)`` so concurrent queries with
+    different settings don't race on the shared index object. ``selector``
+    (a ``faiss.IDSelector``) restricts the search to the rows it accepts.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and (nprobe is not None or selector is not None):
+        return faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe, sel=selector)
+    if isinstance(index, faiss.IndexHNSW) and (ef_search is not None or selector is not None):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+def search(index, queries, k, rows=None, nprobe=None, ef_search=None):
+    """``(distances, rows)`` of the ``k`` nearest rows of any index kind, padded with ``-1``.
+
+    ``rows`` (sorted row ids) restricts the search to those rows; ``nprobe``
+    and ``ef_search`` are as for ``search_params``.
+    """
+    if isinstance(index, FlatVectorIndex):
+        return index.search(queries, k, rows)
+    selector = bitmap = None
+    if rows is not None:
+        selector, bitmap = row_selector(rows, index.ntotal)
+    return index.search(queries, k, params=search_params(index, nprobe, ef_search, selector))
+
+
+def row_selector(rows, ntotal):
+    """``(selector, bitmap)`` accepting only ``rows``; keep ``bitmap`` alive while searching."""
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[rows] = True
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap)), bitmap
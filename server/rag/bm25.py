@@ -0,0 +1,332 @@
+import json
+import math
+import os
+import re
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+TOKEN_PATTERN = re.compile(r"\w+")
+INDEX_FORMAT_VERSION = 1
+_ARRAYS = ("indptr", "doc_ids", "term_freqs", "weights", "idf", "doc_len")
+
+
+def tokenize(text):
+    """Lowercase and split on anything that isn't a word character."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def whitespace_tokenize(text):
+    """The tokenizer HybridRetriever used with rank_bm25, kept for compat mode."""
+    return text.split()
+
+
+class SparseBM25:
+    """BM25Okapi over an inverted index.
+
+    Postings are stored term-major in CSR form: ``indptr[t]:indptr[t+1]`` slices
+    ``doc_ids`` and ``weights`` for term ``t``. ``weights`` already hold the
+    length-normalised tf part of the Okapi formula, so a query only touches the
+    postings of its own terms.
+
+    With ``compat=True`` tokenisation is ``str.split()`` and every float
+    operation follows ``rank_bm25.BM25Okapi`` in the same order, so scores are
+    bit-identical to the old retriever. After ``updated`` the idf floor may
+    differ from a fresh build in the last ulp, since terms are summed in a
+    different order.
+    """
+
+    def __init__(self, texts, compat=False, k1=1.5, b=0.75, epsilon=0.25):
+        self._configure(compat, k1, b, epsilon)
+        self._build([self.tokenizer(text) for text in texts])
+
+    def _configure(self, compat, k1, b, epsilon):
+        self.compat = compat
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.tokenizer = whitespace_tokenize if compat else tokenize
+
+    def _build(self, corpus):
+        vocab = {}
+        terms, docs, tfs, doc_len = self._postings(corpus, vocab, 0)
+        self._finalize(vocab, terms, docs, tfs, doc_len)
+
+    @classmethod
+    def from_batches(cls, batches, compat=False, k1=1.5, b=0.75, epsilon=0.25):
+        """Build from an iterable of text lists, tokenising one batch at a time.
+
+        Only the posting arrays are kept between batches, so the corpus never
+        has to be in memory as text or tokens. The result is identical to
+        ``SparseBM25(all_texts)``.
+        """
+        index = cls.__new__(cls)
+        index._configure(compat, k1, b, epsilon)
+        vocab = {}
+        parts = [index._postings([], vocab, 0)]
+        num_docs = 0
+        for texts in batches:
+            parts.append(index._postings([index.tokenizer(text) for text in texts], vocab, num_docs))
+            num_docs += len(texts)
+        arrays = [np.concatenate(arrays) for arrays in zip(*parts)]
+        del parts
+        index._finalize(vocab, *arrays)
+        return index
+
+    @staticmethod
+    def _postings(corpus, vocab, doc_offset):
+        """Flatten tokenised documents into (term, doc, tf) triples, growing ``vocab``."""
+        terms, docs, tfs = [], [], []
+        doc_len = np.zeros(len(corpus), dtype=np.int64)
+        for i, tokens in enumerate(corpus):
+            doc_len[i] = len(tokens)
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, freq in frequencies.items():
+                terms.append(vocab.setdefault(token, len(vocab)))
+                docs.append(doc_offset + i)
+                tfs.append(freq)
+        return (np.array(terms, dtype=np.int64), np.array(docs, dtype=np.int32),
+                np.array(tfs, dtype=np.int32), doc_len)
+
+    def _finalize(self, vocab, terms, docs, tfs, doc_len):
+        order = np.lexsort((docs, terms))
+        self.vocab = vocab
+        self.corpus_size = len(doc_len)
+        self.doc_len = doc_len
+        self.avgdl = int(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0
+
+        df = np.bincount(terms, minlength=len(vocab)).astype(np.int64)
+        self.indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+        self.doc_ids = docs[order]
+        self.term_freqs = tfs[order]
+
+        self.idf = self._calc_idf(df)
+        self.weights = self._tf_weights(self.term_freqs, self.doc_ids)
+
+    def _tf_weights(self, term_freqs, doc_ids):
+        if not self.corpus_size:
+            return np.zeros(len(term_freqs), dtype=np.float64)
+        term_freqs = term_freqs.astype(np.float64)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avgdl)
+        return term_freqs * (self.k1 + 1) / (term_freqs + norm[doc_ids])
+
+    def updated(self, removed_ids, new_texts):
+        """Return a new index with ``removed_ids`` dropped and ``new_texts`` appended.
+
+        Only ``new_texts`` are tokenised; surviving postings are carried over
+        and the corpus statistics (idf, avgdl) are recomputed from the arrays.
+        Surviving documents keep their relative order and are renumbered from
+        0, followed by the new ones, matching ``FAISS.delete`` + ``add``.
+        """
+        keep_doc = np.ones(self.corpus_size, dtype=bool)
+        keep_doc[np.asarray(removed_ids, dtype=np.int64)] = False
+        new_id = (np.cumsum(keep_doc) - 1).astype(np.int32)
+
+        keep = keep_doc[self.doc_ids]
+        terms = np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.indptr))[keep]
+        docs = new_id[self.doc_ids[keep]]
+        tfs = np.asarray(self.term_freqs[keep])
+        doc_len = np.asarray(self.doc_len[keep_doc])
+
+        vocab = dict(self.vocab)
+        new_terms, new_docs, new_tfs, new_len = self._postings(
+            [self.tokenizer(text) for text in new_texts], vocab, len(doc_len)
+        )
+        terms = np.concatenate([terms, new_terms])
+        docs = np.concatenate([docs, new_docs])
+        tfs = np.concatenate([tfs, new_tfs])
+        doc_len = np.concatenate([doc_len, new_len])
+
+        # Drop terms that no longer occur anywhere so they don't skew average_idf.
+        live = np.bincount(terms, minlength=len(vocab)) > 0
+        remap = np.cumsum(live) - 1
+        vocab = {term: int(remap[term_id]) for term, term_id in vocab.items() if live[term_id]}
+
+        index = self.__class__.__new__(self.__class__)
+        index._configure(self.compat, self.k1, self.b, self.epsilon)
+        index._finalize(vocab, remap[terms], docs, tfs, doc_len)
+        return index
+
+    def partition(self, start, end):
+        """Return documents ``[start, end)`` as their own index, renumbered from 0.
+
+        The partition keeps this index's idf, avgdl and tf weights rather than
+        recomputing them from its own documents, so its scores are exactly
+        the full index's scores and partitions can be merged by score. Terms
+        that don't occur in the range are dropped.
+        """
+        keep = (self.doc_ids >= start) & (self.doc_ids < end)
+        terms = np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.indptr))[keep]
+        live = np.bincount(terms, minlength=len(self.vocab)) > 0
+        remap = np.cumsum(live) - 1
+
+        index = self.__class__.__new__(self.__class__)
+        index._configure(self.compat, self.k1, self.b, self.epsilon)
+        index.vocab = {term: int(remap[term_id]) for term, term_id in self.vocab.items() if live[term_id]}
+        index.corpus_size = end - start
+        index.doc_len = np.asarray(self.doc_len[start:end])
+        index.avgdl = self.avgdl
+        index.average_idf = self.average_idf
+        # Postings stay term-major and doc-sorted, since remap preserves term order.
+        index.indptr = np.zeros(len(index.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(remap[terms], minlength=len(index.vocab)), out=index.indptr[1:])
+        index.doc_ids = (np.asarray(self.doc_ids[keep]) - start).astype(np.int32)
+        index.term_freqs = np.asarray(self.term_freqs[keep])
+        index.weights = np.asarray(self.weights[keep])
+        index.idf = np.asarray(self.idf[live])
+        return index
+
+    def _calc_idf(self, df):
+        # math.log and a running sum in vocab order match rank_bm25 exactly.
+        idf = np.empty(len(df), dtype=np.float64)
+        idf_sum = 0
+        for term_id, freq in enumerate(df.tolist()):
+            idf[term_id] = math.log(self.corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            idf_sum += idf[term_id]
+        if len(df):
+            self.average_idf = idf_sum / len(df)
+            idf[idf < 0] = self.epsilon * self.average_idf
+        else:
+            self.average_idf = 0.0
+        return idf
+
+    def score_sparse(self, query, doc_filter=None):
+        """Score only documents containing a query term.
+
+        Returns ``(doc_ids, scores)`` with ``doc_ids`` sorted ascending. Every
+        other document scores exactly 0. ``doc_filter``, a boolean mask over
+        documents, drops postings of other documents before scoring.
+        """
+        tokens = self.tokenizer(query)
+        term_ids = [self.vocab[token] for token in tokens if token in self.vocab]
+        if not term_ids:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+        slices = [slice(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        docs = [self.doc_ids[s] for s in slices]
+        contrib = [self.idf[t] * self.weights[s] for t, s in zip(term_ids, slices)]
+        if doc_filter is not None:
+            keep = [doc_filter[term_docs] for term_docs in docs]
+            docs = [term_docs[k] for term_docs, k in zip(docs, keep)]
+            contrib = [term_contrib[k] for term_contrib, k in zip(contrib, keep)]
+        docs = np.concatenate(docs)
+        contrib = np.concatenate(contrib)
+        # bincount accumulates in input order, i.e. term by term like BM25Okapi.
+        doc_ids, inverse = np.unique(docs, return_inverse=True)
+        return doc_ids.astype(np.int64), np.bincount(inverse, weights=contrib)
+
+    def score_batch(self, queries, doc_filter=None):
+        """Score many queries with one sparse matrix product.
+
+        Builds a (queries x terms) matrix of query-term counts times idf and
+        multiplies it by the (terms x documents) tf-weight matrix, which is the
+        CSR postings as they are stored. Returns one ``(doc_ids, scores)`` pair
+        per query, like ``score_sparse`` up to float summation order.
+        ``doc_filter`` is applied to the postings as in ``score_sparse``.
+        """
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            for token in self.tokenizer(query):
+                term_id = self.vocab.get(token)
+                if term_id is not None:
+                    rows.append(row)
+                    cols.append(term_id)
+        cols = np.asarray(cols, dtype=np.int64)
+        query_matrix = sparse.csr_matrix(
+            (self.idf[cols], (np.asarray(rows, dtype=np.int64), cols)), shape=(len(queries), len(self.vocab))
+        )  # duplicate (query, term) entries are summed, as repeated query terms are in BM25Okapi
+        weights, doc_ids, indptr = self.weights, self.doc_ids, self.indptr
+        if doc_filter is not None:
+            keep = doc_filter[doc_ids]
+            weights, doc_ids = weights[keep], doc_ids[keep]
+            indptr = np.concatenate([[0], np.cumsum(keep)])[indptr]
+        postings = sparse.csr_matrix((weights, doc_ids, indptr), shape=(len(self.vocab), self.corpus_size))
+        scores = (query_matrix @ postings).tocsr()
+        scores.sort_indices()
+        return [
+            (scores.indices[start:end].astype(np.int64), scores.data[start:end])
+            for start, end in zip(scores.indptr[:-1], scores.indptr[1:])
+        ]
+
+    def score_range(self, doc_ids, scores, population=None):
+        """(min, max) over the whole corpus, or ``population`` documents of it, given a sparse score vector."""
+        if len(doc_ids) == 0:
+            return 0.0, 0.0
+        lo, hi = float(scores.min()), float(scores.max())
+        if len(doc_ids) < (self.corpus_size if population is None else population):
+            lo, hi = min(lo, 0.0), max(hi, 0.0)
+        return lo, hi
+
+    def top_k(self, doc_ids, scores, k):
+        """Highest-scoring ``k`` documents, best first (lower id first on ties), via argpartition."""
+        k = min(k, len(doc_ids))
+        if k == 0:
+            return doc_ids[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((doc_ids[top], -scores[top]))]
+        return doc_ids[top]
+
+    def get_scores(self, query):
+        """Dense scores for every document, like ``BM25Okapi.get_scores``."""
+        if not isinstance(query, str):
+            query = " ".join(query)
+        scores = np.zeros(self.corpus_size)
+        doc_ids, sparse = self.score_sparse(query)
+        scores[doc_ids] = sparse
+        return scores
+
+    def save(self, path):
+        """Write the index as a directory of .npy arrays plus a small JSON header.
+
+        The directory is written next to ``path`` first and swapped in, so a
+        reader never sees a half-written index.
+        """
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(tmp_path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "version": INDEX_FORMAT_VERSION,
+                "compat": self.compat,
+                "k1": self.k1,
+                "b": self.b,
+                "epsilon": self.epsilon,
+                "corpus_size": self.corpus_size,
+                "avgdl": self.avgdl,
+                "average_idf": self.average_idf,
+            }, f)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open an index written by ``save``; arrays are memory-mapped by default."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index version: {meta.get('version')}")
+
+        index = cls.__new__(cls)
+        index._configure(meta["compat"], meta["k1"], meta["b"], meta["epsilon"])
+        index.corpus_size = meta["corpus_size"]
+        index.avgdl = meta["avgdl"]
+        index.average_idf = meta["average_idf"]
+        mmap_mode = "r" if mmap else None
+        for name in _ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            index.vocab = {term: term_id for term_id, term in enumerate(json.load(f))}
+        return index
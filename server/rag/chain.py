@@ -1,61 +1,276 @@
 import os
-import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import groq
+import httpx
+import numpy as np
 from langchain_groq import ChatGroq
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+from langchain.chains import LLMChain, RetrievalQA
+from langchain.schema import HumanMessage
+
+from rag.context import ContextPacker, PackedStuffDocumentsChain, chunk_documents_index
 
+from rag.embeddings import get_embeddings, get_query_embedder
+from rag.index_store import ChunkMetadata, bundle_exists, load_bundle, migrate_pickle, read_manifest
+from rag.metrics import record_stage, stage
+from rag.reranker import get_reranker
 from rag.retrievers import HybridRetriever
-from config import VECTORSTORE_PATH
+from rag.sharding import ShardedRetriever, open_shards
+from config import (
+    VECTORSTORE_PATH, INDEX_DIR, EMBEDDING_MODEL, EMBEDDING, BM25_COMPAT, ASYNC_SERVING, RERANK, CONTEXT, ANN,
+    SHARDING
+)
 
 
 rag_chain = None
 text_chunks = []
 vectorstore = None
+index_manifest = None
+_async_http_client = None
+_preloaded = None
+
+def shared_async_http_client():
+    """One pooled HTTP client for every async Groq call, shared across chain rebuilds."""
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_SERVING["llm_max_connections"],
+                                max_keepalive_connections=ASYNC_SERVING["llm_max_connections"]),
+            timeout=httpx.Timeout(ASYNC_SERVING["llm_timeout"], connect=10.0)
+        )
+    return _async_http_client
+
+async def close_async_http_client():
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
+
+def preload_index(embeddings):
+    """Open the bundle in INDEX_DIR ahead of ``initialize_rag_chain``, which then uses it.
+
+    For a pre-forking server: memory-mapped bundle files are shared through
+    the page cache however they are opened, but an index FAISS reads into
+    memory (HNSW, SQ) is only shared, copy-on-write, if it is read before
+    the fork. Sharded serving opens no index here.
+    """
+    global _preloaded
+    if SHARDING["shards"] <= 1 and bundle_exists(INDEX_DIR):
+        _preloaded = load_bundle(INDEX_DIR, embeddings)
 
 def initialize_rag_chain():
-    global rag_chain, vectorstore, text_chunks
+    global rag_chain, vectorstore, text_chunks, index_manifest, _preloaded
     
     groq_api_key = os.environ.get("GROQ_API_KEY")
     if not groq_api_key:
         raise ValueError("GROQ_API_KEY environment variable not set.")
+
+    if not bundle_exists(INDEX_DIR) and os.path.exists(VECTORSTORE_PATH):
+        print(f"Migrating {VECTORSTORE_PATH} to index bundle {INDEX_DIR}...")
+        migrate_pickle(VECTORSTORE_PATH, INDEX_DIR, EMBEDDING_MODEL, bm25_compat=BM25_COMPAT)
     
-    if os.path.exists(VECTORSTORE_PATH):
-        with open(VECTORSTORE_PATH, "rb") as f:
-            data = pickle.load(f)
-            if isinstance(data, dict):
-                vectorstore = data['vectorstore']
-                text_chunks = data['text_chunks']
-                embeddings = data['embeddings']
-            else:
-                # Fallback for old format
-                vectorstore = data
-                text_chunks = []
-                print("Warning: Old vectorstore format detected. Re-initializing embeddings and text_chunks for compatibility.")
-                embeddings = HuggingFaceEmbeddings(
-                    model_name="sentence-transformers/all-MiniLM-L6-v2",
-                    model_kwargs={'device': 'cpu'}
-                )
-        
-        if 'embeddings' not in locals() or embeddings is None:
-             embeddings = HuggingFaceEmbeddings(
-                    model_name="sentence-transformers/all-MiniLM-L6-v2",
-                    model_kwargs={'device': 'cpu'}
-                )
-
-        rag_chain = create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key)
-        print("RAG chain initialized successfully.")
+    if bundle_exists(INDEX_DIR):
+        embeddings = get_embeddings(EMBEDDING_MODEL, EMBEDDING["batch_size"], EMBEDDING["threads"])
+        bundle, _preloaded = _preloaded, None
+        if bundle is None or bundle[3]["index_version"] != read_manifest(INDEX_DIR)["index_version"]:
+            # Shard workers open the index themselves; this process then only needs the chunk texts.
+            bundle = load_bundle(INDEX_DIR, embeddings, search=SHARDING["shards"] <= 1)
+        vectorstore, text_chunks, bm25, index_manifest = bundle
+        if index_manifest["embedding_model"] != EMBEDDING_MODEL:
+            print(f"Warning: index was built with {index_manifest['embedding_model']}, "
+                  f"but EMBEDDING_MODEL is {EMBEDDING_MODEL}.")
+
+        rag_chain = create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key, bm25=bm25,
+                                        documents=index_manifest["documents"],
+                                        chunk_metadata=ChunkMetadata.open(INDEX_DIR))
+        print(f"RAG chain initialized successfully (index version {index_manifest['index_version']}).")
     else:
         print("Vector store not found. Waiting for file upload.")
 
-def create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key: str):
-    llm = ChatGroq(
-        temperature=0,
-        groq_api_key=groq_api_key, 
-        model_name="llama3-8b-8192"
-    )
+    return rag_chain, vectorstore, text_chunks
+
+def _stuff_prompt(qa_chain, docs, query):
+    """The packed "stuff" prompt for ``docs`` and its token usage report."""
+    with stage("prompt"):
+        return qa_chain.combine_documents_chain.prompt_with_usage(docs, question=query)
+
+def _llm(qa_chain):
+    return qa_chain.combine_documents_chain.llm_chain.llm
+
+def _record_llm_usage(usage, result):
+    token_usage = (result.llm_output or {}).get("token_usage") or {}
+    if token_usage.get("prompt_tokens") is not None:
+        usage["llm_prompt_tokens"] = token_usage["prompt_tokens"]
+        usage["llm_completion_tokens"] = token_usage.get("completion_tokens")
+
+def citations(docs):
+    """Source file, page and section of each retrieved document, in the order of ``sources``.
+
+    ``also_in`` lists the other files and pages a deduplicated chunk was found in.
+    """
+    return [{
+        "file": doc.metadata.get("source"),
+        "page": doc.metadata.get("page"),
+        "section": doc.metadata.get("section"),
+        "chunk_id": doc.metadata.get("chunk_id"),
+        "also_in": doc.metadata.get("also_in", []),
+    } for doc in docs]
+
+def answer_query(qa_chain, query):
+    """Retrieve, pack and answer one question.
+
+    Returns ``(answer, source_documents, usage)``; ``usage`` holds the packing
+    stats, ``prompt_tokens`` (counted with tiktoken, or estimated from
+    characters without it, as ``token_counter`` says) and, when Groq reports
+    them, the billed ``llm_prompt_tokens`` / ``llm_completion_tokens``.
+    """
+    with stage("retrieval"):
+        docs = qa_chain.retriever.get_relevant_documents(query)
+    prompt, usage = _stuff_prompt(qa_chain, docs, query)
+    with stage("llm"):
+        result = _llm(qa_chain).generate([[HumanMessage(content=prompt)]])
+    _record_llm_usage(usage, result)
+    return result.generations[0][0].message.content, docs, usage
+
+async def aanswer_query(qa_chain, query):
+    """Async ``answer_query``: retrieval runs in the executor, the LLM call is awaited."""
+    with stage("retrieval"):
+        docs = await qa_chain.retriever.ainvoke(query)
+    prompt, usage = _stuff_prompt(qa_chain, docs, query)
+    with stage("llm"):
+        result = await _llm(qa_chain).agenerate([[HumanMessage(content=prompt)]])
+    _record_llm_usage(usage, result)
+    return result.generations[0][0].message.content, docs, usage
+
+def stream_rag_answer(qa_chain, query):
+    """Run the same retrieval and packed prompt as ``answer_query``, but stream the answer.
+
+    Returns ``(source_documents, tokens, usage)`` where ``tokens`` yields text
+    pieces as the LLM produces them. Time to the first piece is recorded as
+    the ``llm_first_token`` stage.
+    """
+    with stage("retrieval"):
+        docs = qa_chain.retriever.get_relevant_documents(query)
+    prompt, usage = _stuff_prompt(qa_chain, docs, query)
+    llm = _llm(qa_chain)
+
+    def tokens():
+        first = True
+        with stage("llm"):
+            start = time.perf_counter()
+            for chunk in llm.stream(prompt):
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                    first = False
+                if chunk.content:
+                    yield chunk.content
+
+    return docs, tokens(), usage
+
+async def astream_rag_answer(qa_chain, query):
+    """Async ``stream_rag_answer``: retrieval runs in the executor, tokens come from ``llm.astream``."""
+    with stage("retrieval"):
+        docs = await qa_chain.retriever.ainvoke(query)
+    prompt, usage = _stuff_prompt(qa_chain, docs, query)
+    llm = _llm(qa_chain)
+
+    async def tokens():
+        first = True
+        with stage("llm"):
+            start = time.perf_counter()
+            async for chunk in llm.astream(prompt):
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                    first = False
+                if chunk.content:
+                    yield chunk.content
+
+    return docs, tokens(), usage
+
+def answer_batch(qa_chain, queries, fanout=8):
+    """Answer many questions: one batched retrieval, then up to ``fanout`` LLM calls at a time.
+
+    Returns ``(results, timings)``. Each result holds ``answer``, ``sources``,
+    ``citations``, ``usage`` and ``llm_seconds``, or ``error`` (with the
+    sources) if that question's LLM call failed.
+    """
+    timings = {}
+    start = time.perf_counter()
+    retrieved = qa_chain.retriever.get_relevant_documents_batch(queries, timings=timings)
+    timings["retrieval_seconds"] = round(time.perf_counter() - start, 4)
+    llm = _llm(qa_chain)
+
+    def answer(query, docs):
+        sources = {"sources": [doc.page_content for doc in docs], "citations": citations(docs)}
+        prompt, usage = _stuff_prompt(qa_chain, docs, query)
+        call_start = time.perf_counter()
+        try:
+            with stage("llm"):
+                result = llm.generate([[HumanMessage(content=prompt)]])
+        except Exception as e:
+            return {"error": f"An error occurred: {str(e)}", **sources}
+        _record_llm_usage(usage, result)
+        return {"answer": result.generations[0][0].message.content, **sources, "usage": usage,
+                "llm_seconds": round(time.perf_counter() - call_start, 4)}
+
+    llm_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, fanout)) as pool:
+        results = list(pool.map(answer, queries, retrieved))
+    timings["llm_seconds"] = round(time.perf_counter() - llm_start, 4)
+    return results, timings
+
+def with_retrieval_options(qa_chain, options):
+    """A shallow copy of ``qa_chain`` whose retriever has ``options`` (k, candidates, ...) applied."""
+    if not options:
+        return qa_chain
+    # construct() rather than pydantic's .copy(), which drops exclude=True fields such as callbacks.
+    retriever = type(qa_chain.retriever).construct(**{**qa_chain.retriever.__dict__, **options})
+    return type(qa_chain).construct(**{**qa_chain.__dict__, "retriever": retriever})
+
+def query_embedder_for(embeddings):
+    """The shared ``QueryEmbedder`` for ``embeddings``, configured from ``EMBEDDING``."""
+    return get_query_embedder(embeddings, EMBEDDING["query_cache_size"], EMBEDDING["query_batch_window_ms"] / 1000,
+                              EMBEDDING["query_max_batch"])
+
+def create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key: str, bm25=None, documents=None,
+                        chunk_metadata=None, llm=None, sharded=True):
+    """Build the retrieval QA chain over an index. ``llm`` replaces the Groq chat model
+    (the benchmarks pass ``benchmarks.common.FakeChatModel``); ``groq_api_key`` is then unused.
+    ``sharded=False`` retrieves in-process even with ``SHARDING["shards"] > 1``, as collections do;
+    sharded, ``vectorstore`` and ``bm25`` are unused and may be ``None``."""
+    if llm is None:
+        llm = ChatGroq(
+            temperature=0,
+            groq_api_key=groq_api_key,
+            model_name="llama3-8b-8192",
+            # Async calls (asgi.py) share one connection pool instead of one client per chain.
+            async_client=groq.AsyncGroq(api_key=groq_api_key, http_client=shared_async_http_client()).chat.completions
+        )
     
-    retriever = HybridRetriever(vectorstore, text_chunks, embeddings)
+    rerank_options = {}
+    if RERANK["enabled"]:
+        rerank_options = {
+            "reranker": get_reranker(RERANK["model"], RERANK["batch_size"], RERANK["cache_size"]),
+            "candidates": RERANK["candidates"],
+            "latency_budget": RERANK["latency_budget_ms"] / 1000,
+        }
+    retriever_options = {"k": RERANK["k"], "nprobe": ANN["nprobe"], "ef_search": ANN["ef_search"],
+                         "chunk_metadata": chunk_metadata, "query_embedder": query_embedder_for(embeddings),
+                         **rerank_options}
+    if sharded and SHARDING["shards"] > 1:
+        # Serves the bundle in INDEX_DIR, which every ingest has written by now.
+        shards = open_shards(INDEX_DIR, SHARDING["shards"], ANN, timeout=SHARDING["timeout_seconds"],
+                             drain_seconds=SHARDING["drain_seconds"])
+        retriever = ShardedRetriever(shards, embeddings, **retriever_options)
+    else:
+        # Bundles and fresh ingests both keep chunk i at FAISS row i.
+        chunk_ids = None
+        if vectorstore.index.ntotal == len(text_chunks):
+            chunk_ids = np.arange(len(text_chunks), dtype=np.int64)
+        retriever = HybridRetriever(vectorstore, text_chunks, embeddings, bm25=bm25, chunk_ids=chunk_ids,
+                                    **retriever_options)
     
     prompt_template = """
 You are an HR assistant. Use the following context from HR policies and documents to answer the question accurately and helpfully.
@@ -78,12 +293,20 @@ Answer:
         input_variables=["context", "question"]
     )
     
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
+    # "stuff", with retrieved chunks de-overlapped, merged and trimmed to CONTEXT["max_tokens"].
+    packer = ContextPacker(
+        max_tokens=CONTEXT["max_tokens"],
+        chunk_doc=chunk_documents_index(documents, len(text_chunks)),
+        max_overlap=CONTEXT["max_overlap_chars"]
+    )
+    qa_chain = RetrievalQA(
+        combine_documents_chain=PackedStuffDocumentsChain(
+            llm_chain=LLMChain(llm=llm, prompt=PROMPT),
+            document_variable_name="context",
+            packer=packer
+        ),
         retriever=retriever,
-        return_source_documents=True,
-        chain_type_kwargs={"prompt": PROMPT}
+        return_source_documents=True
     )
     
     return qa_chain
\ No newline at end of file
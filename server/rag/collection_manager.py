@@ -0,0 +1,173 @@
+"""Named collections, each with its own index, and an LRU of the loaded ones.
+
+A collection lives in ``<root>/<name>/``: its PDFs in ``uploaded_files/``,
+its bundle in ``index/`` and its exact-match answer cache in
+``query_cache.sqlite``. ``CollectionManager.get`` returns what the ``load``
+callable built from it (a chain and its caches), loading it on first use.
+Whenever the loaded collections' footprints add up to more than
+``memory_budget`` bytes, the least recently used ones are dropped until they
+fit, though never the one just loaded or queried.
+
+A footprint is counted rather than read off the process's RSS, which
+concurrent loads and queries would blur. It is every bundle file the index
+opens, memory-mapped (resident once queries have read it) or read into
+private memory (HNSW and SQ indexes, see ``rag.index_store``), plus
+``CHUNK_OVERHEAD_BYTES`` a chunk and what the answer caches hold. Caches
+keep growing after a load, so every resident collection is re-counted
+whenever one is loaded; until then up to each cache's ``max_entries`` of
+growth goes uncounted.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from rag.index_store import FAISS_NAME, VECTORS_NAME, bundle_exists, read_manifest
+
+NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+# Held per chunk outside the bundle files: the retriever's chunk id and row
+# arrays and ChunkMetadata's document index, int64 each.
+CHUNK_OVERHEAD_BYTES = 3 * 8
+
+
+class Collection:
+    """The on-disk paths of one collection."""
+
+    def __init__(self, root, name):
+        if not NAME_PATTERN.fullmatch(name):
+            raise ValueError("Collection names are 1-64 letters, digits, '-' or '_', starting with a letter or digit.")
+        self.name = name
+        self.dir = os.path.join(root, name)
+        self.upload_dir = os.path.join(self.dir, "uploaded_files")
+        self.index_dir = os.path.join(self.dir, "index")
+        self.cache_path = os.path.join(self.dir, "query_cache.sqlite")
+
+    def exists(self):
+        return bundle_exists(self.index_dir)
+
+    def manifest(self):
+        return read_manifest(self.index_dir)
+
+    def bytes(self):
+        """Memory a loaded copy of the bundle holds once read: the files its index opens and per-chunk arrays.
+
+        An ANN bundle's ``vectors.f32`` is only read by ingest and sharding, so
+        it is left out when there is a ``faiss.index``.
+        """
+        manifest = self.manifest()
+        files = manifest["files"]
+        opened = [entry["bytes"] for name, entry in files.items() if name != VECTORS_NAME or FAISS_NAME not in files]
+        return sum(opened) + CHUNK_OVERHEAD_BYTES * manifest["num_chunks"]
+
+
+class LoadedCollection:
+    """What the app's loader returns: the chain over a collection and its answer caches."""
+
+    def __init__(self, chain, query_cache, semantic_cache=None):
+        self.chain = chain
+        self.query_cache = query_cache
+        self.semantic_cache = semantic_cache
+
+    @property
+    def caches(self):
+        return self.query_cache, self.semantic_cache
+
+    def cache_bytes(self):
+        return sum(cache.memory_bytes() for cache in self.caches if cache is not None)
+
+
+class CollectionManager:
+    """Collections under ``root``, keeping the recently used ones loaded within ``memory_budget`` bytes.
+
+    ``load(collection)`` builds the loaded form of a ``Collection``. It runs
+    outside the manager's lock, under a per-collection one, so a slow load
+    holds up only queries to that collection.
+    """
+
+    def __init__(self, root, load, memory_budget):
+        self.root = root
+        self.memory_budget = memory_budget
+        self._load = load
+        self._resident = OrderedDict()  # name -> (loaded, bytes), least recently used first
+        self._resident_bytes = 0
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def collection(self, name):
+        """The ``Collection`` called ``name``; raises ``ValueError`` for an invalid name."""
+        return Collection(self.root, name)
+
+    def names(self):
+        """Collections that have an index, in name order."""
+        return sorted(name for name in os.listdir(self.root)
+                      if NAME_PATTERN.fullmatch(name) and bundle_exists(os.path.join(self.root, name, "index")))
+
+    def is_resident(self, name):
+        with self._lock:
+            return name in self._resident
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._loading.setdefault(name, threading.Lock())
+
+    def _touch(self, name):
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is None:
+                return None
+            self._resident.move_to_end(name)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, name):
+        """The loaded collection ``name``, loading it if needed; ``None`` if it has no index yet."""
+        collection = self.collection(name)
+        loaded = self._touch(name)
+        if loaded is not None:
+            return loaded
+        with self._name_lock(name):
+            loaded = self._touch(name)  # another request loaded it while this one waited
+            if loaded is not None:
+                return loaded
+            if not collection.exists():
+                return None
+            loaded = self._load(collection)
+            self._install(name, loaded, collection.bytes())
+        return loaded
+
+    def replace(self, name, load):
+        """Load ``name`` with ``load(collection)`` in place of whatever is resident, e.g. after an ingest."""
+        collection = self.collection(name)
+        with self._name_lock(name):
+            loaded = load(collection)
+            self._install(name, loaded, collection.bytes())
+        return loaded
+
+    def _install(self, name, loaded, size):
+        with self._lock:
+            self._resident.pop(name, None)
+            self._resident[name] = (loaded, size)
+            self.loads += 1
+            footprints = {resident: bundle_bytes + resident_loaded.cache_bytes()
+                          for resident, (resident_loaded, bundle_bytes) in self._resident.items()}
+            self._resident_bytes = sum(footprints.values())
+            # Queries already holding an evicted collection finish on it; it is freed after them.
+            while self._resident_bytes > self.memory_budget and len(self._resident) > 1:
+                evicted, _ = self._resident.popitem(last=False)
+                self._resident_bytes -= footprints[evicted]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": list(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
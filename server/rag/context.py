@@ -0,0 +1,178 @@
+"""Context assembly between the retriever and the "stuff" prompt."""
+import math
+from typing import Any
+
+import numpy as np
+from langchain.chains.combine_documents.stuff import StuffDocumentsChain
+from langchain.schema import Document
+
+try:
+    import tiktoken
+    # llama3 uses a 128k tiktoken BPE; cl100k_base counts within a few percent of it.
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:  # not installed, or its BPE file couldn't be downloaded
+    if not isinstance(e, ImportError):
+        print(f"Warning: tiktoken unavailable ({e}); estimating tokens from characters")
+    _encoding = None
+
+CHARS_PER_TOKEN = 4  # fallback estimate without tiktoken
+# Reported with every token count: "tiktoken", or "estimate" when counts are characters / CHARS_PER_TOKEN.
+TOKEN_COUNTER = "tiktoken" if _encoding is not None else "estimate"
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut ``text`` to at most ``max_tokens``, backing off to a word boundary."""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = _encoding.decode(tokens[:max_tokens])
+    else:
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text
+        cut = text[:max_tokens * CHARS_PER_TOKEN]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > len(cut) // 2 else cut).rstrip() + " ..."
+
+
+def overlap_length(left, right, max_overlap, min_overlap=20):
+    """Length of the longest suffix of ``left`` that is a prefix of ``right``, or 0."""
+    for length in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+class ContextPacker:
+    """Turns retrieved chunks into the passages that go into the prompt.
+
+    Chunks whose text overlaps in their document are joined into one
+    passage with the splitter's overlap removed. Where chunks carry their
+    character offset in the document (``start`` metadata, see
+    ``ChunkMetadata``), the offsets decide: consecutive stored chunks need
+    not be neighbours in the text, since deduplication drops chunks between
+    them. Otherwise chunks with consecutive ids are joined if the end of one
+    matches the start of the next. Chunks known to be from different
+    documents (``chunk_doc`` or ``source`` metadata) are never joined.
+    Exact duplicates are dropped. Passages keep the rank of their best chunk
+    and are added until ``max_tokens`` is reached; the one that crosses the
+    budget is truncated if at least ``min_tail_tokens`` of it still fit.
+    """
+
+    def __init__(self, max_tokens=1500, chunk_doc=None, max_overlap=300, min_tail_tokens=50):
+        self.max_tokens = max_tokens
+        self.chunk_doc = chunk_doc
+        self.max_overlap = max_overlap
+        self.min_tail_tokens = min_tail_tokens
+
+    def _same_document(self, left, right):
+        """Whether chunk documents ``left`` and ``right`` come from one document, or ``None`` if unknown."""
+        if self.chunk_doc is not None:
+            return bool(self.chunk_doc[left.metadata["chunk_id"]] == self.chunk_doc[right.metadata["chunk_id"]])
+        if left.metadata.get("source") is not None and right.metadata.get("source") is not None:
+            return left.metadata["source"] == right.metadata["source"]
+        return None
+
+    def _overlap(self, previous, text, doc):
+        """Characters of ``doc`` already at the end of passage ``text``, whose last chunk is ``previous``."""
+        same = self._same_document(previous, doc)
+        if same is False:
+            return 0
+        previous_start, start = previous.metadata.get("start"), doc.metadata.get("start")
+        if same and previous_start is not None and start is not None:
+            overlap = previous_start + len(previous.page_content) - start
+            if 0 < overlap < len(doc.page_content) and text.endswith(doc.page_content[:overlap]):
+                return overlap
+            return 0
+        if doc.metadata["chunk_id"] != previous.metadata["chunk_id"] + 1:
+            return 0
+        return overlap_length(text, doc.page_content, self.max_overlap)
+
+    def pack(self, docs):
+        """Return ``(passages, stats)``."""
+        seen = set()
+        ranked = []
+        for rank, doc in enumerate(docs):
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            ranked.append((rank, doc))
+
+        with_ids = sorted((doc.metadata["chunk_id"], rank, doc) for rank, doc in ranked
+                          if doc.metadata.get("chunk_id") is not None)
+        passages = [(rank, doc.page_content, [doc]) for rank, doc in ranked
+                    if doc.metadata.get("chunk_id") is None]
+        previous = None
+        for _, rank, doc in with_ids:
+            if previous is not None:
+                best, text, members = passages[-1]
+                overlap = self._overlap(previous, text, doc)
+                if overlap:
+                    passages[-1] = (min(best, rank), text + doc.page_content[overlap:], members + [doc])
+                    previous = doc
+                    continue
+            passages.append((rank, doc.page_content, [doc]))
+            previous = doc
+        passages.sort(key=lambda passage: passage[0])
+
+        tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+        packed, used, trimmed = [], 0, False
+        for _, text, members in passages:
+            tokens = count_tokens(text)
+            if used + tokens > self.max_tokens:
+                trimmed = True
+                remaining = self.max_tokens - used
+                if remaining < self.min_tail_tokens:
+                    break
+                text = truncate_tokens(text, remaining)
+                tokens = count_tokens(text)
+            packed.append(Document(page_content=text, metadata={
+                "chunk_ids": [member.metadata.get("chunk_id") for member in members]
+            }))
+            used += tokens
+            if trimmed:
+                break
+
+        stats = {
+            "chunks": len(docs),
+            "passages": len(packed),
+            "retrieved_tokens": tokens_before,
+            "context_tokens": used,
+            "trimmed": trimmed,
+        }
+        return packed, stats
+
+
+def chunk_documents_index(documents, num_chunks):
+    """Map chunk id -> document index from manifest ``documents`` records, or ``None``."""
+    if not documents or sum(doc["chunks"] for doc in documents) != num_chunks:
+        return None
+    return np.repeat(np.arange(len(documents)), [doc["chunks"] for doc in documents])
+
+
+class PackedStuffDocumentsChain(StuffDocumentsChain):
+    """``StuffDocumentsChain`` whose documents go through a ``ContextPacker`` first."""
+
+    packer: Any = None
+
+    def _get_inputs(self, docs, **kwargs):
+        if self.packer is not None:
+            docs, _ = self.packer.pack(docs)
+        return super()._get_inputs(docs, **kwargs)
+
+    def prompt_with_usage(self, docs, **kwargs):
+        """Return the formatted prompt and the packing stats plus ``prompt_tokens`` and ``token_counter``."""
+        if self.packer is not None:
+            docs, usage = self.packer.pack(docs)
+        else:
+            usage = {"chunks": len(docs), "passages": len(docs)}
+        prompt = self.llm_chain.prompt.format(**super()._get_inputs(docs, **kwargs))
+        usage["prompt_tokens"] = count_tokens(prompt)
+        usage["token_counter"] = TOKEN_COUNTER
+        return prompt, usage
@@ -0,0 +1,257 @@
+"""Duplicate chunks and repeated page boilerplate, removed at ingest.
+
+``strip_boilerplate`` drops the header and footer lines a document repeats
+page after page (page numbers included) before it is split. ``Deduplicator``
+then keeps the first copy of every chunk and records later copies, from the
+same document or another one, as extra sources of it instead of storing,
+embedding and indexing them again. Stored chunks keep their own character
+offsets in the stripped document (``start`` in ``ChunkMetadata``), so
+consecutive stored chunks with a dropped copy between them are not taken
+for neighbours in the text.
+
+Chunks with the same normalised words are exact duplicates. With a
+``max_distance`` above 0, chunks whose 64-bit SimHashes over word trigrams
+differ in at most that many bits are near-duplicates too, provided they
+carry the same numbers: re-issued policies differ in exactly those ("90
+days" against "60 days"), and the later wording would otherwise be dropped.
+Fingerprints are split into ``max_distance + 1`` blocks, so any such pair
+shares at least one block exactly and only chunks sharing a block are ever
+compared.
+"""
+import array
+import functools
+import hashlib
+import itertools
+import math
+import re
+
+import numpy as np
+
+FINGERPRINT_DTYPE = np.dtype([("simhash", "<u8"), ("digest", "<u8"), ("numbers", "<u8")])
+# An extra place a stored chunk appeared: its document (index into the manifest's
+# documents) and 1-based page, and whether that copy was exact or near.
+SOURCE_DTYPE = np.dtype([("chunk", "<i8"), ("document", "<i4"), ("page", "<i4"), ("exact", "i1")])
+SHINGLE_WORDS = 3
+
+_WORD = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+_word_hash = functools.lru_cache(maxsize=1 << 16)(_hash64)
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(values):
+    """splitmix64's finaliser, so every bit of a trigram hash depends on all three words."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def fingerprint(text):
+    """``(simhash, digest, numbers)`` of a chunk.
+
+    ``digest`` hashes its lowercased words, ignoring punctuation and spacing,
+    and ``numbers`` the numbers among them, in order.
+    """
+    words = _WORD.findall(text.lower())
+    digest = _hash64(" ".join(words))
+    numbers = _hash64(" ".join(_DIGITS.findall(text)))
+    hashes = np.array([_word_hash(word) for word in words] or [0], dtype=np.uint64)
+    # Trigram hashes from word hashes, combined with wrapping uint64 arithmetic.
+    shingles = hashes[:max(len(hashes) - SHINGLE_WORDS + 1, 1)].copy()
+    with np.errstate(over="ignore"):
+        for offset in range(1, min(SHINGLE_WORDS, len(hashes))):
+            shingles = shingles * _MULTIPLIER + hashes[offset:offset + len(shingles)]
+        shingles = _mix(shingles)
+    bits = np.unpackbits(shingles.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    simhash = np.packbits(bits.sum(axis=0) * 2 > len(shingles), bitorder="little").view("<u8")[0]
+    return int(simhash), digest, numbers
+
+
+class DuplicateIndex:
+    """Fingerprints of rows ``0..n-1``, searchable for exact and near matches.
+
+    ``max_distance`` 0 finds exact matches only.
+    """
+
+    def __init__(self, max_distance=0):
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        self._blocks = []
+        shift = 0
+        for i in range(blocks):
+            width = 64 // blocks + (i < 64 % blocks)
+            self._blocks.append((shift, (1 << width) - 1))
+            shift += width
+        self._buckets = [{} for _ in self._blocks]
+        self.simhashes = array.array("Q")
+        self.digests = array.array("Q")
+        self.numbers = array.array("Q")
+
+    def __len__(self):
+        return len(self.simhashes)
+
+    def add(self, simhash, digest, numbers):
+        """Add the next row's fingerprint."""
+        row = len(self.simhashes)
+        self.simhashes.append(simhash)
+        self.digests.append(digest)
+        self.numbers.append(numbers)
+        for (shift, mask), buckets in zip(self._blocks, self._buckets):
+            buckets.setdefault((simhash >> shift) & mask, array.array("q")).append(row)
+
+    def find(self, simhash, digest, numbers):
+        """``(row, exact)`` of a duplicate, the nearest if there are several near ones, or ``None``."""
+        best, best_distance = None, self.max_distance + 1
+        compared = set()
+        for (shift, mask), buckets in zip(self._blocks, self._buckets):
+            for row in buckets.get((simhash >> shift) & mask, ()):
+                if row in compared:
+                    continue
+                compared.add(row)
+                if self.digests[row] == digest:
+                    return row, True
+                if not self.max_distance or self.numbers[row] != numbers:
+                    continue
+                distance = (self.simhashes[row] ^ simhash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = row, distance
+        return (best, False) if best is not None else None
+
+    def truncate(self, size):
+        """Forget every row from ``size`` on."""
+        del self.simhashes[size:], self.digests[size:], self.numbers[size:]
+        for buckets in self._buckets:
+            for key in list(buckets):
+                rows = buckets[key]
+                while rows and rows[-1] >= size:
+                    rows.pop()
+                if not rows:
+                    del buckets[key]
+
+
+class Deduplicator:
+    """Decides chunk by chunk whether to store it or record it as another source of a stored one.
+
+    ``fingerprints`` (``FINGERPRINT_DTYPE``) and ``sources``
+    (``SOURCE_DTYPE``) carry over the rows and sources already in a bundle;
+    new rows are numbered after them.
+    """
+
+    def __init__(self, max_distance=0, fingerprints=None, sources=None):
+        self.index = DuplicateIndex(max_distance)
+        for simhash, digest, numbers in (fingerprints.tolist() if fingerprints is not None else ()):
+            self.index.add(simhash, digest, numbers)
+        self._sources = {name: array.array(code) for name, code in
+                         (("chunk", "q"), ("document", "i"), ("page", "i"), ("exact", "b"))}
+        if sources is not None:
+            for name, column in self._sources.items():
+                column.extend(sources[name].tolist())
+        self.carried_over = len(self._sources["chunk"])
+
+    def check(self, text, document, page):
+        """The stored row ``text`` duplicates, recording ``document`` and ``page`` as another source
+        of it, or ``None`` once ``text`` is taken as the next row."""
+        simhash, digest, numbers = fingerprint(text)
+        match = self.index.find(simhash, digest, numbers)
+        if match is None:
+            self.index.add(simhash, digest, numbers)
+            return None
+        row, exact = match
+        for name, value in (("chunk", row), ("document", document), ("page", page), ("exact", exact)):
+            self._sources[name].append(value)
+        return row
+
+    def truncate(self, size, document):
+        """Drop rows from ``size`` on and every source recorded for ``document``, e.g. after it failed."""
+        self.index.truncate(size)
+        columns = self._sources
+        keep = [i for i, (chunk, doc) in enumerate(zip(columns["chunk"], columns["document"]))
+                if chunk < size and doc != document]
+        for name, column in columns.items():
+            columns[name] = array.array(column.typecode, [column[i] for i in keep])
+
+    def fingerprints(self):
+        records = np.zeros(len(self.index), dtype=FINGERPRINT_DTYPE)
+        records["simhash"] = np.frombuffer(self.index.simhashes, dtype=np.uint64)
+        records["digest"] = np.frombuffer(self.index.digests, dtype=np.uint64)
+        records["numbers"] = np.frombuffer(self.index.numbers, dtype=np.uint64)
+        return records
+
+    def sources(self):
+        """Every source recorded, ordered by chunk (``SOURCE_DTYPE``)."""
+        records = np.zeros(len(self._sources["chunk"]), dtype=SOURCE_DTYPE)
+        for name, column in self._sources.items():
+            records[name] = np.frombuffer(column, dtype=records.dtype[name])
+        return records[np.argsort(records["chunk"], kind="stable")]
+
+    def counts(self):
+        """``(exact, near)`` duplicates found since construction."""
+        exact = sum(self._sources["exact"][self.carried_over:])
+        return exact, len(self._sources["exact"]) - self.carried_over - exact
+
+
+def _line_key(line):
+    """A line with case, spacing and numbers (page numbers, dates) normalised away."""
+    return _DIGITS.sub("#", " ".join(line.lower().split()))
+
+
+def _edge_lines(lines, edge_lines):
+    """Indices of the first and last ``edge_lines`` non-blank lines."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    top = filled[:edge_lines]
+    return top, [i for i in filled[-edge_lines:] if i not in top]
+
+
+def _repeated_edges(pages, edge_lines):
+    """``(top, bottom)`` line keys found at that edge of at least half of ``pages`` (three at least)."""
+    top_counts, bottom_counts = {}, {}
+    for page in pages:
+        lines = page.splitlines()
+        top, bottom = _edge_lines(lines, edge_lines)
+        for counts, indices in ((top_counts, top), (bottom_counts, bottom)):
+            for key in {_line_key(lines[i]) for i in indices}:
+                counts[key] = counts.get(key, 0) + 1
+    needed = max(3, math.ceil(len(pages) / 2))
+    return ({key for key, count in top_counts.items() if count >= needed},
+            {key for key, count in bottom_counts.items() if count >= needed})
+
+
+def _strip_page(page, top_keys, bottom_keys, edge_lines):
+    lines = page.splitlines(keepends=True)
+    top, bottom = _edge_lines(lines, edge_lines)
+    drop = set()
+    for indices, keys in ((top, top_keys), (reversed(bottom), bottom_keys)):
+        for i in indices:
+            if _line_key(lines[i]) not in keys:
+                break
+            drop.add(i)
+    if not drop:
+        return page, 0
+    return "".join(line for i, line in enumerate(lines) if i not in drop), len(drop)
+
+
+def strip_boilerplate(pages, sample_pages=16, edge_lines=2, stats=None):
+    """Yield a document's pages without the header and footer lines it repeats.
+
+    The first ``sample_pages`` pages are read ahead to learn which of the
+    first and last ``edge_lines`` lines of a page recur; those are then
+    stripped from every page, as long as they are still at that edge.
+    Documents shorter than three pages pass through untouched, and every page
+    is yielded, so page numbers don't shift. ``stats["boilerplate_lines"]``
+    counts the lines removed.
+    """
+    pages = iter(pages)
+    sample = list(itertools.islice(pages, sample_pages))
+    top_keys, bottom_keys = _repeated_edges(sample, edge_lines) if len(sample) >= 3 else (set(), set())
+    for page in itertools.chain(sample, pages):
+        if top_keys or bottom_keys:
+            page, removed = _strip_page(page, top_keys, bottom_keys, edge_lines)
+            if stats is not None:
+                stats["boilerplate_lines"] = stats.get("boilerplate_lines", 0) + removed
+        yield page
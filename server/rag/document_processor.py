@@ -1,54 +1,569 @@
+import bisect
+import hashlib
 import os
-import pickle
-from PyPDF2 import PdfReader
+import re
+import time
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-from langchain.vectorstores.faiss import FAISS
-from langchain.schema import Document
-
-def process_and_store_documents(upload_dir, vectorstore_path="vectorstore.pkl"):
-    doc_texts = []
-    for file_name in os.listdir(upload_dir):
-        if file_name.endswith('.pdf'):
-            pdf_path = os.path.join(upload_dir, file_name)
-            try:
-                pdf_reader = PdfReader(pdf_path)
-                text = "".join(page.extract_text() or "" for page in pdf_reader.pages)
-                if text.strip():
-                    doc_texts.append(text)
-                    print(f"Processed {file_name}: {len(text)} characters")
-                else:
-                    print(f"Warning: No text extracted from {file_name}")
-            except Exception as e:
-                print(f"Error processing {file_name}: {str(e)}")
-                continue
-
-    if not doc_texts:
-        raise ValueError("No valid PDF documents found or no text could be extracted.")
 
+from rag.ann import ADD_BATCH, build_index
+from rag.bm25 import SparseBM25
+from rag.dedup import FINGERPRINT_DTYPE, Deduplicator, fingerprint, strip_boilerplate
+from rag.embeddings import cached_embedder, get_embeddings
+from rag.extraction import ExtractionError, iter_extracted_pages
+from rag.index_store import (
+    BM25_NAME, BundleWriter, ChunkMetadata, ChunkStore, bundle_exists, load_bundle, read_manifest, vector_reader
+)
+from rag.metrics import ingest_stage, record_ingest_stage
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+_WINDOW = 4 * CHUNK_SIZE
+_LINE = re.compile(r"^[ \t]*(\S[^\n]*?)[ \t]*$", re.MULTILINE)
+_NUMBERED = re.compile(r"^(\d+(\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+\S")
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _no_progress(stage, done=None, total=None):
+    pass
+
+def _is_heading(line):
+    """Short line that reads like a title: numbered, ALL CAPS or Title Case, no closing punctuation."""
+    if len(line) < 3 or len(line) > 80 or line[-1] in ".,;:!?" or len(line.split()) > 10:
+        return False
+    if _NUMBERED.match(line):
+        return True
+    words = [word for word in line.split() if word[0].isalpha()]
+    if not words:
+        return False
+    return line.isupper() or all(word[0].isupper() or word.lower() in _MINOR_WORDS for word in words)
+
+def section_headings(text):
+    """``(offset, heading)`` for every heading-like line of ``text``, in order."""
+    return [(match.start(1), match.group(1)) for match in _LINE.finditer(text) if _is_heading(match.group(1))]
+
+class _HeadingScanner:
+    """``section_headings`` over a document fed in pieces, with offsets into the whole document.
+
+    Only the unfinished last line is kept between pieces, and not even that
+    once it is too long to be a heading.
+    """
+
+    def __init__(self):
+        self.line = ""
+        self.line_start = 0
+
+    def feed(self, text, final=False):
+        if self.line is None:
+            newline = text.find("\n")
+            if newline < 0:
+                self.line_start += len(text)
+                return []
+            self.line, self.line_start = "", self.line_start + newline + 1
+            text = text[newline + 1:]
+        line = self.line + text
+        cut = len(line) if final else line.rfind("\n") + 1
+        headings = [(self.line_start + offset, heading) for offset, heading in section_headings(line[:cut])]
+        self.line, self.line_start = line[cut:], self.line_start + cut
+        # Longer than _is_heading allows whatever the rest of the line holds.
+        if len(self.line) > 80 and len(self.line.strip(" \t")) > 80:
+            self.line, self.line_start = None, self.line_start + len(self.line)
+        return headings
+
+def iter_chunks(text_splitter, pages):
+    """Split one document's pages into ``(chunk, (page, start, section))`` as they arrive.
+
+    Pages are joined as extraction always has, so chunks and their overlap
+    run across page boundaries, but only a window of a few chunks is held:
+    once it is ``_WINDOW`` characters long it is split, every chunk but the
+    last is yielded, and the window restarts where the last chunk starts.
+    Each chunk gets the 1-based page it starts on, its character offset in
+    the document and the last heading at or before that offset.
+    """
+    scanner = _HeadingScanner()
+    heading_starts, headings = [], []
+    page_starts = []
+    window = ""
+    window_start = 0
+    length = 0
+    pages = iter(pages)
+    while True:
+        page = next(pages, None)
+        final = page is None
+        if final:
+            new_headings = scanner.feed("", final=True)
+        else:
+            page_starts.append(length)
+            length += len(page)
+            window += page
+            new_headings = scanner.feed(page)
+        heading_starts += [offset for offset, _ in new_headings]
+        headings += [heading for _, heading in new_headings]
+        if not final and len(window) < _WINDOW:
+            continue
+
+        chunks = text_splitter.split_text(window)
+        starts = []
+        start = 0
+        previous_length = 0
+        for chunk in chunks:
+            # Same search as the splitter's add_start_index: just past the previous chunk's overlap.
+            found = window.find(chunk, max(0, start + previous_length - CHUNK_OVERLAP))
+            start = found if found >= 0 else window.find(chunk)
+            previous_length = len(chunk)
+            starts.append(start)
+        done = len(chunks) if final else len(chunks) - 1
+        for chunk, start in zip(chunks[:done], starts):
+            start += window_start
+            heading = bisect.bisect_right(heading_starts, start) - 1
+            yield chunk, (bisect.bisect_right(page_starts, start), start, headings[heading] if heading >= 0 else None)
+        if final:
+            return
+
+        restart = starts[-1] if chunks else len(window)
+        window = window[restart:]
+        window_start += restart
+        # Keep the last heading before the window; later chunks may still fall under it.
+        drop = max(bisect.bisect_right(heading_starts, window_start) - 1, 0)
+        del heading_starts[:drop], headings[:drop]
+
+def _timed(items, timings, key):
+    """Iterate over ``items``, adding the time spent waiting for each one to ``timings[key]``."""
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        finally:
+            timings[key] += time.perf_counter() - start
+        yield item
+
+def iter_document_chunks(upload_dir, file_names, extraction=None, progress=_no_progress, timings=None,
+                         boilerplate_pages=None, stats=None):
+    """Yield ``(file_name, chunks)`` for each PDF, where ``chunks`` iterates over ``iter_chunks`` of its pages.
+
+    Extraction runs in a process pool (see ``rag.extraction``); ``extraction``
+    is passed through as its ``workers``/``pages_per_task``/``timeout``
+    options. Pages stream in while the document is being chunked; if the file
+    fails part way through, iterating ``chunks`` raises ``ExtractionError``.
+    Time spent waiting on extraction is added to ``timings["extract"]``.
+    With ``boilerplate_pages``, repeated headers and footers learned from
+    that many pages are stripped first (``rag.dedup.strip_boilerplate``),
+    counting the lines removed in ``stats``; chunk offsets are then into
+    the stripped text.
+    """
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, 
-        chunk_overlap=150,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len
     )
-    
-    texts = text_splitter.split_text("\n\n".join(doc_texts))
-    text_chunks = texts
-    
-    print(f"Created {len(texts)} text chunks")
-
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'}
-    )
-    
-    vectorstore = FAISS.from_texts(texts, embedding=embeddings)
-    
-    with open(vectorstore_path, "wb") as f:
-        pickle.dump({
-            'vectorstore': vectorstore,
-            'text_chunks': text_chunks,
-            'embeddings': embeddings
-        }, f)
-        
-    return vectorstore, embeddings, text_chunks
\ No newline at end of file
+    timings = timings if timings is not None else {"extract": 0.0}
+    pdf_paths = [os.path.join(upload_dir, file_name) for file_name in file_names]
+    progress("extract", 0, len(pdf_paths))
+    extracted = iter_extracted_pages(pdf_paths, **(extraction or {}))
+    for parsed, (file_name, pages) in enumerate(_timed(extracted, timings, "extract"), start=1):
+        pages = _timed(pages, timings, "extract")
+        if boilerplate_pages:
+            pages = strip_boilerplate(pages, boilerplate_pages, stats=stats)
+        yield file_name, iter_chunks(text_splitter, pages)
+        progress("extract", parsed, len(pdf_paths))
+
+def _checked(file_name, chunks, duplicates=0):
+    if not chunks:
+        print(f"Warning: No text extracted from {file_name}")
+        return False
+    if duplicates:
+        print(f"Processed {file_name}: {chunks} chunks, {duplicates} of them already stored")
+    else:
+        print(f"Processed {file_name}: {chunks} chunks")
+    return True
+
+def _document_record(file_name, sha256, stored, seen, deduplicator):
+    record = {"name": file_name, "sha256": sha256, "chunks": stored}
+    if deduplicator is not None:
+        record["duplicates"] = seen - stored
+    return record
+
+def chunk_documents(upload_dir, file_names, hashes, extraction=None, progress=_no_progress, deduplicator=None,
+                    first_document=0, boilerplate_pages=None, stats=None):
+    """Extract and split each PDF on its own so every chunk belongs to one document.
+
+    Returns the chunk texts, one ``(page, start, section)`` tuple per chunk
+    (see ``iter_chunks``) and one ``{"name", "sha256", "chunks"}`` record per
+    document, in chunk order. Everything is held in memory; full rebuilds
+    go through ``stream_documents`` instead.
+
+    With a ``rag.dedup.Deduplicator``, chunks it has seen before are left out
+    and recorded as sources of the stored copy; the documents returned are
+    numbered from ``first_document`` and their records count the
+    ``duplicates`` dropped. ``stats["chunks_seen"]`` counts every chunk.
+    """
+    texts = []
+    chunk_meta = []
+    documents = []
+    timings = {"extract": 0.0}
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    for file_name, chunks in iter_document_chunks(upload_dir, file_names, extraction, progress, timings,
+                                                  boilerplate_pages, stats):
+        try:
+            chunks = list(chunks)
+        except ExtractionError as e:
+            print(f"Error processing {file_name}: {str(e)}")
+            continue
+        document = first_document + len(documents)
+        kept = [(chunk, metadata) for chunk, metadata in chunks
+                if deduplicator is None or deduplicator.check(chunk, document, metadata[0]) is None]
+        if not _checked(file_name, len(chunks), len(chunks) - len(kept)):
+            continue
+        stats["chunks_seen"] = stats.get("chunks_seen", 0) + len(chunks)
+        texts.extend(chunk for chunk, _ in kept)
+        chunk_meta.extend(metadata for _, metadata in kept)
+        documents.append(_document_record(file_name, hashes[file_name], len(kept), len(chunks), deduplicator))
+    # Splitting overlaps extraction of later pages; "extract" is the time spent waiting on the pool.
+    record_ingest_stage("extract", timings["extract"])
+    record_ingest_stage("split", time.perf_counter() - start - timings["extract"])
+    return texts, chunk_meta, documents
+
+def _embedding_stats(chunks, cached, seconds):
+    print(f"Embedded {chunks} chunks ({cached} from cache) in {seconds:.2f}s")
+    return {
+        "chunks": chunks,
+        "cached": cached,
+        "embedded": chunks - cached,
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(chunks / seconds, 1) if seconds > 0 else None,
+    }
+
+def stream_documents(writer, upload_dir, file_names, hashes, embeddings, embedding_model, extraction=None,
+                     embedding=None, progress=_no_progress, deduplicator=None, boilerplate_pages=None, stats=None):
+    """Extract, split and embed PDFs into a ``BundleWriter`` a batch at a time.
+
+    Chunks are embedded and appended in batches of ``embedding["batch_size"]``
+    as pages arrive, so memory holds a window of pages and one batch rather
+    than the corpus. Chunks of a file that fails part way through are
+    dropped from the writer again. Returns one ``{"name", "sha256",
+    "chunks"}`` record per document and the embedding stats.
+    ``deduplicator``, ``boilerplate_pages`` and ``stats`` are as for
+    ``chunk_documents``; duplicates are dropped before they are embedded.
+    """
+    options = embedding or {}
+    batch_size = options.get("batch_size", 64)
+    embedder, store = cached_embedder(embeddings, embedding_model, options.get("cache_path"), batch_size)
+    hits_before = store.hits if store else 0
+    timings = {"extract": 0.0, "embed": 0.0}
+    texts, chunk_meta = [], []
+    embedded = 0
+
+    def flush():
+        nonlocal embedded
+        start = time.perf_counter()
+        vectors = embedder.embed_documents(texts)
+        timings["embed"] += time.perf_counter() - start
+        writer.append(texts, vectors, chunk_meta)
+        embedded += len(texts)
+        progress("embed", embedded, None)
+        texts.clear()
+        chunk_meta.clear()
+
+    documents = []
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    for file_name, chunks in iter_document_chunks(upload_dir, file_names, extraction, progress, timings,
+                                                  boilerplate_pages, stats):
+        first_row = len(writer) + len(texts)
+        document = len(documents)
+        seen = 0
+        try:
+            for chunk, metadata in chunks:
+                seen += 1
+                if deduplicator is not None and deduplicator.check(chunk, document, metadata[0]) is not None:
+                    continue
+                texts.append(chunk)
+                chunk_meta.append(metadata)
+                if len(texts) >= batch_size:
+                    flush()
+        except ExtractionError as e:
+            print(f"Error processing {file_name}: {str(e)}")
+            if first_row < len(writer):
+                writer.truncate(first_row)
+            keep = max(first_row - len(writer), 0)
+            del texts[keep:], chunk_meta[keep:]
+            if deduplicator is not None:
+                deduplicator.truncate(first_row, document)
+            continue
+        count = len(writer) + len(texts) - first_row
+        if _checked(file_name, seen, seen - count):
+            stats["chunks_seen"] = stats.get("chunks_seen", 0) + seen
+            documents.append(_document_record(file_name, hashes[file_name], count, seen, deduplicator))
+    if texts:
+        flush()
+
+    # Stages interleave; "split" is what's left of the loop: splitting and writing chunks.
+    record_ingest_stage("extract", timings["extract"])
+    record_ingest_stage("embed", timings["embed"])
+    record_ingest_stage("split", time.perf_counter() - start - timings["extract"] - timings["embed"])
+    cached = store.hits - hits_before if store else 0
+    return documents, _embedding_stats(embedded, cached, timings["embed"])
+
+def _compaction(stats, stored, deduplicator):
+    """``report["dedup"]``: chunks seen and stored, duplicates dropped and boilerplate lines removed."""
+    seen = stats.get("chunks_seen", 0)
+    exact, near = deduplicator.counts() if deduplicator is not None else (0, 0)
+    if exact or near:
+        print(f"Stored {stored} of {seen} chunks ({exact} exact and {near} near duplicates)")
+    return {
+        "chunks_seen": seen,
+        "chunks_stored": stored,
+        "exact_duplicates": exact,
+        "near_duplicates": near,
+        "boilerplate_lines": stats.get("boilerplate_lines", 0),
+        "compaction_ratio": round(seen / stored, 3) if stored else None,
+    }
+
+def embed_texts(texts, embeddings, embedding_model, embedding=None, progress=_no_progress):
+    """Embed chunk texts through the persistent cache; returns ``(vectors, stats)``."""
+    options = embedding or {}
+    batch_size = options.get("batch_size", 64)
+    embedder, store = cached_embedder(embeddings, embedding_model, options.get("cache_path"), batch_size)
+    hits_before = store.hits if store else 0
+    start = time.perf_counter()
+    vectors = []
+    progress("embed", 0, len(texts))
+    for batch_start in range(0, len(texts), batch_size):
+        vectors.extend(embedder.embed_documents(texts[batch_start:batch_start + batch_size]))
+        progress("embed", len(vectors), len(texts))
+    seconds = time.perf_counter() - start
+    record_ingest_stage("embed", seconds)
+
+    cached = store.hits - hits_before if store else 0
+    return vectors, _embedding_stats(len(texts), cached, seconds)
+
+def _kept_vectors(index_dir, manifest, chunks, embeddings, embedding_model, embedding=None):
+    """``read_rows(start, end)`` over the bundle's stored vectors (see ``vector_reader``).
+
+    An index that can't give its vectors back, like an IVF index written
+    without a direct map, has the chunks embedded again instead.
+    """
+    read_rows = vector_reader(index_dir, manifest)
+    try:
+        read_rows(0, min(1, manifest["num_chunks"]))
+    except RuntimeError:
+        print("Warning: index vectors can't be read back; embedding kept chunks again.")
+        return lambda start, end: embed_texts(chunks[start:end], embeddings, embedding_model, embedding)[0]
+    return read_rows
+
+def process_and_store_documents(upload_dir, index_dir="index", bm25_compat=False,
+                                embedding_model="sentence-transformers/all-MiniLM-L6-v2",
+                                incremental=False, extraction=None, embedding=None, progress=None, ann=None,
+                                embeddings=None, dedup=None, sharded=False):
+    """Build the index bundle for every PDF in ``upload_dir``.
+
+    With ``incremental=True`` and an existing bundle, PDFs whose content hash is
+    unchanged are skipped; only new or changed files are extracted and
+    embedded, and chunks of changed or deleted files are removed. A full
+    rebuild streams instead (see ``stream_documents``): memory holds a window
+    of pages and one embedding batch rather than the corpus, and the returned
+    vectorstore, chunks and BM25 are memory-mapped from the written bundle.
+
+    Returns ``(vectorstore, embeddings, text_chunks, bm25, report)``. ``report``
+    lists the added/updated/removed/unchanged file names and, for incremental
+    runs, ``stale_sources``: the texts of every chunk that was removed, which
+    is what cached answers citing them need to be checked against. It is ``None`` after a
+    full rebuild, meaning everything is stale. ``report["embedding"]`` holds
+    the embedding throughput.
+
+    ``embedding`` takes ``batch_size``, ``threads`` and ``cache_path`` (the
+    on-disk embedding cache; off when unset). ``progress(stage, done, total)``
+    is called as files are extracted (``"extract"``), chunks are embedded
+    (``"embed"``; no total on a full rebuild) and the bundle is written
+    (``"persist"``). ``ann`` selects
+    the FAISS index kind and its build options (``config.ANN``); flat if unset.
+    ``embeddings`` replaces the ``embedding_model`` weights (the benchmarks pass
+    ``HashingEmbeddings``); ``embedding_model`` still names the vectors.
+
+    With ``sharded`` the bundle is about to be served by shard workers
+    (``rag.sharding``), so only its chunks are opened afterwards: the
+    returned vectorstore and BM25 index are ``None``.
+
+    ``dedup`` (``config.DEDUP``) strips repeated page headers and footers and
+    stores duplicate chunks once (see ``rag.dedup``); off if unset.
+    ``report["dedup"]`` then counts the chunks seen and stored by this run,
+    the exact and near duplicates dropped and the boilerplate lines removed;
+    ``compaction_ratio`` is chunks seen per chunk stored.
+    """
+    progress = progress or _no_progress
+    file_names = sorted(name for name in os.listdir(upload_dir) if name.endswith('.pdf'))
+    hashes = {name: hash_file(os.path.join(upload_dir, name)) for name in file_names}
+
+    options = embedding or {}
+    if embeddings is None:
+        embeddings = get_embeddings(embedding_model, options.get("batch_size", 64), options.get("threads"))
+
+    dedup = dedup or {}
+    boilerplate_pages = dedup.get("sample_pages", 16) if dedup.get("strip_boilerplate") else None
+    previous = read_manifest(index_dir) if incremental and bundle_exists(index_dir) else None
+    if previous is not None:
+        if sum(doc["chunks"] for doc in previous["documents"]) != previous["num_chunks"]:
+            print("Warning: index has no per-document records. Falling back to a full rebuild.")
+        elif previous["embedding_model"] != embedding_model:
+            print("Warning: index was built with a different embedding model. Falling back to a full rebuild.")
+        else:
+            return _update_documents(upload_dir, index_dir, embeddings, embedding_model,
+                                     file_names, hashes, previous, extraction, embedding, progress, ann, dedup,
+                                     sharded)
+
+    deduplicator = Deduplicator(dedup.get("max_distance", 0)) if dedup.get("enabled") else None
+    stats = {}
+    writer = BundleWriter(index_dir)
+    try:
+        documents, embedding_stats = stream_documents(writer, upload_dir, file_names, hashes, embeddings,
+                                                      embedding_model, extraction, embedding, progress,
+                                                      deduplicator, boilerplate_pages, stats)
+        if not len(writer):
+            raise ValueError("No valid PDF documents found or no text could be extracted.")
+        print(f"Created {len(writer)} text chunks")
+
+        options = dict(ann or {})
+        with ingest_stage("index"):
+            writer.write_index(*build_index(writer.vectors(), options.pop("kind", "flat"), options))
+        with ingest_stage("bm25"):
+            writer.write_bm25(SparseBM25.from_batches(writer.texts(), compat=bm25_compat))
+        progress("persist")
+        with ingest_stage("persist"):
+            if deduplicator is not None:
+                writer.commit(embedding_model, documents, deduplicator.sources(), deduplicator.fingerprints())
+            else:
+                writer.commit(embedding_model, documents)
+    except Exception:
+        writer.abort()
+        raise
+    # Each index is written as soon as it's built; serve them memory-mapped, as at startup.
+    vectorstore, text_chunks, bm25, _ = load_bundle(index_dir, embeddings, search=not sharded)
+
+    report = {
+        "added": [doc["name"] for doc in documents],
+        "updated": [],
+        "removed": [],
+        "unchanged": [],
+        "stale_sources": None,
+        "embedding": embedding_stats,
+        "dedup": _compaction(stats, len(text_chunks), deduplicator) if dedup else None,
+    }
+    return vectorstore, embeddings, text_chunks, bm25, report
+
+def _dependents(previous_documents, known, sources, stale_names):
+    """Documents whose duplicate chunks are stored under one of ``stale_names`` (or under a dependent)."""
+    names = [doc["name"] for doc in previous_documents]
+    dependents = set()
+    going = set(stale_names)
+    while going and len(sources):
+        rows = [row for name in going for row in known[name][1]]
+        found = {names[document] for document in sources["document"][np.isin(sources["chunk"], rows)].tolist()}
+        going = found - set(stale_names) - dependents
+        dependents |= going
+    return dependents
+
+def _update_documents(upload_dir, index_dir, embeddings, embedding_model, file_names, hashes, previous,
+                      extraction, embedding, progress, ann, dedup, sharded=False):
+    known = {}
+    row = 0
+    for doc in previous["documents"]:
+        known[doc["name"]] = (doc, range(row, row + doc["chunks"]))
+        row += doc["chunks"]
+
+    unchanged = [name for name in file_names if name in known and known[name][0]["sha256"] == hashes[name]]
+    removed = [name for name in known if name not in hashes]
+    chunk_metadata = ChunkMetadata.open(index_dir)
+    # A chunk stored once for several documents goes with the one it's stored under;
+    # the others are extracted again to get it back.
+    dependents = _dependents(previous["documents"], known, chunk_metadata.sources,
+                             {name for name in file_names if name in known and name not in unchanged} | set(removed))
+    if dependents:
+        print(f"Re-extracting {len(dependents)} unchanged documents that shared chunks with changed ones")
+        unchanged = [name for name in unchanged if name not in dependents]
+    updated = [name for name in file_names if name in known and name not in unchanged]
+    added = [name for name in file_names if name not in known]
+
+    chunks = ChunkStore.open(index_dir)
+    ann_info = previous.get("ann", {"kind": "flat"})
+    requested = (ann or {}).get("kind", "flat")
+    stale_rows = sorted(i for name in updated + removed for i in known[name][1])
+    stale_sources = {chunks[i] for i in stale_rows}
+
+    # Sources found in documents that stay, renumbered for the rows and documents that remain.
+    kept_rows = np.setdiff1d(np.arange(len(chunks)), stale_rows)
+    sources = chunk_metadata.sources
+    document_ids = np.full(len(previous["documents"]), -1)
+    kept_documents = [i for i, doc in enumerate(previous["documents"]) if doc["name"] in unchanged]
+    document_ids[kept_documents] = np.arange(len(kept_documents))
+    sources = sources[np.isin(sources["chunk"], kept_rows) & (document_ids[sources["document"]] >= 0)]
+    sources["chunk"] = np.searchsorted(kept_rows, sources["chunk"])
+    sources["document"] = document_ids[sources["document"]]
+
+    deduplicator = None
+    stats = {}
+    if dedup.get("enabled"):
+        fingerprints = chunk_metadata.fingerprints
+        if fingerprints is None or len(fingerprints) != len(chunks) or fingerprints.dtype != FINGERPRINT_DTYPE:
+            # bundles written without dedup, or with an older fingerprint layout
+            fingerprints = np.array([fingerprint(text) for text in chunks], dtype=FINGERPRINT_DTYPE)
+        deduplicator = Deduplicator(dedup.get("max_distance", 0), fingerprints[kept_rows], sources)
+    boilerplate_pages = dedup.get("sample_pages", 16) if dedup.get("strip_boilerplate") else None
+    new_texts, new_meta, new_documents = chunk_documents(upload_dir, added + updated, hashes, extraction, progress,
+                                                         deduplicator, len(kept_documents), boilerplate_pages, stats)
+    if deduplicator is not None:
+        sources = deduplicator.sources()
+    vectors, embedding_stats = embed_texts(new_texts, embeddings, embedding_model, embedding, progress)
+    documents = [known[doc["name"]][0] for doc in previous["documents"] if doc["name"] in unchanged]
+    documents += new_documents
+
+    if not len(kept_rows) and not new_texts:
+        raise ValueError("No valid PDF documents found or no text could be extracted.")
+    print(f"Incremental ingest: {len(added)} added, {len(updated)} updated, {len(removed)} removed, "
+          f"{len(unchanged)} unchanged ({len(new_texts)} chunks embedded, {len(stale_rows)} removed)")
+
+    if stale_rows or new_documents or ann_info.get("requested", ann_info["kind"]) != requested:
+        # Kept chunks bring their vectors from the bundle; only the new ones were embedded.
+        read_rows = _kept_vectors(index_dir, previous, chunks, embeddings, embedding_model, embedding)
+        writer = BundleWriter(index_dir)
+        try:
+            for document in kept_documents:
+                rows = known[previous["documents"][document]["name"]][1]
+                for batch_start in range(rows.start, rows.stop, ADD_BATCH):
+                    batch_end = min(batch_start + ADD_BATCH, rows.stop)
+                    writer.append(chunks[batch_start:batch_end], read_rows(batch_start, batch_end),
+                                  chunk_metadata.rows(batch_start, batch_end))
+            writer.append(new_texts, vectors, new_meta)
+            options = dict(ann or {})
+            with ingest_stage("index"):
+                writer.write_index(*build_index(writer.vectors(), options.pop("kind", "flat"), options))
+            with ingest_stage("bm25"):
+                writer.write_bm25(SparseBM25.load(os.path.join(index_dir, BM25_NAME)).updated(stale_rows, new_texts))
+            progress("persist")
+            with ingest_stage("persist"):
+                writer.commit(embedding_model, documents, sources,
+                              deduplicator.fingerprints() if deduplicator is not None else None)
+        except Exception:
+            writer.abort()
+            raise
+    vectorstore, text_chunks, bm25, _ = load_bundle(index_dir, embeddings, search=not sharded)
+
+    report = {
+        "added": added,
+        "updated": updated,
+        "removed": removed,
+        "unchanged": unchanged,
+        "stale_sources": stale_sources,
+        "embedding": embedding_stats,
+        "dedup": _compaction(stats, len(new_texts), deduplicator) if dedup else None,
+    }
+    return vectorstore, embeddings, text_chunks, bm25, report
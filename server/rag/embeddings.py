@@ -0,0 +1,238 @@
+"""Embedding model sharing, a persistent content-addressed embedding cache for
+chunks and a shared, micro-batching query embedder."""
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+from langchain_core.stores import BaseStore
+
+from rag.semantic_cache import normalize_query
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_embeddings(model_name, batch_size=64, threads=None):
+    """Return the process-wide embedding model for ``model_name``, loading it once."""
+    with _models_lock:
+        if model_name not in _models:
+            if threads:
+                import torch
+                torch.set_num_threads(threads)
+            _models[model_name] = HuggingFaceEmbeddings(
+                model_name=model_name,
+                model_kwargs={'device': 'cpu'},
+                encode_kwargs={'batch_size': batch_size}
+            )
+        return _models[model_name]
+
+
+class EmbeddingStore(BaseStore):
+    """SQLite-backed map from chunk text to its embedding for one model.
+
+    Rows are keyed by ``sha256(model_name + NUL + text)``, so identical chunks
+    from any document share one entry and switching models never returns a
+    stale vector. Vectors are stored as raw float32 bytes.
+    """
+
+    def __init__(self, path, model_name):
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def mget(self, keys):
+        hashed = [self._key(text) for text in keys]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit.
+            for start in range(0, len(hashed), 500):
+                batch = hashed[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                found.update(rows)
+        values = [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in hashed
+        ]
+        hits = sum(value is not None for value in values)
+        self.hits += hits
+        self.misses += len(values) - hits
+        return values
+
+    def mset(self, key_value_pairs):
+        rows = [
+            (self._key(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in key_value_pairs
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+
+    def mdelete(self, keys):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(self._key(text),) for text in keys])
+
+    def yield_keys(self, prefix=None):
+        # Keys are one-way hashes of the text, so there is nothing useful to list.
+        return iter(())
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def cached_embedder(embeddings, model_name, cache_path=None, batch_size=64):
+    """Wrap ``embeddings`` so document vectors are read from / written to ``cache_path``.
+
+    Returns ``(embedder, store)``; ``store`` is ``None`` when caching is off.
+    Missing vectors are computed ``batch_size`` at a time and written back
+    after each batch.
+    """
+    if not cache_path:
+        return embeddings, None
+    with _stores_lock:
+        key = (os.path.abspath(cache_path), model_name)
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(cache_path, model_name)
+        store = _stores[key]
+    return CacheBackedEmbeddings(embeddings, store, batch_size=batch_size), store
+
+
+class QueryEmbedder:
+    """Embeds each question once: an LRU of normalised question -> vector in front of the model.
+
+    Everything that needs a request's question vector (the semantic cache,
+    FAISS search) asks here, so a request costs at most one forward pass and
+    a repeated question none. Questions are normalised with
+    ``normalize_query`` before embedding, so the key and the vector agree.
+
+    Misses go to one background thread, which embeds up to ``max_batch``
+    queued questions per forward pass: everything that arrived while the
+    previous pass ran, plus whatever comes within ``batch_window`` seconds of
+    the first. Identical questions in flight share one slot in the batch.
+    Returned vectors are read-only.
+    """
+
+    def __init__(self, embeddings, max_entries=4096, batch_window=0.0, max_batch=64):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self.hits = 0
+        self.misses = 0
+        self.forward_passes = 0
+        self.embedded = 0
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._pending = {}  # normalised question -> Future
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+
+    def embed(self, query):
+        return self.embed_many([query])[0]
+
+    def embed_many(self, queries):
+        """One float32 vector per question, in order."""
+        texts = [normalize_query(query) for query in queries]
+        vectors = {}
+        futures = {}
+        with self._lock:
+            for text in texts:
+                if text in vectors or text in futures:
+                    continue
+                vector = self._cache.get(text)
+                if vector is not None:
+                    self._cache.move_to_end(text)
+                    self.hits += 1
+                    vectors[text] = vector
+                    continue
+                self.misses += 1
+                future = self._pending.get(text)
+                if future is None:
+                    future = self._pending[text] = Future()
+                    self._queue.put(text)
+                futures[text] = future
+            if futures and self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                self._worker.start()
+        for text, future in futures.items():
+            vectors[text] = future.result()
+        return [vectors[text] for text in texts]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if self.batch_window:
+                time.sleep(self.batch_window)
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                vectors = np.asarray(self.embeddings.embed_documents(batch), dtype=np.float32)
+            except Exception as e:
+                with self._lock:
+                    futures = [self._pending.pop(text) for text in batch]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            vectors.setflags(write=False)
+            with self._lock:
+                self.forward_passes += 1
+                self.embedded += len(batch)
+                if self.max_entries:
+                    for text, vector in zip(batch, vectors):
+                        self._cache[text] = vector
+                    while len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+                futures = [self._pending.pop(text) for text in batch]
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "forward_passes": self.forward_passes,
+                "embedded": self.embedded,
+                "mean_batch": round(self.embedded / self.forward_passes, 2) if self.forward_passes else None,
+            }
+
+
+_query_embedders = {}
+
+
+def get_query_embedder(embeddings, max_entries=4096, batch_window=0.0, max_batch=64):
+    """Return the process-wide ``QueryEmbedder`` in front of ``embeddings``, creating it once."""
+    with _models_lock:
+        embedder = _query_embedders.get(id(embeddings))
+        if embedder is None:
+            # The embedder holds a reference, so the id is never reused while it is registered.
+            embedder = _query_embedders[id(embeddings)] = QueryEmbedder(embeddings, max_entries, batch_window,
+                                                                         max_batch)
+        return embedder
@@ -0,0 +1,160 @@
+"""Parallel PDF text extraction.
+
+PdfReader is pure Python, so extraction runs in a process pool rather than
+threads. Work is split by file and by page range. Pages are handed back in
+input order as their range arrives, and only a bounded number of ranges are
+extracted ahead of the consumer, so memory doesn't grow with the number or
+size of the files while the caller chunks and embeds what it already has.
+
+Workers are fresh interpreters from a fork server (spawned where there is
+none), not forks of the caller: ingest runs on a thread of the serving
+process, and forking a process whose other threads may hold locks can
+deadlock the child. The fork server preloads only this module and PyPDF2,
+so each worker starts from that rather than from the server. Like any
+spawned worker, it still imports the caller's ``__main__``, which must be
+safe to import (see ``multiprocessing``'s programming guidelines).
+"""
+import collections
+import multiprocessing
+import os
+import time
+
+from PyPDF2 import PdfReader
+
+
+class ExtractionError(Exception):
+    """A PDF couldn't be read, or waiting on it took longer than the timeout."""
+
+
+def _extract_pages(pdf_path, start, end):
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _count_pages(pdf_path):
+    return len(PdfReader(pdf_path).pages)
+
+
+def _pool(workers):
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return context.Pool(workers)
+
+
+def _read_serially(pdf_path):
+    try:
+        reader = PdfReader(pdf_path)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+    except Exception as e:
+        raise ExtractionError(str(e)) from e
+
+
+class _PageRanges:
+    """Page-range tasks for ``pdf_paths`` in file order, submitted at most ``max_pending`` ahead of the consumer."""
+
+    def __init__(self, pool, pdf_paths, pages_per_task, timeout, max_pending):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.timed_out = False
+        self._pending = 0
+        self._queue = collections.deque()
+        counts = [pool.apply_async(_count_pages, (pdf_path,)) for pdf_path in pdf_paths]
+        self._tasks = self._submit(pdf_paths, counts, pages_per_task)
+
+    def _submit(self, pdf_paths, counts, pages_per_task):
+        """Yield ``(file index, task)`` for each page range of each file, then ``(file index, None)``."""
+        for index, (pdf_path, count) in enumerate(zip(pdf_paths, counts)):
+            try:
+                pages = count.get(self.timeout)
+            except multiprocessing.TimeoutError:
+                self.timed_out = True
+                yield index, ExtractionError(f"timed out after {self.timeout}s reading the page count")
+            except Exception as e:
+                yield index, ExtractionError(str(e))
+            else:
+                for start in range(0, pages, pages_per_task):
+                    self._pending += 1
+                    yield index, self.pool.apply_async(
+                        _extract_pages, (pdf_path, start, min(start + pages_per_task, pages))
+                    )
+            yield index, None
+
+    def _pop(self, index):
+        """Next task of file ``index``, or ``None`` once the file has none left."""
+        while self._pending < self.max_pending:
+            task = next(self._tasks, None)
+            if task is None:
+                break
+            self._queue.append(task)
+        if not self._queue or self._queue[0][0] != index:
+            return None
+        _, task = self._queue.popleft()
+        if task is not None and not isinstance(task, ExtractionError):
+            self._pending -= 1
+        return task
+
+    def pages(self, index):
+        waited = 0.0
+        while True:
+            task = self._pop(index)
+            if task is None:
+                return
+            if isinstance(task, ExtractionError):
+                raise task
+            start = time.monotonic()
+            try:
+                texts = task.get(max(self.timeout - waited, 0))
+            except multiprocessing.TimeoutError:
+                self.timed_out = True
+                raise ExtractionError(f"timed out after {self.timeout}s") from None
+            except Exception as e:
+                raise ExtractionError(str(e)) from e
+            waited += time.monotonic() - start
+            yield from texts
+
+    def discard(self, index):
+        """Drop the tasks of file ``index`` that the consumer didn't take."""
+        while self._pop(index) is not None:
+            pass
+
+
+def iter_extracted_pages(pdf_paths, workers=None, pages_per_task=16, timeout=120, max_pending=None):
+    """Yield ``(file_name, pages)`` for each PDF, in the order given.
+
+    ``pages`` iterates over the file's page texts as they are extracted, and
+    is done with once the next file is taken. If the file can't be read, or
+    waiting on it takes more than ``timeout`` seconds in all, it raises
+    ``ExtractionError``, possibly after some pages; the caller should drop
+    whatever it kept from that file. At most ``max_pending`` page ranges
+    (default ``4 * workers``) are extracted ahead of the consumer.
+    ``workers=1`` extracts in the calling process, one page at a time.
+    """
+    workers = workers or os.cpu_count() or 1
+    if not pdf_paths:
+        return
+    if workers == 1:
+        for pdf_path in pdf_paths:
+            yield os.path.basename(pdf_path), _read_serially(pdf_path)
+        return
+
+    pool = _pool(workers)
+    ranges = _PageRanges(pool, pdf_paths, pages_per_task, timeout, max_pending or 4 * workers)
+    finished = False
+    try:
+        for index, pdf_path in enumerate(pdf_paths):
+            yield os.path.basename(pdf_path), ranges.pages(index)
+            ranges.discard(index)
+        finished = True
+    finally:
+        # A worker stuck on a pathological PDF, or a consumer that stopped
+        # early, would otherwise leave close/join waiting on stale tasks.
+        if ranges.timed_out or not finished:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
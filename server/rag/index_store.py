@@ -0,0 +1,649 @@
+"""On-disk index bundle shared by every worker through the OS page cache.
+
+A bundle is a directory holding:
+
+- ``vectors.f32``      every chunk's embedding as raw ``(n, dimension)``
+                       float32 rows; flat bundles search it in place through
+                       ``np.memmap`` (see ``rag.ann.FlatVectorIndex``)
+- ``faiss.index``      native FAISS index, ANN kinds only (see :mod:`rag.ann`),
+                       opened with ``IO_FLAG_MMAP``: IVF inverted lists stay
+                       mapped, HNSW and SQ are read into private memory
+- ``chunks.bin``       every chunk's UTF-8 text back to back
+- ``chunk_offsets.npy``  ``int64`` offsets into ``chunks.bin`` (``len + 1`` entries)
+- ``bm25/``            the persisted :class:`rag.bm25.SparseBM25`
+- ``chunk_meta.npy``   per chunk: page, character offset in its document and
+                       section heading id, plus ``sections.json`` (optional;
+                       bundles written before chunk metadata lack both)
+- ``chunk_sources.npy``  the other documents and pages a stored chunk was
+                       found in as a duplicate, and ``chunk_fingerprints.npy``,
+                       each chunk's SimHash (optional; see :mod:`rag.dedup`)
+- ``manifest.json``    format version, index version, embedding model name,
+                       a size + sha256 for every file above, the source
+                       documents (name, content hash, chunk count) in chunk order
+                       and how the FAISS index was built (``ann``)
+
+Chunk ``i`` is always FAISS row ``i`` and BM25 document ``i``. Bundles
+written before ``vectors.f32`` hold a flat ``faiss.index`` instead, which
+loads as a private copy.
+"""
+import array
+import fnmatch
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from collections.abc import Mapping, Sequence
+
+import faiss
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.schema import Document
+from langchain.vectorstores.faiss import FAISS
+
+from rag.ann import ADD_BATCH, FlatVectorIndex
+from rag.bm25 import SparseBM25
+from rag.dedup import FINGERPRINT_DTYPE, SOURCE_DTYPE
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+FAISS_NAME = "faiss.index"
+CHUNKS_NAME = "chunks.bin"
+OFFSETS_NAME = "chunk_offsets.npy"
+BM25_NAME = "bm25"
+CHUNK_META_NAME = "chunk_meta.npy"
+SECTIONS_NAME = "sections.json"
+SOURCES_NAME = "chunk_sources.npy"
+FINGERPRINTS_NAME = "chunk_fingerprints.npy"
+VECTORS_NAME = "vectors.f32"
+CHUNK_META_DTYPE = np.dtype([("page", "<i4"), ("start", "<i8"), ("section", "<i4")])
+
+# Held across a publish's two renames, so a reader never puts ``<bundle>.old`` back mid-swap.
+_swap_lock = threading.Lock()
+
+
+class ChunkStore(Sequence):
+    """Read-only list of chunk texts backed by one blob and an offset table."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def open(cls, bundle_dir):
+        offsets = np.load(os.path.join(bundle_dir, OFFSETS_NAME), mmap_mode="r")
+        blob_path = os.path.join(bundle_dir, CHUNKS_NAME)
+        if os.path.getsize(blob_path) == 0:
+            return cls(b"", offsets)
+        return cls(np.memmap(blob_path, dtype=np.uint8, mode="r"), offsets)
+
+    @staticmethod
+    def write(bundle_dir, texts):
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        with open(os.path.join(bundle_dir, CHUNKS_NAME), "wb") as f:
+            for i, text in enumerate(texts):
+                data = text.encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        np.save(os.path.join(bundle_dir, OFFSETS_NAME), offsets)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+
+class ChunkDocstore(Docstore):
+    """LangChain docstore view over a ChunkStore; docstore ids are chunk ids."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def search(self, search):
+        try:
+            return Document(page_content=self.chunks[int(search)])
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+
+
+class RowIds(Mapping):
+    """``{row: str(row)}`` over ``n`` rows, computed on lookup instead of stored.
+
+    The vectorstore's ``index_to_docstore_id``, since docstore ids are chunk
+    ids: a real dict costs over 100 bytes a chunk in every process.
+    """
+
+    def __init__(self, n):
+        self.n = n
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.n:
+            raise KeyError(row)
+        return str(row)
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+    def __len__(self):
+        return self.n
+
+
+class ChunkMetadata:
+    """Source file, page, section heading and character offset of every chunk.
+
+    File names come from the manifest's document records; the rest from
+    ``chunk_meta.npy``, which is memory-mapped. Pages are 1-based. Page 0,
+    start -1 and section -1 mean unknown (chunks carried over from a bundle
+    without metadata) or, for the section, that no heading precedes the
+    chunk in its document.
+
+    A chunk stored once for several identical or near-identical passages
+    belongs to the document it was first found in; ``sources`` lists the
+    others, and ``get`` reports them as ``also_in``. Since later copies are
+    dropped, chunk ``i + 1`` need not follow chunk ``i`` in the text; their
+    ``start`` offsets say whether it does.
+    """
+
+    def __init__(self, documents, records=None, sections=(), sources=None, fingerprints=None):
+        self.names = [doc["name"] for doc in documents]
+        self.doc_index = np.repeat(np.arange(len(documents)), [doc["chunks"] for doc in documents])
+        self.records = records
+        self.sections = list(sections)
+        self.sources = sources if sources is not None else np.zeros(0, dtype=SOURCE_DTYPE)
+        self.fingerprints = fingerprints
+        self._selections = {}
+
+    @classmethod
+    def open(cls, bundle_dir, documents=None):
+        """Metadata for a bundle, or ``None`` if its documents don't account for every chunk."""
+        manifest = read_manifest(bundle_dir)
+        documents = manifest["documents"] if documents is None else documents
+        if not documents or sum(doc["chunks"] for doc in documents) != manifest["num_chunks"]:
+            return None
+        path = os.path.join(bundle_dir, CHUNK_META_NAME)
+        if not os.path.exists(path):
+            return cls(documents)
+        with open(os.path.join(bundle_dir, SECTIONS_NAME), encoding="utf-8") as f:
+            sections = json.load(f)
+        sources = fingerprints = None
+        if os.path.exists(os.path.join(bundle_dir, SOURCES_NAME)):
+            sources = np.load(os.path.join(bundle_dir, SOURCES_NAME))
+        if os.path.exists(os.path.join(bundle_dir, FINGERPRINTS_NAME)):
+            fingerprints = np.load(os.path.join(bundle_dir, FINGERPRINTS_NAME), mmap_mode="r")
+        return cls(documents, np.load(path, mmap_mode="r"), sections, sources, fingerprints)
+
+    @staticmethod
+    def write(bundle_dir, chunk_meta):
+        """Write ``(page, start, section heading or None)`` tuples, one per chunk."""
+        sections = {}
+        records = np.zeros(len(chunk_meta), dtype=CHUNK_META_DTYPE)
+        for i, (page, start, section) in enumerate(chunk_meta):
+            records[i] = (page, start, -1 if section is None else sections.setdefault(section, len(sections)))
+        ChunkMetadata.save(bundle_dir, records, list(sections))
+
+    @staticmethod
+    def save(bundle_dir, records, sections):
+        """Write ``CHUNK_META_DTYPE`` records and the headings their section ids index."""
+        np.save(os.path.join(bundle_dir, CHUNK_META_NAME), records)
+        with open(os.path.join(bundle_dir, SECTIONS_NAME), "w", encoding="utf-8") as f:
+            json.dump(sections, f, ensure_ascii=False)
+
+    @staticmethod
+    def save_duplicates(bundle_dir, num_chunks, sources=None, fingerprints=None):
+        """Write ``SOURCE_DTYPE`` sources and one ``FINGERPRINT_DTYPE`` record per chunk, if given."""
+        if sources is not None:
+            if len(sources) and not 0 <= sources["chunk"].min() <= sources["chunk"].max() < num_chunks:
+                raise ValueError("chunk sources must refer to stored chunks.")
+            np.save(os.path.join(bundle_dir, SOURCES_NAME), np.asarray(sources, dtype=SOURCE_DTYPE))
+        if fingerprints is not None:
+            if len(fingerprints) != num_chunks:
+                raise ValueError("fingerprints must hold one record per chunk.")
+            np.save(os.path.join(bundle_dir, FINGERPRINTS_NAME), np.asarray(fingerprints, dtype=FINGERPRINT_DTYPE))
+
+    def __len__(self):
+        return len(self.doc_index)
+
+    def rows(self, start=0, end=None):
+        """Chunks ``[start, end)``'s ``(page, start, section)`` tuples, as ``write`` takes them."""
+        end = len(self) if end is None else end
+        if self.records is None:
+            return [(0, -1, None)] * (end - start)
+        return [(int(page), int(offset), self.sections[section] if section >= 0 else None)
+                for page, offset, section in self.records[start:end].tolist()]
+
+    def get(self, chunk_id):
+        metadata = {"source": self.names[self.doc_index[chunk_id]]}
+        if self.records is not None:
+            page, start, section = self.records[chunk_id].tolist()
+            metadata.update(page=page or None, start=start if start >= 0 else None,
+                            section=self.sections[section] if section >= 0 else None)
+        if len(self.sources):
+            first, last = np.searchsorted(self.sources["chunk"], [chunk_id, chunk_id + 1])
+            if last > first:
+                metadata["also_in"] = [{"source": self.names[document], "page": page or None}
+                                       for document, page in self.sources[["document", "page"]][first:last].tolist()]
+        return metadata
+
+    def select(self, documents=None, sections=None):
+        """Sorted ids of the chunks matching a filter.
+
+        ``documents`` and ``sections`` are lists of case-insensitive patterns
+        matched against file names and section headings: ``fnmatch`` globs,
+        or substrings when a pattern has no wildcard. A chunk must match both
+        lists when both are given. A stored duplicate matches ``documents`` if
+        any of the documents it was found in does.
+        """
+        key = (tuple(documents or ()), tuple(sections or ()))
+        if key not in self._selections:
+            mask = np.ones(len(self), dtype=bool)
+            if documents:
+                matched = [i for i, name in enumerate(self.names) if _matches(name, documents)]
+                in_documents = np.isin(self.doc_index, matched)
+                in_documents[self.sources["chunk"][np.isin(self.sources["document"], matched)]] = True
+                mask &= in_documents
+            if sections:
+                matched = [i for i, heading in enumerate(self.sections) if _matches(heading, sections)]
+                mask &= np.isin(self.records["section"], matched) if self.records is not None else False
+            if len(self._selections) >= 64:
+                self._selections.clear()
+            self._selections[key] = np.flatnonzero(mask)
+        return self._selections[key]
+
+
+def _matches(value, patterns):
+    value = value.lower()
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if fnmatch.fnmatchcase(value, pattern) if any(c in pattern for c in "*?[") else pattern in value:
+            return True
+    return False
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _bundle_files(bundle_dir):
+    paths = [name for name in (VECTORS_NAME, FAISS_NAME) if os.path.exists(os.path.join(bundle_dir, name))]
+    paths += [CHUNKS_NAME, OFFSETS_NAME]
+    if os.path.exists(os.path.join(bundle_dir, CHUNK_META_NAME)):
+        paths += [CHUNK_META_NAME, SECTIONS_NAME]
+    paths += [name for name in (SOURCES_NAME, FINGERPRINTS_NAME) if os.path.exists(os.path.join(bundle_dir, name))]
+    bm25_dir = os.path.join(bundle_dir, BM25_NAME)
+    paths += sorted(os.path.join(BM25_NAME, name) for name in os.listdir(bm25_dir))
+    return paths
+
+
+def read_manifest(bundle_dir):
+    with open(os.path.join(bundle_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index bundle version: {manifest.get('format_version')}")
+    return manifest
+
+
+def _recover(bundle_dir):
+    """Put ``<bundle_dir>.old`` back if a publish died between moving it aside and moving the new one in."""
+    if os.path.exists(bundle_dir):
+        return
+    old_dir = f"{bundle_dir}.old"
+    with _swap_lock:
+        if not os.path.exists(bundle_dir) and os.path.exists(os.path.join(old_dir, MANIFEST_NAME)):
+            print(f"Restoring {old_dir} left by an interrupted index publish")
+            os.rename(old_dir, bundle_dir)
+
+
+def bundle_exists(bundle_dir):
+    _recover(bundle_dir)
+    return os.path.exists(os.path.join(bundle_dir, MANIFEST_NAME))
+
+
+def _fresh_tmp_dir(bundle_dir):
+    tmp_dir = f"{bundle_dir}.tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def write_bundle(bundle_dir, index, texts, bm25, embedding_model, documents=None, ann=None, chunk_meta=None,
+                 sources=None, fingerprints=None, vectors=None):
+    """Write a bundle to a temporary directory and swap it in.
+
+    ``index_version`` increases by one on every write so callers can tell
+    which corpus an answer was computed against. ``chunk_meta`` is one
+    ``(page, start, section)`` tuple per chunk (see ``ChunkMetadata``);
+    ``sources`` and ``fingerprints`` come from ``rag.dedup.Deduplicator``.
+    ``vectors`` are the exact vectors an ANN ``index`` was built from; a
+    flat index brings its own. Without them an ANN bundle has no ``vectors.f32``.
+    """
+    if index.ntotal != len(texts) or bm25.corpus_size != len(texts):
+        raise ValueError("FAISS index, chunks and BM25 index must all hold the same number of chunks.")
+    if chunk_meta is not None and len(chunk_meta) != len(texts):
+        raise ValueError("chunk_meta must hold one record per chunk.")
+    if isinstance(index, faiss.IndexFlatL2):
+        index = FlatVectorIndex(index.reconstruct_n(0, index.ntotal))
+    tmp_dir = _fresh_tmp_dir(bundle_dir)
+    if isinstance(index, FlatVectorIndex):
+        vectors = index.vectors
+    else:
+        faiss.write_index(index, os.path.join(tmp_dir, FAISS_NAME))
+    if vectors is not None:
+        with open(os.path.join(tmp_dir, VECTORS_NAME), "wb") as f:
+            for start in range(0, len(texts), ADD_BATCH):
+                f.write(np.ascontiguousarray(vectors[start:start + ADD_BATCH], dtype=np.float32).tobytes())
+    ChunkStore.write(tmp_dir, texts)
+    bm25.save(os.path.join(tmp_dir, BM25_NAME))
+    if chunk_meta is not None:
+        ChunkMetadata.write(tmp_dir, chunk_meta)
+        ChunkMetadata.save_duplicates(tmp_dir, len(texts), sources, fingerprints)
+    return _publish(bundle_dir, tmp_dir, index.d, len(texts), embedding_model, documents, ann)
+
+
+def _publish(bundle_dir, tmp_dir, dimension, num_chunks, embedding_model, documents, ann):
+    """Add the manifest to the files written in ``tmp_dir`` and swap it in as ``bundle_dir``.
+
+    The swap is two renames, so ``bundle_dir`` is briefly missing; a crash
+    there leaves the previous bundle in ``<bundle_dir>.old``, which
+    ``bundle_exists`` and ``load_bundle`` restore.
+    """
+    previous = read_manifest(bundle_dir) if bundle_exists(bundle_dir) else {}
+    files = {}
+    for name in _bundle_files(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        files[name] = {"bytes": os.path.getsize(path), "sha256": _sha256(path)}
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "index_version": previous.get("index_version", 0) + 1,
+        "created_at": time.time(),
+        "embedding_model": embedding_model,
+        "dimension": dimension,
+        "num_chunks": num_chunks,
+        "documents": documents or [],
+        "ann": ann or {"kind": "flat", "description": "Flat", "trained_on": 0},
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    old_dir = f"{bundle_dir}.old"
+    with _swap_lock:
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.exists(bundle_dir):
+            os.rename(bundle_dir, old_dir)
+        os.rename(tmp_dir, bundle_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    return manifest
+
+
+class VectorFile:
+    """Read-only ``(n, dim)`` float32 rows of a raw file, read on demand.
+
+    Slicing reads just those rows with ``np.fromfile`` instead of mapping the
+    file, so rows that were read once don't stay in this process's resident
+    set. ``rag.ann.build_index`` takes it in place of an array.
+    """
+
+    def __init__(self, path, num_vectors, dim):
+        self.path = path
+        self.shape = (num_vectors, dim)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        start, stop, step = rows.indices(self.shape[0])
+        if step != 1:
+            raise IndexError("VectorFile only supports contiguous slices")
+        count = max(stop - start, 0) * self.shape[1]
+        itemsize = np.dtype(np.float32).itemsize
+        return np.fromfile(self.path, dtype=np.float32, count=count,
+                           offset=start * self.shape[1] * itemsize).reshape(-1, self.shape[1])
+
+
+class BundleWriter:
+    """Build a bundle batch by batch without holding the corpus in memory.
+
+    Chunk texts go straight to ``chunks.bin`` in the temporary directory and
+    vectors to ``vectors.f32`` next to it. Once every chunk is appended, build
+    the index over ``vectors()`` and pass it to ``write_index``, then
+    BM25 over ``texts()`` (read back in batches) to ``write_bm25``; each is
+    written out as soon as it is built so the two are never in memory
+    together. ``commit`` then swaps the bundle in like ``write_bundle``.
+    ``truncate`` drops the chunks appended since an earlier length, e.g.
+    those of a file that failed part way through. Until ``commit`` the live
+    bundle is untouched; ``abort`` throws the partial one away.
+    """
+
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        self.tmp_dir = _fresh_tmp_dir(bundle_dir)
+        self.dim = None
+        self.ann = None
+        self._indexed = False
+        # Flat arrays rather than a list of tuples: a few bytes per chunk.
+        self._offsets = array.array("q", [0])
+        self._pages = array.array("i")
+        self._starts = array.array("q")
+        self._section_ids = array.array("i")
+        self._sections = {}
+        self._chunks = open(os.path.join(self.tmp_dir, CHUNKS_NAME), "wb")
+        self._vectors = open(os.path.join(self.tmp_dir, VECTORS_NAME), "wb")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, texts, vectors, chunk_meta):
+        """Append chunks with their vectors and ``(page, start, section)`` records."""
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[0] != len(texts) or len(chunk_meta) != len(texts):
+            raise ValueError("append needs one vector and one metadata record per chunk.")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        for text in texts:
+            data = text.encode("utf-8")
+            self._chunks.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+        self._vectors.write(vectors.tobytes())
+        for page, start, section in chunk_meta:
+            self._pages.append(page)
+            self._starts.append(start)
+            self._section_ids.append(-1 if section is None else self._sections.setdefault(section, len(self._sections)))
+
+    def truncate(self, size):
+        """Drop every chunk after the first ``size``."""
+        del self._offsets[size + 1:]
+        del self._pages[size:], self._starts[size:], self._section_ids[size:]
+        self._chunks.truncate(self._offsets[-1])
+        self._chunks.seek(self._offsets[-1])
+        vector_bytes = size * (self.dim or 0) * np.dtype(np.float32).itemsize
+        self._vectors.truncate(vector_bytes)
+        self._vectors.seek(vector_bytes)
+
+    def vectors(self):
+        """Every appended vector, as a ``VectorFile``."""
+        self._vectors.flush()
+        return VectorFile(os.path.join(self.tmp_dir, VECTORS_NAME), len(self), self.dim or 0)
+
+    def texts(self, batch_size=1024):
+        """Yield the appended chunk texts in lists of at most ``batch_size``."""
+        self._chunks.flush()
+        offsets = self._offsets
+        with open(os.path.join(self.tmp_dir, CHUNKS_NAME), "rb") as f:
+            for start in range(0, len(self), batch_size):
+                end = min(start + batch_size, len(self))
+                blob = f.read(offsets[end] - offsets[start])
+                yield [blob[offsets[i] - offsets[start]:offsets[i + 1] - offsets[start]].decode("utf-8")
+                       for i in range(start, end)]
+
+    def write_index(self, index, ann=None):
+        """Write the index over every appended chunk; ``ann`` is what ``build_index`` reports.
+
+        A ``FlatVectorIndex`` over ``vectors()`` needs nothing written: the
+        bundle's ``vectors.f32`` is its index.
+        """
+        if index.ntotal != len(self):
+            raise ValueError("FAISS index, chunks and BM25 index must all hold the same number of chunks.")
+        if not isinstance(index, FlatVectorIndex):
+            faiss.write_index(index, os.path.join(self.tmp_dir, FAISS_NAME))
+        self.ann = ann
+        self._indexed = True
+
+    def write_bm25(self, bm25):
+        if bm25.corpus_size != len(self):
+            raise ValueError("FAISS index, chunks and BM25 index must all hold the same number of chunks.")
+        bm25.save(os.path.join(self.tmp_dir, BM25_NAME))
+
+    def commit(self, embedding_model, documents=None, sources=None, fingerprints=None):
+        """Write the chunk offsets and metadata and swap the bundle in; returns its manifest.
+
+        ``sources`` and ``fingerprints`` are as for ``write_bundle``.
+        """
+        if not self._indexed or not os.path.exists(os.path.join(self.tmp_dir, BM25_NAME)):
+            raise ValueError("write_index and write_bm25 must be called before commit.")
+        self._close()
+        np.save(os.path.join(self.tmp_dir, OFFSETS_NAME), np.frombuffer(self._offsets, dtype=np.int64))
+        records = np.zeros(len(self), dtype=CHUNK_META_DTYPE)
+        records["page"] = np.frombuffer(self._pages, dtype=np.int32)
+        records["start"] = np.frombuffer(self._starts, dtype=np.int64)
+        records["section"] = np.frombuffer(self._section_ids, dtype=np.int32)
+        ChunkMetadata.save(self.tmp_dir, records, list(self._sections))
+        ChunkMetadata.save_duplicates(self.tmp_dir, len(self), sources, fingerprints)
+        return _publish(self.bundle_dir, self.tmp_dir, self.dim, len(self), embedding_model, documents, self.ann)
+
+    def abort(self):
+        self._close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _close(self):
+        self._chunks.close()
+        self._vectors.close()
+
+
+def verify_bundle(bundle_dir, checksums=False):
+    """Check every file against the manifest; sizes always, sha256 if asked."""
+    _recover(bundle_dir)
+    manifest = read_manifest(bundle_dir)
+    for name, expected in manifest["files"].items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path):
+            raise ValueError(f"Index bundle is missing {name}")
+        if os.path.getsize(path) != expected["bytes"]:
+            raise ValueError(f"Index bundle file {name} has the wrong size")
+        if checksums and _sha256(path) != expected["sha256"]:
+            raise ValueError(f"Index bundle file {name} failed its checksum")
+    return manifest
+
+
+def open_vectors(bundle_dir, manifest=None):
+    """The bundle's ``vectors.f32`` as a read-only ``(n, dimension)`` memmap, or ``None`` if it has none."""
+    manifest = manifest or read_manifest(bundle_dir)
+    if VECTORS_NAME not in manifest["files"]:
+        return None
+    shape = (manifest["num_chunks"], manifest["dimension"] or 0)
+    if not manifest["num_chunks"]:
+        return np.zeros(shape, dtype=np.float32)
+    return np.memmap(os.path.join(bundle_dir, VECTORS_NAME), dtype=np.float32, mode="r", shape=shape)
+
+
+def vector_reader(bundle_dir, manifest=None):
+    """``read_rows(start, end)``: the vectors of chunks ``[start, end)`` as an array.
+
+    Rows come from ``vectors.f32``, or in bundles without one are
+    reconstructed from ``faiss.index``, which is approximate for PQ and SQ
+    indexes and raises ``RuntimeError`` for IVF ones without a direct map.
+    """
+    manifest = manifest or read_manifest(bundle_dir)
+    vectors = open_vectors(bundle_dir, manifest)
+    if vectors is not None:
+        return lambda start, end: vectors[start:end]
+    index = faiss.read_index(os.path.join(bundle_dir, FAISS_NAME), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return lambda start, end: index.reconstruct_n(start, end - start)
+
+
+def load_bundle(bundle_dir, embeddings, verify_checksums=False, mmap=True, search=True):
+    """Open a bundle without unpickling anything.
+
+    Returns ``(vectorstore, chunks, bm25, manifest)``. The chunk blob, the
+    BM25 arrays and a flat index's vectors are memory-mapped read-only, and
+    so are an IVF index's inverted lists; HNSW and SQ indexes, and flat ones
+    in bundles without ``vectors.f32``, are private copies. Pass
+    ``mmap=False`` to get a private FAISS index that can be modified, or
+    ``search=False`` to open only the chunks (``vectorstore`` and ``bm25``
+    are then ``None``), e.g. when shard workers do the searching.
+    """
+    manifest = verify_bundle(bundle_dir, checksums=verify_checksums)
+    if not search:
+        return None, ChunkStore.open(bundle_dir), None, manifest
+    vectors = open_vectors(bundle_dir, manifest)
+    if FAISS_NAME in manifest["files"]:
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(os.path.join(bundle_dir, FAISS_NAME), io_flags)
+    elif mmap:
+        index = FlatVectorIndex(vectors)
+    else:
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        for start in range(0, len(vectors), ADD_BATCH):
+            index.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH]))
+    chunks = ChunkStore.open(bundle_dir)
+    bm25 = SparseBM25.load(os.path.join(bundle_dir, BM25_NAME))
+    vectorstore = FAISS(
+        embeddings,
+        index,
+        ChunkDocstore(chunks),
+        RowIds(index.ntotal) if mmap else {row: str(row) for row in range(index.ntotal)},
+    )
+    return vectorstore, chunks, bm25, manifest
+
+
+def migrate_pickle(pickle_path, bundle_dir, embedding_model, bm25_compat=False):
+    """One-shot conversion of a legacy ``vectorstore.pkl`` into a bundle.
+
+    Chunk texts are read back from the pickled docstore in FAISS row order,
+    so the old ``text_chunks`` list isn't needed (old-format pickles lack it).
+    """
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    if isinstance(data, dict):
+        vectorstore = data['vectorstore']
+        embeddings = data.get('embeddings')
+        embedding_model = getattr(embeddings, "model_name", None) or embedding_model
+    else:
+        vectorstore = data
+
+    texts = []
+    for row in range(vectorstore.index.ntotal):
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+        texts.append(doc.page_content if isinstance(doc, Document) else "")
+
+    bm25 = SparseBM25(texts, compat=bm25_compat)
+    return write_bundle(bundle_dir, vectorstore.index, texts, bm25, embedding_model)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("usage: python -m rag.index_store migrate <vectorstore.pkl> <bundle_dir>")
+        sys.exit(2)
+    from config import BM25_COMPAT, EMBEDDING_MODEL
+    result = migrate_pickle(sys.argv[2], sys.argv[3], EMBEDDING_MODEL, bm25_compat=BM25_COMPAT)
+    print(f"Migrated {result['num_chunks']} chunks into {sys.argv[3]} (index version {result['index_version']}).")
@@ -0,0 +1,207 @@
+"""Process-local metrics in the Prometheus text exposition format.
+
+A few counters, gauges and histograms rendered by ``render`` for ``GET
+/metrics``, without a prometheus_client dependency. Values live in the
+serving process, so with several workers each one has to be scraped.
+
+``stage(name)`` times a block of the query pipeline into
+``rag_stage_seconds``; inside ``track_request`` the same durations are also
+summed per request between ``start_request`` and ``end_request``, which is
+what the optional ``Server-Timing`` header reports.
+"""
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INGEST_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """``callback``, if given, returns ``{label values tuple: value}`` at scrape time."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _items(self):
+        if self.callback is not None:
+            return sorted(self.callback().items())
+        with self._lock:
+            return sorted((key, self._copy(value)) for key, value in self._values.items())
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._items():
+            lines.extend(self._samples(list(zip(self.labelnames, key)), value))
+        return lines
+
+    def _samples(self, labels, value):
+        yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @staticmethod
+    def _copy(value):
+        return list(value[0]), value[1]
+
+    def totals(self):
+        """``{label values: (count, sum)}`` of everything observed so far."""
+        with self._lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self._values.items()}
+
+    def _samples(self, labels, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+        yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a query.", ("stage",)
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds", "Time spent in each stage of an ingest job.", ("stage",), INGEST_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "End-to-end request latency by route.", ("route", "method", "status")
+)
+REQUESTS = Counter("rag_requests_total", "Requests served, by route and status.", ("route", "method", "status"))
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_ingest_stage(name, seconds):
+    INGEST_STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def ingest_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_ingest_stage(name, time.perf_counter() - start)
+
+
+def start_request():
+    """Start collecting stage timings for the current request; returns a token for ``end_request``."""
+    return _request_timings.set({})
+
+
+def current_timings():
+    """The ``{stage: seconds}`` collected so far for the current request."""
+    return dict(_request_timings.get() or {})
+
+
+def end_request(token):
+    """Stop collecting and return the request's ``{stage: seconds}``."""
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings or {}
+
+
+def observe_request(route, method, status, seconds):
+    REQUEST_SECONDS.observe(seconds, route=route, method=method, status=status)
+    REQUESTS.inc(route=route, method=method, status=status)
+
+
+def server_timing(timings, total=None):
+    """``Server-Timing`` header value for a request's stage timings, in milliseconds."""
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
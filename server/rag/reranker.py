@@ -0,0 +1,128 @@
+"""Optional cross-encoder rerank stage for ``HybridRetriever``."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.schema import Document
+
+
+class CrossEncoderReranker:
+    """Re-scores (query, chunk) pairs with a small CPU cross-encoder.
+
+    All uncached pairs of a request are scored in one ``predict`` batch, and
+    scores are kept in an LRU keyed by a hash of the query and chunk text, so
+    they stay valid across re-indexing. ``seconds_per_pair`` is a running
+    estimate used to skip reranking when it would overrun a deadline; each
+    skip decays it by ``SKIP_DECAY``, so a stale high estimate is tried
+    again before long and, if it was right, measured back up.
+    """
+
+    SKIP_DECAY = 0.9
+    WARM_UP_PAIRS = 4
+
+    def __init__(self, model_name, batch_size=32, cache_size=10000, max_length=512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.seconds_per_pair = None
+        self.reranked = 0
+        self.skipped = 0
+        self.cached_pairs = 0
+        self.scored_pairs = 0
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()
+
+    @property
+    def model(self):
+        with self._load_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            return self._model
+
+    def warm_up(self):
+        """Load the model and run a first batch, then time a second one to seed ``seconds_per_pair``."""
+        pairs = [("warm up", "warm up")] * self.WARM_UP_PAIRS
+        model = self.model
+        model.predict(pairs[:1], show_progress_bar=False)  # first inference allocates buffers
+        start = time.perf_counter()
+        model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        self.seconds_per_pair = (time.perf_counter() - start) / len(pairs)
+
+    def _key(self, query, text):
+        return hashlib.md5(f"{query}\0{text}".encode("utf-8")).hexdigest()
+
+    def rerank(self, query, docs, k, deadline=None):
+        """Return the best ``k`` of ``docs`` by cross-encoder score, best first.
+
+        Returns ``None`` if scoring the uncached pairs is expected to finish
+        after ``deadline`` (a ``time.perf_counter()`` value); the caller then
+        keeps its own order.
+        """
+        keys = [self._key(query, doc.page_content) for doc in docs]
+        with self._lock:
+            scores = [self._scores.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._scores.move_to_end(key)
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing and deadline is not None and self.seconds_per_pair is not None:
+            if time.perf_counter() + len(missing) * self.seconds_per_pair > deadline:
+                self.skipped += 1
+                self.seconds_per_pair *= self.SKIP_DECAY
+                return None
+
+        if missing:
+            model = self.model  # loads lazily; not part of the timing
+            start = time.perf_counter()
+            predicted = model.predict(
+                [(query, docs[i].page_content) for i in missing],
+                batch_size=self.batch_size, show_progress_bar=False
+            )
+            per_pair = (time.perf_counter() - start) / len(missing)
+            self.seconds_per_pair = per_pair if self.seconds_per_pair is None else (
+                0.8 * self.seconds_per_pair + 0.2 * per_pair
+            )
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = scores[i]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        self.reranked += 1
+        self.cached_pairs += len(docs) - len(missing)
+        self.scored_pairs += len(missing)
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:k]
+        return [
+            Document(page_content=docs[i].page_content,
+                     metadata={**docs[i].metadata, "rerank_score": scores[i]})
+            for i in order
+        ]
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "cached_pairs": self.cached_pairs,
+            "scored_pairs": self.scored_pairs,
+            "ms_per_pair": round(self.seconds_per_pair * 1000, 3) if self.seconds_per_pair else None,
+        }
+
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name, batch_size=32, cache_size=10000):
+    """Return the process-wide reranker for ``model_name``; the model loads on first use."""
+    with _rerankers_lock:
+        if model_name not in _rerankers:
+            _rerankers[model_name] = CrossEncoderReranker(model_name, batch_size, cache_size)
+        return _rerankers[model_name]
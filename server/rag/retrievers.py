@@ -1,69 +1,317 @@
+import asyncio
+import contextvars
+import time
+from typing import Any, Optional
+
 import numpy as np
 from langchain.schema.retriever import BaseRetriever
 from langchain.schema import Document
-from rank_bm25 import BM25Okapi
+
+from rag.ann import search
+from rag.bm25 import SparseBM25
+from rag.metrics import record_stage, stage
 
 class HybridRetriever(BaseRetriever):
-    """Custom retriever combining vector search and BM25."""
-    
-    def __init__(self, vectorstore, texts, embeddings):
-        super().__init__()
-        self.vectorstore = vectorstore
-        self.bm25 = BM25Okapi([text.split() for text in texts])
-        self.texts = texts
-        self.embeddings = embeddings
-    
+    """Custom retriever combining vector search and BM25.
+
+    ``candidates`` chunks are fetched from each source and merged (default
+    ``k * 2``). With a ``reranker`` and ``rerank`` on, the merged pool is
+    re-scored by the cross-encoder down to ``k``, unless that is expected to
+    overrun ``latency_budget`` seconds from the start of retrieval. ``nprobe``
+    (IVF indexes) and ``ef_search`` (HNSW) trade vector recall for speed. These
+    are plain fields, so a per-request copy can override them.
+
+    With ``chunk_metadata`` (a ``ChunkMetadata``), returned documents carry their
+    source file, page and section, and ``filter`` (``{"documents": [...],
+    "sections": [...]}``, see ``ChunkMetadata.select``) restricts a query to
+    the matching chunks: FAISS searches only their rows and BM25 scores only
+    their postings.
+
+    With a ``query_embedder`` (``rag.embeddings.QueryEmbedder``) question
+    vectors come from its shared cache and batches instead of a forward pass
+    of ``embeddings`` per call.
+    """
+
+    vectorstore: Any
+    texts: Any
+    embeddings: Any
+    bm25: Any = None
+    chunk_ids: Any = None
+    chunk_rows: Any = None
+    fusion: str = "weighted"
+    vector_weight: float = 0.7
+    rrf_k: int = 60
+    executor: Any = None  # for async retrieval; None means the event loop's default executor
+    k: int = 3
+    candidates: Optional[int] = None
+    reranker: Any = None
+    rerank: bool = True
+    latency_budget: Optional[float] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    chunk_metadata: Any = None
+    filter: Optional[dict] = None
+    query_embedder: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, vectorstore, texts, embeddings, fusion="weighted", bm25=None, **kwargs):
+        super().__init__(vectorstore=vectorstore, texts=texts, embeddings=embeddings, fusion=fusion, **kwargs)
+        self.bm25 = bm25 if bm25 is not None else SparseBM25(texts)
+        if self.chunk_ids is None:
+            self.chunk_ids = self._build_id_index()
+        self.chunk_rows = np.full(len(texts), -1, dtype=np.int64)
+        mapped = np.flatnonzero(self.chunk_ids >= 0)
+        self.chunk_rows[self.chunk_ids[mapped]] = mapped
+
+    def _build_id_index(self):
+        """Map FAISS row positions to chunk ids once, so ranking never compares strings."""
+        position = {}
+        for idx, text in enumerate(self.texts):
+            position.setdefault(text, idx)
+
+        chunk_ids = np.full(self.vectorstore.index.ntotal, -1, dtype=np.int64)
+        for row, doc_id in self.vectorstore.index_to_docstore_id.items():
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                chunk_ids[row] = position.get(doc.page_content, -1)
+        return chunk_ids
+
     def _get_relevant_documents(self, query: str):
         """Get documents relevant to a query."""
-        return self.get_relevant_documents(query, k=3)
-    
+        return self.get_relevant_documents(query)
+
     async def _aget_relevant_documents(self, query: str):
-        """Async version - not implemented."""
-        return self._get_relevant_documents(query)
-    
-    def get_relevant_documents(self, query, k=3):
-        # Vector similarity search
-        vector_docs = self.vectorstore.similarity_search(query, k=k*2)
-
-        bm25_scores = self.bm25.get_scores(query.split())
-        bm25_indices = np.argsort(bm25_scores)[::-1][:k*2]
-        
-        all_docs = []
-        doc_set = set()
-        
-        for doc in vector_docs:
-            if doc.page_content not in doc_set:
-                all_docs.append((doc, 'vector'))
-                doc_set.add(doc.page_content)
-        
-
-        for idx in bm25_indices:
-            if idx < len(self.texts) and self.texts[idx] not in doc_set:
-                doc = Document(page_content=self.texts[idx])
-                all_docs.append((doc, 'bm25'))
-                doc_set.add(self.texts[idx])
-        
-
-        scored_docs = []
-        for doc, source in all_docs:
-            vector_score = 0.5
-            bm25_score = 0.5
-            
-            if source == 'vector':
-                vector_score = 1.0
-            if doc.page_content in self.texts:
-                text_idx = self.texts.index(doc.page_content)
-                raw_bm25_scores = self.bm25.get_scores(query.split())
-                bm25_score = raw_bm25_scores[text_idx]
-                min_score = np.min(raw_bm25_scores)
-                max_score = np.max(raw_bm25_scores)
-                if max_score - min_score > 1e-8:
-                    bm25_score = (bm25_score - min_score) / (max_score - min_score)
-                else:
-                    bm25_score = 0.5
-            
-            hybrid_score = 0.7 * vector_score + 0.3 * bm25_score
-            scored_docs.append((doc, hybrid_score))
-        
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
-        return [doc for doc, score in scored_docs[:k]]
\ No newline at end of file
+        """Run the CPU-bound embedding, FAISS and BM25 work off the event loop."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()  # keep per-request stage timings
+        return await loop.run_in_executor(self.executor, context.run, self._get_relevant_documents, query)
+
+    def _embed_query(self, query):
+        if self.query_embedder is not None:
+            return self._normalize(np.array([self.query_embedder.embed(query)], dtype=np.float32))
+        return self._normalize(np.asarray([self.embeddings.embed_query(query)], dtype=np.float32))
+
+    def _embed_queries(self, queries):
+        if self.query_embedder is not None:
+            return self._normalize(np.array(self.query_embedder.embed_many(queries), dtype=np.float32))
+        return self._normalize(np.asarray(self.embeddings.embed_documents(list(queries)), dtype=np.float32))
+
+    def _normalize(self, vectors):
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _allowed_ids(self):
+        """Sorted ids of the chunks ``filter`` allows, or ``None`` when there is no filter."""
+        if not self.filter:
+            return None
+        if self.chunk_metadata is None:
+            raise ValueError("This index has no document metadata to filter on. Re-upload the documents.")
+        return self.chunk_metadata.select(**self.filter)
+
+    def _doc_filter(self, allowed):
+        """Boolean mask over BM25 documents (chunk ids) for ``allowed``."""
+        if allowed is None:
+            return None
+        mask = np.zeros(self.bm25.corpus_size, dtype=bool)
+        mask[allowed] = True
+        return mask
+
+    def _vector_search(self, query_vector, fetch_k, allowed=None):
+        """Return (chunk ids, cosine similarities) for the nearest FAISS rows."""
+        distances, rows = self._search(query_vector, fetch_k, allowed)
+        return self._search_hits(rows[0], distances[0])
+
+    def _search(self, query_vectors, fetch_k, allowed=None):
+        rows = None
+        if allowed is not None:
+            rows = self.chunk_rows[allowed]
+            rows = np.sort(rows[rows >= 0])
+        return search(self.vectorstore.index, query_vectors, fetch_k, rows, self.nprobe, self.ef_search)
+
+    def _search_hits(self, rows, distances):
+        keep = rows >= 0
+        ids = self.chunk_ids[rows[keep]]
+        sims = self._distance_to_similarity(distances[keep])
+        found = ids >= 0
+        return ids[found], sims[found]
+
+    def _distance_to_similarity(self, distances):
+        # MiniLM vectors are unit length, so squared L2 maps straight onto cosine.
+        return np.clip(1.0 - distances / 2.0, 0.0, 1.0)
+
+    def _vector_scores_for(self, query_vector, ids):
+        """Score chunks that only BM25 surfaced against the query vector."""
+        scores = np.zeros(len(ids), dtype=np.float32)
+        for i, chunk_id in enumerate(ids):
+            row = int(self.chunk_rows[chunk_id])
+            if row < 0:
+                continue
+            try:
+                vector = self.vectorstore.index.reconstruct(row)
+            except RuntimeError:
+                continue
+            distance = float(np.sum((vector - query_vector[0]) ** 2))
+            scores[i] = self._distance_to_similarity(distance)
+        return scores
+
+    def _pool_size(self, k):
+        return max(self.candidates or k * 2, k)
+
+    def _reranking(self):
+        return self.reranker is not None and self.rerank
+
+    def get_relevant_documents(self, query, k=None, **kwargs):
+        k = k or self.k
+        start = time.perf_counter()
+        fetch_k = self._pool_size(k)
+        allowed = self._allowed_ids()
+        if allowed is not None and not len(allowed):
+            return []
+        with stage("embed"):
+            query_vector = self._embed_query(query)
+        with stage("vector_search"):
+            vector_ids, vector_sims = self._vector_search(query_vector, fetch_k, allowed)
+
+        # Score BM25 once per query, touching only postings of the query terms.
+        with stage("bm25"):
+            bm25_docs, bm25_scores = self.bm25.score_sparse(query, self._doc_filter(allowed))
+        with stage("fusion"):
+            docs = self._fuse(query_vector, vector_ids, vector_sims, bm25_docs, bm25_scores,
+                              fetch_k, fetch_k if self._reranking() else k, None if allowed is None else len(allowed))
+        deadline = start + self.latency_budget if self.latency_budget is not None else None
+        return self._rerank(query, docs, k, deadline)
+
+    def _rerank(self, query, docs, k, deadline=None):
+        if not self._reranking() or len(docs) <= 1:
+            return docs[:k]
+        with stage("rerank"):
+            reranked = self.reranker.rerank(query, docs, k, deadline)
+        return reranked if reranked is not None else docs[:k]
+
+    def get_relevant_documents_batch(self, queries, k=None, timings=None):
+        """Retrieve for many queries at once: one embedding batch, one FAISS
+        search and one BM25 matrix product. Returns a document list per query.
+
+        Reranking, if on, ignores ``latency_budget`` here: batches are for
+        throughput. If ``timings`` is a dict, the seconds spent in each stage
+        are stored in it.
+        """
+        if not queries:
+            return []
+        k = k or self.k
+        fetch_k = self._pool_size(k)
+        limit = fetch_k if self._reranking() else k
+        allowed = self._allowed_ids()
+        if allowed is not None and not len(allowed):
+            return [[] for _ in queries]
+        start = time.perf_counter()
+        query_vectors = self._embed_queries(queries)
+        embedded = time.perf_counter()
+        distances, rows = self._search(query_vectors, fetch_k, allowed)
+        searched = time.perf_counter()
+        bm25_results = self.bm25.score_batch(queries, self._doc_filter(allowed))
+        scored = time.perf_counter()
+
+        population = None if allowed is None else len(allowed)
+        results = []
+        for i, (bm25_docs, bm25_scores) in enumerate(bm25_results):
+            vector_ids, vector_sims = self._search_hits(rows[i], distances[i])
+            results.append(self._fuse(query_vectors[i:i + 1], vector_ids, vector_sims, bm25_docs, bm25_scores,
+                                      fetch_k, limit, population))
+        fused = time.perf_counter()
+        if self._reranking():
+            results = [self._rerank(query, docs, k) for query, docs in zip(queries, results)]
+        stages = {
+            "embed": embedded - start,
+            "vector_search": searched - embedded,
+            "bm25": scored - searched,
+            "fusion": fused - scored,
+            "rerank": time.perf_counter() - fused,
+        }
+        for name, seconds in stages.items():
+            if name != "rerank" or self._reranking():
+                record_stage(f"batch_{name}", seconds)
+        if timings is not None:
+            timings.update({f"{name}_seconds": round(seconds, 4) for name, seconds in stages.items()})
+        return results
+
+    def _fuse(self, query_vector, vector_ids, vector_sims, bm25_docs, bm25_scores, fetch_k, limit,
+              population=None):
+        """Merge the top ``fetch_k`` of each source and return the best ``limit``."""
+        candidates = self._candidates(query_vector, vector_ids, vector_sims, bm25_docs, bm25_scores, fetch_k,
+                                      population)
+        return self._top_documents(candidates, limit, self.texts.__getitem__)
+
+    def _candidates(self, query_vector, vector_ids, vector_sims, bm25_docs, bm25_scores, fetch_k,
+                    population=None):
+        """Everything fusion needs about the top ``fetch_k`` of each source.
+
+        A dict of candidate ``ids`` (vector hits first, then BM25-only hits)
+        with their cosine ``vector`` and raw ``bm25`` scores aligned, each
+        source's ranked ids, and the ``bm25_range`` over the corpus, or over
+        the ``population`` chunks a filter allows. Vector scores of BM25-only
+        hits are only reconstructed for weighted fusion.
+        """
+        bm25_ids = self.bm25.top_k(bm25_docs, bm25_scores, fetch_k)
+        ids = np.array(list(dict.fromkeys(vector_ids.tolist() + bm25_ids.tolist())), dtype=np.int64)
+
+        vector_score = dict(zip(vector_ids.tolist(), vector_sims.tolist()))
+        missing = [c for c in ids.tolist() if c not in vector_score]
+        if missing and self.fusion != "rrf":
+            vector_score.update(zip(missing, self._vector_scores_for(query_vector, missing).tolist()))
+        vec = np.array([vector_score.get(c, 0.0) for c in ids.tolist()], dtype=np.float32)
+
+        raw = np.zeros(len(ids))
+        pos = np.searchsorted(bm25_docs, ids)
+        hit = pos < len(bm25_docs)
+        hit[hit] = bm25_docs[pos[hit]] == ids[hit]
+        raw[hit] = bm25_scores[pos[hit]]
+
+        return {
+            "ids": ids,
+            "vector": vec,
+            "bm25": raw,
+            "vector_ranked": vector_ids,
+            "bm25_ranked": bm25_ids,
+            "bm25_range": self.bm25.score_range(bm25_docs, bm25_scores, population),
+        }
+
+    def _top_documents(self, candidates, limit, text_for):
+        """Fuse the scores of ``candidates`` and return the best ``limit`` as Documents."""
+        ids = candidates["ids"].tolist()
+        if not ids:
+            return []
+        if self.fusion == "rrf":
+            scores = self._rrf_scores(ids, candidates["vector_ranked"], candidates["bm25_ranked"])
+        else:
+            scores = self._weighted_scores(candidates["vector"], candidates["bm25"], candidates["bm25_range"])
+
+        order = sorted(range(len(ids)), key=lambda i: scores[i], reverse=True)[:limit]
+        return [
+            Document(page_content=text_for(ids[i]), metadata={
+                "chunk_id": ids[i],
+                "score": float(scores[i]),
+                **(self.chunk_metadata.get(ids[i]) if self.chunk_metadata is not None else {}),
+            })
+            for i in order
+        ]
+
+    def _weighted_scores(self, vec, raw, bm25_range):
+        min_score, max_score = bm25_range
+        if max_score - min_score > 1e-8:
+            lex = (raw - min_score) / (max_score - min_score)
+        else:
+            lex = np.full(len(raw), 0.5)
+
+        return self.vector_weight * vec + (1.0 - self.vector_weight) * lex
+
+    def _rrf_scores(self, candidates, vector_ids, bm25_ids):
+        """Reciprocal-rank fusion: sum of 1 / (rrf_k + rank) over each ranked list."""
+        scores = dict.fromkeys(candidates, 0.0)
+        for ranked in (vector_ids, bm25_ids):
+            for rank, chunk_id in enumerate(ranked.tolist(), start=1):
+                scores[chunk_id] += 1.0 / (self.rrf_k + rank)
+        return [scores[c] for c in candidates]
@@ -0,0 +1,148 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", query.lower())).strip()
+
+
+class SemanticCache:
+    """Answers keyed by question meaning rather than exact text.
+
+    Each cached question is normalised, embedded with the shared MiniLM model
+    and stored in a small inner-product FAISS index. A new question whose
+    cosine similarity to a cached one reaches ``threshold`` gets that answer.
+    Identical normalised questions are matched without embedding at all.
+
+    Entries are evicted oldest-first past ``max_entries``. ``clear`` bumps
+    ``version``; pass the version read before answering to ``add`` so answers
+    from a replaced index are not stored.
+    """
+
+    def __init__(self, embed_query, threshold=0.92, max_entries=2048):
+        self.embed_query = embed_query
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.version = 0
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.near_misses = 0
+        self._hit_similarity_sum = 0.0
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()  # id -> (normalised query, response)
+        self._by_text = {}
+        self._next_id = 0
+
+    def _embed(self, normalized):
+        vector = np.asarray([self.embed_query(normalized)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, query):
+        """Return a copy of the cached response, annotated with the match, or ``None``."""
+        normalized = normalize_query(query)
+        with self._lock:
+            self.lookups += 1
+            entry_id = self._by_text.get(normalized)
+            if entry_id is not None:
+                self.exact_hits += 1
+                self._hit_similarity_sum += 1.0
+                return self._annotate(entry_id, 1.0)
+            if self._index is None or self._index.ntotal == 0:
+                return None
+
+        vector = self._embed(normalized)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            similarities, ids = self._index.search(vector, 1)
+            similarity, entry_id = float(similarities[0][0]), int(ids[0][0])
+            if entry_id not in self._entries:
+                return None
+            if similarity < self.threshold:
+                if similarity >= self.threshold - 0.05:
+                    self.near_misses += 1
+                return None
+            self.semantic_hits += 1
+            self._hit_similarity_sum += similarity
+            return self._annotate(entry_id, similarity)
+
+    def _annotate(self, entry_id, similarity):
+        matched_query, response = self._entries[entry_id]
+        return {**response, "cache": {"type": "semantic", "similarity": round(similarity, 4),
+                                      "matched_query": matched_query}}
+
+    def add(self, query, response, version=None):
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if normalized in self._by_text:
+                self._remove([self._by_text[normalized]])
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (normalized, response)
+            self._by_text[normalized] = entry_id
+            if len(self._entries) > self.max_entries:
+                self._remove(list(self._entries)[:len(self._entries) - self.max_entries])
+
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            normalized, _ = self._entries.pop(entry_id)
+            self._by_text.pop(normalized, None)
+        self._index.remove_ids(np.array(entry_ids, dtype=np.int64))
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._by_text.clear()
+            if self._index is not None:
+                self._index.reset()
+
+    def invalidate_sources(self, stale_sources):
+        with self._lock:
+            stale = [
+                entry_id for entry_id, (_, response) in self._entries.items()
+                if not stale_sources.isdisjoint(response.get("sources", []))
+            ]
+            if stale:
+                self._remove(stale)
+            return len(stale)
+
+    def memory_bytes(self):
+        """Rough bytes held: the question vectors and their ids, plus questions and responses as JSON."""
+        with self._lock:
+            size = sum(len(normalized) + len(json.dumps(response)) for normalized, response in self._entries.values())
+            if self._index is not None:
+                size += self._index.ntotal * (self._index.d * 4 + 8)
+            return size
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "near_misses": self.near_misses,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else None,
+                "mean_hit_similarity": round(self._hit_similarity_sum / hits, 4) if hits else None,
+            }
@@ -0,0 +1,473 @@
+"""Sharded retrieval: the index bundle split across local worker processes.
+
+``split_bundle`` cuts a bundle into ``N`` shard bundles of contiguous chunk
+ranges under ``<bundle>/shards/``, streaming each range out of the bundle's
+files without loading the whole index. Each shard has its own index,
+chunk texts and a BM25 partition that keeps the full corpus's idf and avgdl
+(see ``SparseBM25.partition``), so BM25 scores from different shards are
+directly comparable. ``ShardPool`` runs one worker process per shard; only
+that worker maps the shard's files. ``ShardedRetriever`` embeds the query
+once, scatters it to every shard, and gathers each shard's local candidates
+into the same global top-k a single-process ``HybridRetriever`` would pick.
+The serving process itself opens only the bundle's chunk texts
+(``load_bundle(..., search=False)``).
+
+Workers are started as ``python -m rag.sharding worker ...`` rather than
+with ``multiprocessing``, so they never re-import the server's ``__main__``
+(which would re-open the job store and fail running ingest jobs).
+"""
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import Any
+
+import faiss
+import numpy as np
+from langchain.schema.retriever import BaseRetriever
+
+from rag.ann import ADD_BATCH, build_index
+from rag.bm25 import SparseBM25
+from rag.index_store import (
+    BM25_NAME, BundleWriter, ChunkStore, load_bundle, read_manifest, vector_reader
+)
+from rag.metrics import record_stage, stage
+from rag.retrievers import HybridRetriever
+
+SHARDS_DIR = "shards"
+SHARDS_MANIFEST = "shards.json"
+AUTHKEY_ENV = "SHARD_WORKER_AUTHKEY"
+
+
+def shard_ranges(num_chunks, num_shards):
+    """Contiguous ``(start, end)`` chunk ranges, as even as possible."""
+    bounds = np.linspace(0, num_chunks, num_shards + 1).round().astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def split_bundle(bundle_dir, num_shards, ann=None):
+    """Split ``bundle_dir`` into shard bundles, reusing a split of the same index version.
+
+    Returns ``(shard_dirs, offsets)``. Shard indexes are rebuilt with the
+    kind the main index was built with, from its ``vectors.f32`` read a
+    block at a time; bundles without one have their vectors read back out
+    of the main index, which for PQ/SQ indexes gives approximate vectors.
+    Shards below ``ann["min_vectors"]`` get a flat index.
+    """
+    manifest = read_manifest(bundle_dir)
+    root = os.path.join(os.path.abspath(bundle_dir), SHARDS_DIR)
+    num_shards = max(1, min(num_shards, manifest["num_chunks"]))
+    ranges = shard_ranges(manifest["num_chunks"], num_shards)
+    expected = {"index_version": manifest["index_version"], "ranges": ranges}
+
+    existing = _read_split(root)
+    if existing == expected:
+        return _shard_dirs(root, num_shards), [start for start, _ in ranges]
+
+    print(f"Splitting index version {manifest['index_version']} into {num_shards} shards...")
+    chunks = ChunkStore.open(bundle_dir)
+    bm25 = SparseBM25.load(os.path.join(bundle_dir, BM25_NAME))
+    read_rows = vector_reader(bundle_dir, manifest)
+    kind = manifest["ann"].get("requested", manifest["ann"]["kind"])
+    tmp_root = f"{root}.tmp{os.getpid()}"
+    if os.path.exists(tmp_root):
+        shutil.rmtree(tmp_root)
+    for shard_dir, (start, end) in zip(_shard_dirs(tmp_root, num_shards), ranges):
+        _write_shard(shard_dir, chunks, read_rows, bm25.partition(start, end), start, end, kind, ann,
+                     manifest["embedding_model"])
+    with open(os.path.join(tmp_root, SHARDS_MANIFEST), "w") as f:
+        json.dump(expected, f)
+
+    # Another process may have finished the same split meanwhile.
+    if _read_split(root) == expected:
+        shutil.rmtree(tmp_root)
+    else:
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        os.rename(tmp_root, root)
+    return _shard_dirs(root, num_shards), [start for start, _ in ranges]
+
+
+def _write_shard(shard_dir, chunks, read_rows, bm25, start, end, kind, ann, embedding_model):
+    """Write chunks ``[start, end)`` as a shard bundle, ``ADD_BATCH`` chunks at a time."""
+    writer = BundleWriter(shard_dir)
+    try:
+        for block in range(start, end, ADD_BATCH):
+            stop = min(block + ADD_BATCH, end)
+            # Shards serve no chunk metadata: filters are resolved against the whole bundle's.
+            writer.append(chunks[block:stop], read_rows(block, stop), [(0, -1, None)] * (stop - block))
+        writer.write_index(*build_index(writer.vectors(), kind, ann))
+        writer.write_bm25(bm25)
+        writer.commit(embedding_model)
+    except Exception:
+        writer.abort()
+        raise
+
+
+def _read_split(root):
+    try:
+        with open(os.path.join(root, SHARDS_MANIFEST)) as f:
+            split = json.load(f)
+    except (OSError, ValueError):
+        return None
+    split["ranges"] = [tuple(r) for r in split.get("ranges", [])]
+    return split
+
+
+def _shard_dirs(root, num_shards):
+    return [os.path.join(root, f"{shard:02d}") for shard in range(num_shards)]
+
+
+def shard_candidates(retriever, offset, query_vectors, queries, fetch_k, fusion, nprobe, ef_search, allowed=None):
+    """One shard's local candidates for each query, with chunk ids made global.
+
+    Each result is ``HybridRetriever._candidates`` for the shard plus the
+    candidates' ``texts``, or ``None`` when ``allowed`` (local chunk ids a
+    filter lets through) is empty.
+    """
+    if allowed is not None and not len(allowed):
+        return [None] * len(queries)
+    retriever.fusion, retriever.nprobe, retriever.ef_search = fusion, nprobe, ef_search
+    doc_filter = retriever._doc_filter(allowed)
+    distances, rows = retriever._search(query_vectors, fetch_k, allowed)
+    if len(queries) == 1:
+        bm25_results = [retriever.bm25.score_sparse(queries[0], doc_filter)]
+    else:
+        bm25_results = retriever.bm25.score_batch(queries, doc_filter)
+
+    population = None if allowed is None else len(allowed)
+    results = []
+    for i, (bm25_docs, bm25_scores) in enumerate(bm25_results):
+        vector_ids, vector_sims = retriever._search_hits(rows[i], distances[i])
+        candidates = retriever._candidates(query_vectors[i:i + 1], vector_ids, vector_sims,
+                                           bm25_docs, bm25_scores, fetch_k, population)
+        candidates["texts"] = [retriever.texts[chunk_id] for chunk_id in candidates["ids"].tolist()]
+        for key in ("ids", "vector_ranked", "bm25_ranked"):
+            candidates[key] = candidates[key] + offset
+        results.append(candidates)
+    return results
+
+
+def run_worker(address, shard, shard_dir, offset):
+    """Worker process main loop: serve candidate requests for one shard until told to stop."""
+    import faiss
+    faiss.omp_set_num_threads(1)  # one core per shard; parallelism comes from the shards
+
+    conn = Client(address, authkey=bytes.fromhex(os.environ.pop(AUTHKEY_ENV)))
+    conn.send(shard)
+    try:
+        vectorstore, chunks, bm25, _ = load_bundle(shard_dir, None)
+        retriever = HybridRetriever(vectorstore, chunks, None, bm25=bm25,
+                                    chunk_ids=np.arange(len(chunks), dtype=np.int64))
+    except Exception as e:
+        conn.send(RuntimeError(f"Shard {shard} failed to load {shard_dir}: {e}"))
+        return
+    conn.send(len(chunks))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        request_id, request = message
+        try:
+            reply = shard_candidates(retriever, offset, **request)
+        except Exception as e:
+            reply = RuntimeError(f"Shard {shard}: {e}")
+        conn.send((request_id, reply))
+
+
+class ShardPool:
+    """One worker process per shard bundle.
+
+    Every request is tagged with an id and written to each worker's
+    connection; a reader thread per worker resolves the matching future, so
+    concurrent queries pipeline through the workers instead of taking turns.
+    """
+
+    def __init__(self, shard_dirs, offsets, timeout=30, startup_timeout=300):
+        self.shard_dirs = shard_dirs
+        self.offsets = list(offsets)
+        self.timeout = timeout
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        authkey = os.urandom(16)
+        env = {**os.environ, AUTHKEY_ENV: authkey.hex()}
+        server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        listener = Listener(authkey=authkey)
+        self._processes = [
+            subprocess.Popen(
+                [sys.executable, "-m", "rag.sharding", "worker", listener.address, str(shard), shard_dir,
+                 str(offset)],
+                cwd=server_dir, env=env
+            )
+            for shard, (shard_dir, offset) in enumerate(zip(shard_dirs, offsets))
+        ]
+        try:
+            connections = self._accept(listener, startup_timeout)
+            self._connections = [connections[shard] for shard in range(len(shard_dirs))]
+            self.sizes = [self._ready(conn) for conn in self._connections]
+        except Exception:
+            self._terminate()
+            raise
+        finally:
+            listener.close()
+
+        self.num_chunks = sum(self.sizes)
+        self._send_locks = [threading.Lock() for _ in shard_dirs]
+        for shard, conn in enumerate(self._connections):
+            threading.Thread(target=self._read_replies, args=(shard, conn), daemon=True,
+                             name=f"shard-{shard}").start()
+
+    def _accept(self, listener, startup_timeout):
+        """Accept one connection per worker; a watchdog unblocks ``accept`` if a worker dies first."""
+        connected = threading.Event()
+
+        def watchdog():
+            deadline = time.monotonic() + startup_timeout
+            while not connected.wait(0.5):
+                if time.monotonic() > deadline or any(p.poll() is not None for p in self._processes):
+                    try:
+                        Client(listener.address, authkey=None).close()
+                    except Exception:
+                        pass
+                    return
+
+        threading.Thread(target=watchdog, daemon=True).start()
+        connections = {}
+        try:
+            while len(connections) < len(self._processes):
+                try:
+                    conn = listener.accept()
+                    shard = conn.recv()
+                except Exception:
+                    raise RuntimeError("A shard worker exited or timed out during startup.") from None
+                connections[shard] = conn
+        finally:
+            connected.set()
+        return connections
+
+    @staticmethod
+    def _ready(conn):
+        reply = conn.recv()  # sent once the shard is loaded
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _read_replies(self, shard, conn):
+        while True:
+            try:
+                request_id, reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop((request_id, shard), None)
+            if future is None:
+                continue
+            if isinstance(reply, Exception):
+                future.set_exception(reply)
+            else:
+                future.set_result(reply)
+
+        # The worker is gone: fail whatever was still waiting on it.
+        with self._lock:
+            orphaned = [key for key in self._pending if key[1] == shard]
+            futures = [self._pending.pop(key) for key in orphaned]
+        for future in futures:
+            future.set_exception(RuntimeError(f"Shard worker {shard} exited."))
+
+    def candidates(self, per_shard=None, **request):
+        """Send ``request`` to every shard; returns the shards' replies in shard order.
+
+        ``per_shard``, if given, holds one dict of extra arguments per shard.
+        """
+        request_id = next(self._ids)
+        futures = []
+        for shard, conn in enumerate(self._connections):
+            future = Future()
+            with self._lock:
+                self._pending[(request_id, shard)] = future
+            with self._send_locks[shard]:
+                conn.send((request_id, {**request, **per_shard[shard]} if per_shard else request))
+            futures.append(future)
+        return [future.result(timeout=self.timeout) for future in futures]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for shard, conn in enumerate(self._connections):
+            try:
+                with self._send_locks[shard]:
+                    conn.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for conn in self._connections:
+            conn.close()
+
+    def _terminate(self):
+        for process in self._processes:
+            process.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def open_shards(bundle_dir, num_shards, ann=None, timeout=30, drain_seconds=30):
+    """Split ``bundle_dir`` if needed and start a ``ShardPool`` over it.
+
+    The pool this replaces is closed ``drain_seconds`` later, once queries
+    still running on the previous chain are done with it.
+    """
+    global _pool
+    shard_dirs, offsets = split_bundle(bundle_dir, num_shards, ann)
+    pool = ShardPool(shard_dirs, offsets, timeout=timeout)
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    if previous is not None:
+        timer = threading.Timer(drain_seconds, previous.close)
+        timer.daemon = True
+        timer.start()
+    return pool
+
+
+def _best(ranked_lists, scores, k):
+    """The ``k`` highest-scoring ids over several ranked lists, best first (lower id first on ties)."""
+    ids = np.concatenate(ranked_lists)
+    order = np.lexsort((ids, -np.array([scores[chunk_id] for chunk_id in ids.tolist()])))[:k]
+    return ids[order]
+
+
+class ShardedRetriever(HybridRetriever):
+    """``HybridRetriever`` whose chunks, FAISS rows and BM25 postings live in a ``ShardPool``.
+
+    Each shard returns the union of its local top ``fetch_k`` from each
+    source with both raw scores. The global top ``fetch_k`` of a source is
+    the best ``fetch_k`` of those local lists, so every global candidate
+    arrives with its scores and fusion, reranking and options behave exactly
+    as in a single process.
+    """
+
+    shards: Any = None
+
+    def __init__(self, shards, embeddings, **kwargs):
+        BaseRetriever.__init__(self, vectorstore=None, texts=None, embeddings=embeddings, shards=shards, **kwargs)
+
+    def get_relevant_documents(self, query, k=None, **kwargs):
+        k = k or self.k
+        start = time.perf_counter()
+        fetch_k = self._pool_size(k)
+        allowed = self._allowed_ids()
+        if allowed is not None and not len(allowed):
+            return []
+        with stage("embed"):
+            query_vector = self._embed_query(query)
+        docs = self._gather(query_vector, [query], fetch_k, fetch_k if self._reranking() else k, allowed)[0]
+        deadline = start + self.latency_budget if self.latency_budget is not None else None
+        return self._rerank(query, docs, k, deadline)
+
+    def get_relevant_documents_batch(self, queries, k=None, timings=None):
+        """Like ``HybridRetriever.get_relevant_documents_batch``, with one scatter for the whole batch.
+
+        ``timings`` reports the shards' search and BM25 work together as
+        ``shards_seconds``.
+        """
+        if not queries:
+            return []
+        k = k or self.k
+        fetch_k = self._pool_size(k)
+        allowed = self._allowed_ids()
+        if allowed is not None and not len(allowed):
+            return [[] for _ in queries]
+        start = time.perf_counter()
+        query_vectors = self._embed_queries(queries)
+        embedded = time.perf_counter()
+        record_stage("batch_embed", embedded - start)
+        results = self._gather(query_vectors, queries, fetch_k, fetch_k if self._reranking() else k, allowed,
+                               timings, "batch_")
+        fused = time.perf_counter()
+        if self._reranking():
+            results = [self._rerank(query, docs, k) for query, docs in zip(queries, results)]
+            record_stage("batch_rerank", time.perf_counter() - fused)
+        if timings is not None:
+            timings.update(embed_seconds=round(embedded - start, 4),
+                           rerank_seconds=round(time.perf_counter() - fused, 4))
+        return results
+
+    def _gather(self, query_vectors, queries, fetch_k, limit, allowed=None, timings=None, stage_prefix=""):
+        start = time.perf_counter()
+        per_shard = None
+        if allowed is not None:
+            # Each shard gets the allowed ids in its own range, renumbered from 0.
+            per_shard = []
+            for offset, size in zip(self.shards.offsets, self.shards.sizes):
+                lo, hi = np.searchsorted(allowed, [offset, offset + size])
+                per_shard.append({"allowed": allowed[lo:hi] - offset})
+        replies = self.shards.candidates(per_shard, query_vectors=query_vectors, queries=list(queries),
+                                         fetch_k=fetch_k, fusion=self.fusion, nprobe=self.nprobe,
+                                         ef_search=self.ef_search)
+        gathered = time.perf_counter()
+        results = []
+        for i in range(len(queries)):
+            parts = [reply[i] for reply in replies if reply[i] is not None]
+            if not parts:
+                results.append([])
+                continue
+            candidates, texts = self._merge(parts, fetch_k)
+            results.append(self._top_documents(candidates, limit, texts.__getitem__))
+        fused = time.perf_counter()
+        record_stage(f"{stage_prefix}shards", gathered - start)
+        record_stage(f"{stage_prefix}fusion", fused - gathered)
+        if timings is not None:
+            timings.update(shards_seconds=round(gathered - start, 4),
+                           fusion_seconds=round(fused - gathered, 4))
+        return results
+
+    @staticmethod
+    def _merge(parts, fetch_k):
+        """Global candidates and their texts from every shard's local candidates."""
+        vector, bm25, texts = {}, {}, {}
+        for part in parts:
+            ids = part["ids"].tolist()
+            vector.update(zip(ids, part["vector"].tolist()))
+            bm25.update(zip(ids, part["bm25"].tolist()))
+            texts.update(zip(ids, part["texts"]))
+
+        vector_ranked = _best([part["vector_ranked"] for part in parts], vector, fetch_k)
+        bm25_ranked = _best([part["bm25_ranked"] for part in parts], bm25, fetch_k)
+        ids = list(dict.fromkeys(vector_ranked.tolist() + bm25_ranked.tolist()))
+        lows, highs = zip(*(part["bm25_range"] for part in parts))
+        candidates = {
+            "ids": np.array(ids, dtype=np.int64),
+            "vector": np.array([vector[chunk_id] for chunk_id in ids], dtype=np.float32),
+            "bm25": np.array([bm25[chunk_id] for chunk_id in ids]),
+            "vector_ranked": vector_ranked,
+            "bm25_ranked": bm25_ranked,
+            # Shards without a hit still have zero-score documents, so 0 stays in range.
+            "bm25_range": (min(lows), max(highs)),
+        }
+        return candidates, texts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 6 or sys.argv[1] != "worker":
+        print("usage: python -m rag.sharding worker <address> <shard> <shard_dir> <offset>")
+        sys.exit(2)
+    run_worker(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))
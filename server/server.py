@@ -1,5 +1,6 @@
 import os
 import pickle
+from typing import Any
 import shutil
 import numpy as np
 from flask import Flask, request, jsonify
@@ -17,12 +18,11 @@ from langchain.globals import set_llm_cache
 from langchain.schema import Document
 from langchain.schema.retriever import BaseRetriever
 from rank_bm25 import BM25Okapi
-import hashlib
-import json
 
-# --- ADD THIS LINE FOR CPU STABILITY ---
-os.environ["OMP_NUM_THREADS"] = "1"
-# ---------------------------------------
+from utils.cache import QueryCache
+
+# Thread count for torch/OpenMP; set EMBEDDING_THREADS=1 if CPU inference is unstable.
+os.environ.setdefault("OMP_NUM_THREADS", os.environ.get("EMBEDDING_THREADS", str(os.cpu_count() or 1)))
 
 load_dotenv()
 set_llm_cache(InMemoryCache())
@@ -34,7 +34,7 @@ CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"])
 
 UPLOAD_DIR = "uploaded_files"
 VECTORSTORE_PATH = "vectorstore.pkl"
-CACHE_PATH = "query_cache.json"
+CACHE_PATH = "query_cache.sqlite"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
@@ -42,93 +42,141 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 rag_chain = None
 text_chunks = []
 vectorstore = None
+query_cache = QueryCache(max_entries=1024, ttl_seconds=24 * 3600, path=CACHE_PATH)
 
 
 class HybridRetriever(BaseRetriever):
     """Custom retriever combining vector search and BM25."""
-    
-    def __init__(self, vectorstore, texts, embeddings):
-        super().__init__()
-        self.vectorstore = vectorstore
+
+    vectorstore: Any
+    texts: Any
+    embeddings: Any
+    bm25: Any = None
+    chunk_ids: Any = None
+    chunk_rows: Any = None
+    fusion: str = "weighted"
+    vector_weight: float = 0.7
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, vectorstore, texts, embeddings, fusion="weighted", **kwargs):
+        super().__init__(vectorstore=vectorstore, texts=texts, embeddings=embeddings, fusion=fusion, **kwargs)
         self.bm25 = BM25Okapi([text.split() for text in texts])
-        self.texts = texts
-        self.embeddings = embeddings
-    
+        self.chunk_ids = self._build_id_index()
+        self.chunk_rows = np.full(len(texts), -1, dtype=np.int64)
+        mapped = np.flatnonzero(self.chunk_ids >= 0)
+        self.chunk_rows[self.chunk_ids[mapped]] = mapped
+
+    def _build_id_index(self):
+        """Map FAISS row positions to chunk ids once, so ranking never compares strings."""
+        position = {}
+        for idx, text in enumerate(self.texts):
+            position.setdefault(text, idx)
+
+        chunk_ids = np.full(self.vectorstore.index.ntotal, -1, dtype=np.int64)
+        for row, doc_id in self.vectorstore.index_to_docstore_id.items():
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                chunk_ids[row] = position.get(doc.page_content, -1)
+        return chunk_ids
+
     def _get_relevant_documents(self, query: str):
         """Get documents relevant to a query."""
         return self.get_relevant_documents(query, k=3)
-    
+
     async def _aget_relevant_documents(self, query: str):
         """Async version - not implemented."""
         return self._get_relevant_documents(query)
-    
-    def get_relevant_documents(self, query, k=3):
-        # Vector similarity search
-        vector_docs = self.vectorstore.similarity_search(query, k=k*2)
-        
-        # BM25 search
-        bm25_scores = self.bm25.get_scores(query.split())
-        bm25_indices = np.argsort(bm25_scores)[::-1][:k*2]
-        
-        # Combine and re-rank
-        all_docs = []
-        doc_set = set()
-        
-        # Add vector results
-        for doc in vector_docs:
-            if doc.page_content not in doc_set:
-                all_docs.append((doc, 'vector'))
-                doc_set.add(doc.page_content)
-        
-        # Add BM25 results
-        for idx in bm25_indices:
-            if idx < len(self.texts) and self.texts[idx] not in doc_set:
-                doc = Document(page_content=self.texts[idx])
-                all_docs.append((doc, 'bm25'))
-                doc_set.add(self.texts[idx])
-        
-        # Re-rank by hybrid score
-        scored_docs = []
-        for doc, source in all_docs:
-            vector_score = 0.5
-            bm25_score = 0.5
-            
-            if source == 'vector':
-                vector_score = 1.0
-            if doc.page_content in self.texts:
-                text_idx = self.texts.index(doc.page_content)
-                raw_bm25_scores = self.bm25.get_scores(query.split())
-                bm25_score = raw_bm25_scores[text_idx]
-                # Normalize BM25 score
-                min_score = np.min(raw_bm25_scores)
-                max_score = np.max(raw_bm25_scores)
-                if max_score - min_score > 1e-8:
-                    bm25_score = (bm25_score - min_score) / (max_score - min_score)
-                else:
-                    bm25_score = 0.5
-            
-            hybrid_score = 0.7 * vector_score + 0.3 * bm25_score
-            scored_docs.append((doc, hybrid_score))
-        
-        # Sort by hybrid score and return top k
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
-        return [doc for doc, score in scored_docs[:k]]
-
-
-def load_cache():
-    if os.path.exists(CACHE_PATH):
-        with open(CACHE_PATH, 'r') as f:
-            return json.load(f)
-    return {}
 
+    def _embed_query(self, query):
+        vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            vector /= max(np.linalg.norm(vector), 1e-12)
+        return vector
+
+    def _vector_search(self, query_vector, fetch_k):
+        """Return (chunk ids, cosine similarities) for the nearest FAISS rows."""
+        distances, rows = self.vectorstore.index.search(query_vector, fetch_k)
+        rows, distances = rows[0], distances[0]
+        keep = rows >= 0
+        ids = self.chunk_ids[rows[keep]]
+        sims = self._distance_to_similarity(distances[keep])
+        found = ids >= 0
+        return ids[found], sims[found]
+
+    def _distance_to_similarity(self, distances):
+        # MiniLM vectors are unit length, so squared L2 maps straight onto cosine.
+        return np.clip(1.0 - distances / 2.0, 0.0, 1.0)
+
+    def _vector_scores_for(self, query_vector, ids):
+        """Score chunks that only BM25 surfaced against the query vector."""
+        scores = np.zeros(len(ids), dtype=np.float32)
+        for i, chunk_id in enumerate(ids):
+            row = int(self.chunk_rows[chunk_id])
+            if row < 0:
+                continue
+            try:
+                vector = self.vectorstore.index.reconstruct(row)
+            except RuntimeError:
+                continue
+            distance = float(np.sum((vector - query_vector[0]) ** 2))
+            scores[i] = self._distance_to_similarity(distance)
+        return scores
 
-def save_cache(cache):
-    with open(CACHE_PATH, 'w') as f:
-        json.dump(cache, f)
-
+    def get_relevant_documents(self, query, k=3, **kwargs):
+        fetch_k = k * 2
+        query_vector = self._embed_query(query)
+        vector_ids, vector_sims = self._vector_search(query_vector, fetch_k)
 
-def get_cache_key(query):
-    return hashlib.md5(query.encode()).hexdigest()
+        # Score BM25 once per query and normalise once.
+        bm25_scores = self.bm25.get_scores(query.split())
+        top = min(fetch_k, len(bm25_scores))
+        bm25_ids = np.argpartition(-bm25_scores, top - 1)[:top] if top else np.array([], dtype=np.int64)
+        bm25_ids = bm25_ids[np.argsort(-bm25_scores[bm25_ids], kind="stable")]
+
+        candidates = list(dict.fromkeys([int(i) for i in vector_ids] + [int(i) for i in bm25_ids]))
+        if not candidates:
+            return []
+
+        if self.fusion == "rrf":
+            scores = self._rrf_scores(candidates, vector_ids, bm25_ids)
+        else:
+            scores = self._weighted_scores(candidates, query_vector, vector_ids, vector_sims, bm25_scores)
+
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:k]
+        return [
+            Document(page_content=self.texts[candidates[i]],
+                     metadata={"chunk_id": candidates[i], "score": float(scores[i])})
+            for i in order
+        ]
+
+    def _weighted_scores(self, candidates, query_vector, vector_ids, vector_sims, bm25_scores):
+        candidates = np.asarray(candidates, dtype=np.int64)
+
+        vector_score = dict(zip(vector_ids.tolist(), vector_sims.tolist()))
+        missing = [c for c in candidates.tolist() if c not in vector_score]
+        if missing:
+            vector_score.update(zip(missing, self._vector_scores_for(query_vector, missing).tolist()))
+        vec = np.array([vector_score[c] for c in candidates.tolist()], dtype=np.float32)
+
+        min_score = np.min(bm25_scores)
+        max_score = np.max(bm25_scores)
+        if max_score - min_score > 1e-8:
+            lex = (bm25_scores[candidates] - min_score) / (max_score - min_score)
+        else:
+            lex = np.full(len(candidates), 0.5)
+
+        return self.vector_weight * vec + (1.0 - self.vector_weight) * lex
+
+    def _rrf_scores(self, candidates, vector_ids, bm25_ids):
+        """Reciprocal-rank fusion: sum of 1 / (rrf_k + rank) over each ranked list."""
+        scores = dict.fromkeys(candidates, 0.0)
+        for ranked in (vector_ids, bm25_ids):
+            for rank, chunk_id in enumerate(ranked.tolist(), start=1):
+                scores[chunk_id] += 1.0 / (self.rrf_k + rank)
+        return [scores[c] for c in candidates]
 
 
 def process_and_store_documents(upload_dir, vectorstore_path="vectorstore.pkl"):
@@ -307,9 +355,8 @@ def upload_files():
         groq_api_key = os.environ.get("GROQ_API_KEY")
         rag_chain = create_rag_pipeline(vectorstore, text_chunks, embeddings, groq_api_key)
         
-        # Clear cache when new documents are uploaded
-        if os.path.exists(CACHE_PATH):
-            os.remove(CACHE_PATH)
+        # New documents make every cached answer stale
+        query_cache.bump_version()
         
         return jsonify({
             "message": f"{successful_uploads} files uploaded and processed successfully.",
@@ -332,12 +379,11 @@ def query_endpoint():
         return jsonify({"error": "Query text is required."}), 400
     
     # Check cache
-    cache = load_cache()
-    cache_key = get_cache_key(query_text)
-    if cache_key in cache:
-        print("Returning cached response")
-        return jsonify(cache[cache_key])
+    cached = query_cache.get(query_text)
+    if cached is not None:
+        return jsonify(cached)
         
+    cache_version = query_cache.version
     try:
         result = rag_chain({"query": query_text})
         response = {
@@ -346,8 +392,7 @@ def query_endpoint():
         }
         
         # Cache the response
-        cache[cache_key] = response
-        save_cache(cache)
+        query_cache.set(query_text, response, version=cache_version)
         
         return jsonify(response)
     except Exception as e:
@@ -362,7 +407,8 @@ def health_check():
         "status": "healthy",
         "rag_initialized": rag_chain is not None,
         "vectorstore_exists": os.path.exists(VECTORSTORE_PATH),
-        "chunks_loaded": len(text_chunks)
+        "chunks_loaded": len(text_chunks),
+        "cache": query_cache.stats()
     })
 
 
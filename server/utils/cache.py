@@ -1,17 +1,145 @@
-import os
-import json
 import hashlib
-from config import CACHE_PATH
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 
-def load_cache():
-    if os.path.exists(CACHE_PATH):
-        with open(CACHE_PATH, 'r') as f:
-            return json.load(f)
-    return {}
+def get_cache_key(query):
+    return hashlib.md5(query.encode()).hexdigest()
 
-def save_cache(cache):
-    with open(CACHE_PATH, 'w') as f:
-        json.dump(cache, f)
+class QueryCache:
+    """Bounded, thread-safe LRU of query responses with a TTL.
 
-def get_cache_key(query):
-    return hashlib.md5(query.encode()).hexdigest()
\ No newline at end of file
+    Keys are ``"<version>:<md5 of query>"``. A full re-index calls
+    ``bump_version`` so every older answer stops matching instead of the
+    cache file being deleted; incremental ingests use ``invalidate_sources``.
+
+    With ``path`` set, entries are also written through to SQLite (WAL mode,
+    one row per answer) and the newest ``max_entries`` still-valid rows are
+    read back once at startup.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version INTEGER, created_at REAL, value TEXT)"
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        self.version = row[0] if row else 0
+
+        rows = self._conn.execute(
+            "SELECT key, created_at, value FROM entries WHERE version = ? AND created_at > ? "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.version, time.time() - self.ttl_seconds, self.max_entries)
+        ).fetchall()
+        for key, created_at, value in reversed(rows):
+            self._entries[key] = (created_at, json.loads(value))
+
+    def _key(self, query):
+        return f"{self.version}:{get_cache_key(query)}"
+
+    def get(self, query):
+        with self._lock:
+            key = self._key(query)
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, query, response, version=None):
+        """Cache ``response``. Pass the ``version`` read before computing it so an
+        answer from an index that was swapped out meanwhile is dropped."""
+        now = time.time()
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            key = self._key(query)
+            self._entries[key] = (now, response)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += len(evicted)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                        (key, self.version, now, json.dumps(response))
+                    )
+                    self._conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in evicted])
+
+    def bump_version(self):
+        """Make every cached answer stale, e.g. after a full re-index."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+                    self._conn.execute("DELETE FROM entries WHERE version < ?", (self.version,))
+            return self.version
+
+    def invalidate_sources(self, stale_sources):
+        """Drop cached answers whose sources include any of ``stale_sources``."""
+        with self._lock:
+            stale_keys = [
+                key for key, (_, response) in self._entries.items()
+                if not stale_sources.isdisjoint(response.get("sources", []))
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+            if self._conn is not None:
+                # Rows not resident in memory may be stale too.
+                rows = self._conn.execute("SELECT key, value FROM entries").fetchall()
+                stale_rows = [
+                    (key,) for key, value in rows
+                    if not stale_sources.isdisjoint(json.loads(value).get("sources", []))
+                ]
+                with self._conn:
+                    self._conn.executemany("DELETE FROM entries WHERE key = ?", stale_rows)
+            return len(stale_keys)
+
+    def memory_bytes(self):
+        """Rough bytes held: the cached responses as JSON, plus SQLite's page cache limit when persisted."""
+        with self._lock:
+            size = sum(len(json.dumps(response)) for _, response in self._entries.values())
+            if self._conn is not None:
+                pages = self._conn.execute("PRAGMA cache_size").fetchone()[0]
+                # A negative cache_size is a limit in KiB rather than pages.
+                size += -pages * 1024 if pages < 0 else pages * self._conn.execute("PRAGMA page_size").fetchone()[0]
+            return size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -1,7 +1,103 @@
 import os
-os.environ["OMP_NUM_THREADS"] = "1"
 
 UPLOAD_DIR = "uploaded_files"
-VECTORSTORE_PATH = "vectorstore.pkl"
-CACHE_PATH = "query_cache.json"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
\ No newline at end of file
+STAGING_DIR = "upload_staging"
+JOBS_DB_PATH = "jobs.sqlite"
+VECTORSTORE_PATH = "vectorstore.pkl"  # legacy pickle, migrated to INDEX_DIR on startup
+INDEX_DIR = "index"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CACHE_PATH = "query_cache.sqlite"
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 24 * 3600
+SEMANTIC_CACHE = {
+    "enabled": True,
+    "threshold": float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92)),  # cosine similarity
+    "max_entries": 2048,
+}
+BM25_COMPAT = False  # str.split() tokens, scores identical to rank_bm25.BM25Okapi
+EXTRACTION = {
+    "workers": int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1)),
+    "pages_per_task": 16,
+    "timeout": 120,  # seconds per file
+}
+DEDUP = {  # rag/dedup.py, at ingest
+    "enabled": os.environ.get("DEDUP", "1") == "1",  # store exact and near-duplicate chunks once
+    # SimHash bits (of 64) near-duplicate chunks may differ in; 0 merges exact copies only. 3 is about a
+    # word changed per 1000 characters, but a merge keeps the first wording seen, so a re-issued policy's
+    # changed clause could be lost (chunks whose numbers differ are never merged).
+    "max_distance": int(os.environ.get("DEDUP_MAX_DISTANCE", 0)),
+    "strip_boilerplate": os.environ.get("STRIP_BOILERPLATE", "1") == "1",  # repeated page headers and footers
+    "sample_pages": 16,  # pages of each document its headers and footers are learned from
+}
+EMBEDDING = {
+    "batch_size": int(os.environ.get("EMBEDDING_BATCH_SIZE", 64)),
+    "threads": int(os.environ.get("EMBEDDING_THREADS", os.cpu_count() or 1)),
+    "cache_path": "embedding_cache.sqlite",
+    "query_cache_size": 4096,  # LRU of normalised question -> vector; 0 turns it off
+    # Misses arriving while a forward pass runs share the next one; a window also holds the first miss.
+    "query_batch_window_ms": float(os.environ.get("QUERY_BATCH_WINDOW_MS", 0)),
+    "query_max_batch": 64,
+}
+RERANK = {
+    "enabled": os.environ.get("RERANK", "0") == "1",
+    "model": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    "candidates": 12,  # merged pool the cross-encoder picks k from
+    "k": 3,
+    "latency_budget_ms": float(os.environ.get("RERANK_BUDGET_MS", 300)),  # retrieval + rerank
+    "batch_size": 32,
+    "cache_size": 20000,  # (query, chunk) scores
+    "max_candidates": 50,  # upper bound for per-request k / candidates
+}
+ANN = {  # FAISS index built at ingest; see rag/ann.py
+    "kind": os.environ.get("ANN_INDEX", "flat"),  # flat | ivf | hnsw | ivfpq | sq
+    "nlist": None,  # IVF lists, default ~4*sqrt(chunks)
+    "nprobe": int(os.environ.get("ANN_NPROBE", 16)),  # IVF lists searched per query
+    "hnsw_m": 32,
+    "ef_construction": 80,
+    "ef_search": int(os.environ.get("ANN_EF_SEARCH", 64)),
+    "pq_m": 48,  # PQ sub-quantizers; 384 dims / 48 = 8 dims each
+    "train_size": 100000,  # vectors sampled for IVF/PQ/SQ training
+    "min_vectors": 10000,  # smaller corpora always get a flat index
+}
+CONTEXT = {  # packing of retrieved chunks into the llama3-8b-8192 prompt
+    "max_tokens": int(os.environ.get("CONTEXT_MAX_TOKENS", 1500)),
+    "max_overlap_chars": 300,  # longer than the splitter's 150-character overlap
+}
+BATCH_QUERY = {
+    "max_queries": 1000,
+    "fanout": int(os.environ.get("LLM_FANOUT", 8)),  # concurrent LLM calls per batch
+    "max_fanout": 32,
+}
+COLLECTIONS = {  # rag/collection_manager.py; /collections/<name>/... routes
+    "dir": "collections",
+    # Counted memory of the collections kept loaded (bundle files, per-chunk arrays, answer caches;
+    # see rag/collection_manager.py); least recently used ones are dropped past this.
+    "memory_budget_mb": float(os.environ.get("COLLECTIONS_MEMORY_MB", 2048)),
+}
+SHARDING = {  # rag/sharding.py, for the default index only
+    "shards": int(os.environ.get("INDEX_SHARDS", 1)),  # worker processes; 1 retrieves in-process
+    "timeout_seconds": 30,  # per scatter-gather
+    "drain_seconds": 30,  # the previous pool stays up this long after a re-ingest
+}
+STARTUP = {
+    # Load the embedding model and open the index at import, before a pre-forking server
+    # (gunicorn --preload) forks its workers, so they share both copy-on-write rather than each
+    # loading its own. Otherwise they load in the background in every worker; memory-mapped
+    # bundle files (flat vectors, IVF lists) are shared through the page cache either way.
+    "preload_models": os.environ.get("PRELOAD_MODELS", "0") == "1",
+}
+METRICS = {  # rag/metrics.py, served at GET /metrics
+    "timing_header": os.environ.get("TIMING_HEADER", "0") == "1",  # Server-Timing on query responses
+}
+ASYNC_SERVING = {  # asgi.py only
+    "max_in_flight": int(os.environ.get("MAX_IN_FLIGHT_QUERIES", 256)),
+    "max_waiting": int(os.environ.get("MAX_WAITING_QUERIES", 512)),  # beyond this, 503
+    "max_wait_seconds": float(os.environ.get("MAX_QUERY_WAIT_SECONDS", 30)),
+    "cpu_workers": int(os.environ.get("RETRIEVAL_WORKERS", os.cpu_count() or 1)),  # FAISS/BM25/embedding threads
+    "llm_max_connections": int(os.environ.get("LLM_MAX_CONNECTIONS", 100)),
+    "llm_timeout": float(os.environ.get("LLM_TIMEOUT_SECONDS", 60)),
+}
+# Must be set before torch is imported; EMBEDDING_THREADS=1 restores the old pinning.
+os.environ.setdefault("OMP_NUM_THREADS", str(EMBEDDING["threads"]))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(STAGING_DIR, exist_ok=True)
\ No newline at end of file
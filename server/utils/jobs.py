@@ -0,0 +1,137 @@
+import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class JobStore:
+    """Persistent job table in SQLite so job status survives a restart."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, created_at REAL, updated_at REAL, "
+            "progress TEXT, result TEXT, error TEXT)"
+        )
+        # Anything still queued or running belonged to a process that is gone. A multiprocessing
+        # child, such as a PDF extraction worker importing the server's main module, leaves them be.
+        if multiprocessing.current_process().name != "MainProcess":
+            return
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart.', updated_at = ? "
+                "WHERE status IN ('queued', 'running')", (time.time(),)
+            )
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs VALUES (?, 'queued', ?, ?, '{}', NULL, NULL)", (job_id, now, now)
+            )
+        return job_id
+
+    def update(self, job_id, status=None, progress=None, result=None, error=None):
+        fields = {"updated_at": time.time()}
+        if status is not None:
+            fields["status"] = status
+        if progress is not None:
+            fields["progress"] = json.dumps(progress)
+        if result is not None:
+            fields["result"] = json.dumps(result)
+        if error is not None:
+            fields["error"] = error
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, created_at, updated_at, progress, result, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "created_at": row[2],
+            "updated_at": row[3],
+            "progress": json.loads(row[4] or "{}"),
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+        }
+
+
+class ProgressTracker:
+    """Turns ``progress(stage, done, total)`` callbacks into job-table updates with an ETA.
+
+    Each stage's ETA runs from when that stage was first reported, so stages
+    that interleave (a streaming ingest embeds between files) keep their own
+    clocks. A count reported without a total (streamed embedding, whose
+    chunk count isn't known up front) takes its ETA from the files parsed.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.state = {"stage": "queued"}
+        self._started = {}
+
+    def _eta(self, stage, done, total):
+        if not done or not total:
+            return None
+        elapsed = time.monotonic() - self._started[stage]
+        return round(elapsed / done * (total - done), 1)
+
+    def __call__(self, stage, done=None, total=None):
+        self._started.setdefault(stage, time.monotonic())
+        self.state["stage"] = stage
+        if stage == "extract":
+            self.state["files_parsed"], self.state["files_total"] = done, total
+        elif stage == "embed":
+            self.state["chunks_embedded"], self.state["chunks_total"] = done, total
+
+        eta = self._eta(stage, done, total)
+        if done is not None and total is None and "extract" in self._started:
+            eta = self._eta("extract", self.state.get("files_parsed"), self.state.get("files_total"))
+        self.state["eta_seconds"] = eta
+        self.store.update(self.job_id, progress=dict(self.state))
+
+
+class JobRunner:
+    """Runs ingest jobs one at a time on a background thread.
+
+    A single worker keeps ingests from racing on the upload directory and the
+    index bundle; later uploads simply queue.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(progress, *args, **kwargs)``; its return value becomes the job result."""
+        job_id = self.store.create()
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        tracker = ProgressTracker(self.store, job_id)
+        self.store.update(job_id, status="running")
+        try:
+            result = fn(tracker, *args, **kwargs)
+        except Exception as e:
+            print(f"Error in job {job_id}: {traceback.format_exc()}")
+            self.store.update(job_id, status="failed", error=str(e))
+        else:
+            tracker.state.update(stage="done", eta_seconds=0)
+            self.store.update(job_id, status="succeeded", progress=tracker.state, result=result)